@@ -0,0 +1,348 @@
+"""
+ Benchmark for writing articles
+
+ Compares the compiled ojs_builder.write_article against building each
+ article as an Element and writing it with XMLStreamWriter.element, both
+ with the current ojs_builder.build_article and with the hand-unrolled
+ TreeBuilder version it replaced (legacy_build_article below). Reports
+ articles per second for each and checks that they all write the same XML.
+
+ Usage:
+    python benchmarks/bench_article.py [--articles 20000] [--authors 5]
+                                       [--repeat 3]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ojs_builder import build_article, write_article
+from ojs_writer import EmbeddedFile, XMLStreamWriter
+
+# The legacy builder reads exactly five author columns.
+LEGACY_AUTHORS = 5
+
+
+def synthetic_articles(article_count, author_count):
+    """
+    Parameters:
+        article_count (int): Number of articles to generate.
+        author_count (int): Number of authors per article; columns up to
+                            LEGACY_AUTHORS are always present, left empty
+                            when unused.
+
+    Returns:
+        list: Article dictionaries ready for build_article.
+    """
+    articles = []
+    for number in range(1, article_count + 1):
+        article = {"file_number": str(number),
+                   "submission_stage": "submission",
+                   "revision_number": "1",
+                   "fileGenre1": "Article Text",
+                   "file1": "article%d.pdf" % number,
+                   "uploader": "admin",
+                   "bucket_location": "http://bucket.s3.amazonaws.com/pdf/",
+                   "issueDatepublished": "1975-04-01",
+                   "seq": str(number % 20),
+                   "sectionAbbrev": "ART",
+                   "title": "Article %d & \"friends\" <draft>" % number,
+                   "abstract": "An abstract\r\nover two lines " * 4,
+                   "keywords": "organ;theatre;wurlitzer",
+                   "pages": "%d-%d" % (number, number + 3)}
+        for author in range(1, max(author_count, LEGACY_AUTHORS) + 1):
+            used = author <= author_count
+            suffix = str(author)
+            article["authorGivenname" + suffix] = "Given" + suffix if used else ""
+            article["authorFamilyname" + suffix] = "Family" + suffix if used else ""
+            article["authorAffiliation" + suffix] = "University" if used else ""
+            article["authorEmail" + suffix] = "a%s@example.org" % suffix if used else ""
+        articles.append(article)
+    return articles
+
+
+def legacy_build_article(children):
+    """
+    build_article as it was before ARTICLE_SCHEMA, kept as the reference
+    the compiled writer is measured and checked against.
+
+    Parameters:
+    children (dict): A Dictionary containing section key,value pairs for OJS
+    import. When it holds a pdf_folder the PDF is embedded in the revision
+    as base64, otherwise the revision links to bucket_location.
+
+    Returns:
+    Element: XML Element Object containing OJS Article. An embedded PDF is
+    left as an EmbeddedFile so it is only encoded while being written out by
+    ojs_writer.XMLStreamWriter.
+    """
+
+    TREE_BUILDER = ElementTree.TreeBuilder()
+    TREE_BUILDER.start("article", {"status": "3", "current_publication_id": children['file_number'], "stage": "production"})
+    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
+    TREE_BUILDER.data(children["file_number"])
+    TREE_BUILDER.end("id")
+    TREE_BUILDER.start("submission_file", {
+        "stage": children['submission_stage'],
+        "id": children['file_number']
+    })
+    TREE_BUILDER.start("revision", {
+        "number": children['revision_number'],
+        "genre": children['fileGenre1'],
+        "filename": children['file1'],
+        "viewable": "true",
+        "filetype": "application/pdf",
+        "uploader": children['uploader']
+    })
+    TREE_BUILDER.start("name", {"locale": "en_US"})
+    TREE_BUILDER.data(children['file1'])
+    TREE_BUILDER.end("name")
+    # generate_xml_embedded.py sets pdf_folder to embed the PDF itself in
+    # the XML, the other drivers set bucket_location to link to it.
+    if 'pdf_folder' in children:
+        TREE_BUILDER.start("embed", {"encoding": "base64"})
+        TREE_BUILDER.end("embed")
+    else:
+        TREE_BUILDER.start("href", {
+            "src": children['bucket_location'] + children['file1'],
+            "mime_type": "application/pdf"
+        })
+        TREE_BUILDER.end("href")
+    TREE_BUILDER.end("revision")
+    TREE_BUILDER.end("submission_file")
+    TREE_BUILDER.start("publication", {
+        "locale": "en_US",
+        "version": "1",
+        "status": "3",
+        "date_published": children['issueDatepublished'],
+        "seq": children['seq'],
+        "section_ref": children['sectionAbbrev']
+    })
+    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
+    TREE_BUILDER.data(children['file_number'])
+    TREE_BUILDER.end("id")
+    TREE_BUILDER.start("title", {})
+    TREE_BUILDER.data(children['title'])
+    TREE_BUILDER.end("title")
+    TREE_BUILDER.start("abstract", {})
+    TREE_BUILDER.data(children['abstract'])
+    TREE_BUILDER.end("abstract")
+    # Subject/Keywords are separated by a ';' in the spreadsheet therefore
+    # parse it
+    if 'keywords' in children:
+        TREE_BUILDER.start('keywords', {})
+        for keyword in children['keywords'].split(';'):
+            TREE_BUILDER.start('keyword', {})
+            TREE_BUILDER.data(keyword)
+            TREE_BUILDER.end("keyword")
+        TREE_BUILDER.end("keywords")
+    elif 'keywords' in children:
+        TREE_BUILDER.start('keywords', {})
+        for keyword in children['keywords'].split(';'):
+            TREE_BUILDER.start('subject', {})
+            TREE_BUILDER.data(keyword)
+            TREE_BUILDER.end("subject")
+        TREE_BUILDER.end("subjects")
+    else:
+        TREE_BUILDER.start("subjects", {})
+        TREE_BUILDER.start("subject", {})
+        TREE_BUILDER.end("subject")
+        TREE_BUILDER.end("subjects")
+    TREE_BUILDER.start("authors", {})
+    TREE_BUILDER.start("author", {
+        "include_in_browse": "true",
+        "user_group_ref": "Author",
+        "seq": "1",
+        "id": "1"
+        })
+    TREE_BUILDER.start("givenname", {"locale":"en_US"})
+    TREE_BUILDER.data(children['authorGivenname1'])
+    TREE_BUILDER.end("givenname")
+    TREE_BUILDER.start("familyname", {"locale":"en_US"})
+    TREE_BUILDER.data(children['authorFamilyname1'])
+    TREE_BUILDER.end("familyname")
+    TREE_BUILDER.start("affiliation", {})
+    TREE_BUILDER.data(children['authorAffiliation1'])
+    TREE_BUILDER.end("affiliation")
+    TREE_BUILDER.start("email", {})
+    TREE_BUILDER.data(children['authorEmail1'])
+    TREE_BUILDER.end("email")
+    TREE_BUILDER.end("author")
+    if children['authorGivenname2'] != '':
+        TREE_BUILDER.start("author", {
+            "user_group_ref": "Author",
+            "seq": "2",
+            "id": "2"
+            })
+        TREE_BUILDER.start("givenname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorGivenname2'])
+        TREE_BUILDER.end("givenname")
+        TREE_BUILDER.start("familyname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorFamilyname2'])
+        TREE_BUILDER.end("familyname")
+        TREE_BUILDER.start("affiliation", {})
+        TREE_BUILDER.data(children['authorAffiliation2'])
+        TREE_BUILDER.end("affiliation")
+        TREE_BUILDER.start("email", {})
+        TREE_BUILDER.data(children['authorEmail2'])
+        TREE_BUILDER.end("email")
+        TREE_BUILDER.end("author")
+    if children['authorGivenname3'] != '':
+        TREE_BUILDER.start("author", {
+            "user_group_ref": "Author",
+            "seq": "3",
+            "id": "3"
+            })
+        TREE_BUILDER.start("givenname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorGivenname3'])
+        TREE_BUILDER.end("givenname")
+        TREE_BUILDER.start("familyname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorFamilyname3'])
+        TREE_BUILDER.end("familyname")
+        TREE_BUILDER.start("affiliation", {})
+        TREE_BUILDER.data(children['authorAffiliation3'])
+        TREE_BUILDER.end("affiliation")
+        TREE_BUILDER.start("email", {})
+        TREE_BUILDER.data(children['authorEmail3'])
+        TREE_BUILDER.end("email")
+        TREE_BUILDER.end("author")
+    if children['authorGivenname4'] != '':
+        TREE_BUILDER.start("author", {
+            "user_group_ref": "Author",
+            "seq": "4",
+            "id": "4"
+            })
+        TREE_BUILDER.start("givenname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorGivenname4'])
+        TREE_BUILDER.end("givenname")
+        TREE_BUILDER.start("familyname", {"locale":"en_US"})
+        TREE_BUILDER.data(children['authorFamilyname4'])
+        TREE_BUILDER.end("familyname")
+        TREE_BUILDER.start("affiliation", {})
+        TREE_BUILDER.data(children['authorAffiliation4'])
+        TREE_BUILDER.end("affiliation")
+        TREE_BUILDER.start("email", {})
+        TREE_BUILDER.data(children['authorEmail4'])
+        TREE_BUILDER.end("email")
+        TREE_BUILDER.end("author")
+    if children['authorGivenname5'] != '':
+        TREE_BUILDER.start("author", {
+            "user_group_ref": "Author",
+            "seq": "5",
+            "id": "5"
+        })
+        TREE_BUILDER.start("givenname", {"locale": "en_US"})
+        TREE_BUILDER.data(children['authorGivenname5'])
+        TREE_BUILDER.end("givenname")
+        TREE_BUILDER.start("familyname", {"locale": "en_US"})
+        TREE_BUILDER.data(children['authorFamilyname5'])
+        TREE_BUILDER.end("familyname")
+        TREE_BUILDER.start("affiliation", {})
+        TREE_BUILDER.data(children['authorAffiliation5'])
+        TREE_BUILDER.end("affiliation")
+        TREE_BUILDER.start("email", {})
+        TREE_BUILDER.data(children['authorEmail5'])
+        TREE_BUILDER.end("email")
+        TREE_BUILDER.end("author")
+    TREE_BUILDER.end("authors")
+    TREE_BUILDER.start("article_galley", {
+        "locale": "en_US",
+        "approved": "false"
+    })
+    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
+    TREE_BUILDER.data(children['file_number'])
+    TREE_BUILDER.end("id")
+    TREE_BUILDER.start("name", {"locale": "en_US"})
+    TREE_BUILDER.data("PDF")
+    TREE_BUILDER.end("name")
+    TREE_BUILDER.start("seq", {})
+    TREE_BUILDER.data(children['seq'])
+    TREE_BUILDER.end("seq")
+    TREE_BUILDER.start("submission_file_ref", {
+        "id": children['file_number'],
+        "revision": "1"
+    })
+    TREE_BUILDER.end("submission_file_ref")
+    TREE_BUILDER.end("article_galley")
+    TREE_BUILDER.start("pages", {})
+    TREE_BUILDER.data(children['pages'])
+    TREE_BUILDER.end("pages")
+    TREE_BUILDER.end("publication")
+    TREE_BUILDER.end("article")
+    article = TREE_BUILDER.close()
+    if 'pdf_folder' in children:
+        article.find("submission_file/revision/embed").text = EmbeddedFile(
+            os.path.join(children['pdf_folder'], children['file1']))
+    return article
+
+
+def write_elements(build, articles):
+    output = io.StringIO()
+    writer = XMLStreamWriter(output)
+    writer.start("articles", {})
+    for article in articles:
+        writer.element(build(article))
+    writer.end("articles")
+    return output.getvalue()
+
+
+def write_compiled(articles):
+    output = io.StringIO()
+    writer = XMLStreamWriter(output)
+    writer.start("articles", {})
+    for article in articles:
+        write_article(writer, article)
+    writer.end("articles")
+    return output.getvalue()
+
+
+def best_time(function, repeat):
+    """
+    Returns:
+        tuple: (fastest seconds over repeat runs, result of the last run)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--authors", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    articles = synthetic_articles(args.articles, args.authors)
+    candidates = [("write_article", lambda: write_compiled(articles)),
+                  ("build_article", lambda: write_elements(build_article,
+                                                           articles))]
+    if args.authors <= LEGACY_AUTHORS:
+        candidates.append(("legacy_build_article",
+                           lambda: write_elements(legacy_build_article,
+                                                  articles)))
+
+    outputs = {}
+    print("%22s %10s %14s" % ("writer", "seconds", "articles/s"))
+    for name, function in candidates:
+        seconds, outputs[name] = best_time(function, args.repeat)
+        print("%22s %10.3f %14.0f" % (name, seconds, args.articles / seconds))
+    reference = outputs["write_article"]
+    for name, output in outputs.items():
+        if output != reference:
+            sys.exit("%s wrote different XML than write_article" % name)
+    print("All writers produced identical XML (%d bytes)" % len(reference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+ Benchmark for compressed output files
+
+ Renders a synthetic import.csv (see generate_csv.py) to conversion files
+ on disk, uncompressed and through ojs_compression with each codec and
+ level, and reports the size of the output and the write throughput in MB
+ of uncompressed XML per second. Covers are random bytes of a typical JPEG
+ size, which like real JPEGs do not compress beyond undoing base64.
+
+ Usage:
+    python benchmarks/bench_compression.py [--rows 20000] [--issues 200]
+                                           [--authors 3] [--no-covers]
+                                           [--codecs none gzip:1 gzip:6 zstd:3]
+"""
+
+import argparse
+import base64
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import generate_csv
+from ojs_batching import plan_batches
+from ojs_compression import CompressedWriter, compressed_name, get_codec
+from ojs_pipeline import write_batch
+from ojs_reader import index_issues, number_articles, read_records
+
+
+def cover_payloads(issues):
+    """
+    Returns:
+        dict: base64 cover of a typical size keyed by issueCover.
+    """
+    payloads = {}
+    for issue in issues.values():
+        cover = issue['issueCover']
+        if cover and cover not in payloads:
+            generator = random.Random(cover)
+            payloads[cover] = str(base64.b64encode(generator.randbytes(
+                generator.randint(40 * 1024, 160 * 1024))), "ascii")
+    return payloads
+
+
+def render(directory, codec_spec, batches, issues, sections, articles,
+           issue_identifiers, covers):
+    """
+    Returns:
+        tuple: (bytes on disk, bytes of XML, seconds)
+    """
+    name, _, level = codec_spec.partition(":")
+    codec = get_codec(None if name == "none" else name)
+    stored = xml = 0
+    start = time.perf_counter()
+    for number, batch in enumerate(batches, 1):
+        path = os.path.join(directory, compressed_name(
+            "conversion%d.xml" % number, codec and codec.name))
+        if codec is None:
+            with open(path, "w", encoding="utf-8") as output:
+                write_batch(output, batch, issues, sections, articles,
+                            issue_identifiers, covers)
+                xml += output.tell()
+        else:
+            with CompressedWriter(open(path, "wb"), codec,
+                                  int(level) if level else None) as output:
+                write_batch(output, batch, issues, sections, articles,
+                            issue_identifiers, covers)
+            xml += output.uncompressed_bytes
+        stored += os.path.getsize(path)
+        os.remove(path)
+    return stored, xml, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--issues", type=int, default=200)
+    parser.add_argument("--authors", type=int, default=3)
+    parser.add_argument("--no-covers", action="store_true")
+    parser.add_argument("--codecs", nargs="+",
+                        default=["none", "gzip:1", "gzip:6", "gzip:9",
+                                 "zstd:3", "zstd:19"],
+                        help="codec:level pairs, none for uncompressed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.csv")
+        generate_csv.write_csv(path, args.rows, args.issues, args.authors,
+                               not args.no_covers)
+        with open(path, encoding="utf-8-sig") as input_file:
+            issues, sections, articles = index_issues(read_records(
+                input_file,
+                {'bucket_location': "http://mybucket.s3.amazonaws.com/pdf/"}))
+        issue_identifiers = number_articles(issues, articles)
+        batches = plan_batches(issues, sections, articles)
+        covers = cover_payloads(issues)
+
+        print("%10s %12s %8s %10s %10s" % ("codec", "bytes", "ratio",
+                                           "seconds", "XML MB/s"))
+        for codec_spec in args.codecs:
+            try:
+                stored, xml, seconds = render(
+                    directory, codec_spec, batches, issues, sections,
+                    articles, issue_identifiers, covers)
+            except ValueError as error:
+                print("%10s %s" % (codec_spec, error))
+                continue
+            print("%10s %12d %8.3f %10.3f %10.1f" % (
+                codec_spec, stored, stored / xml, seconds,
+                xml / 1024 / 1024 / seconds))
+
+
+if __name__ == "__main__":
+    main()
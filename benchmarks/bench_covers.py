@@ -0,0 +1,105 @@
+"""
+ Benchmark for cover normalization
+
+ Makes scanned-looking covers of several sizes, a large high quality JPEG,
+ a PNG and an uncompressed TIFF, normalizes them with ojs_images in the
+ calling thread and in a pool of processes, and reports the bytes of
+ base64 embedded per cover before and after, and the covers normalized per
+ second. Needs the Pillow package.
+
+ Usage:
+    python benchmarks/bench_covers.py [--covers 32] [--max-dimension 1600]
+                                      [--quality 85] [--processes N]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ojs_images import CoverNormalizer, Image, normalize_image
+
+
+def make_cover(number):
+    """
+    Returns:
+        bytes: A cover image of a few thousand pixels a side, blurred
+               shapes standing in for a scanned cover.
+    """
+    from PIL import ImageDraw, ImageFilter  # pylint: disable=import-outside-toplevel
+    generator = random.Random(number)
+    width = generator.randint(2000, 3200)
+    image = Image.new("RGB", (width, width * 4 // 3), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        left = generator.randint(0, width)
+        top = generator.randint(0, width * 4 // 3)
+        draw.ellipse([left, top, left + generator.randint(40, 500),
+                      top + generator.randint(40, 500)],
+                     fill=tuple(generator.randint(0, 255) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    output = io.BytesIO()
+    image_format = ("JPEG", "PNG", "TIFF")[number % 3]
+    if image_format == "JPEG":
+        image.save(output, image_format, quality=97)
+    else:
+        image.save(output, image_format)
+    return output.getvalue()
+
+
+def run(normalizer, covers):
+    """
+    Returns:
+        tuple: (seconds, base64 bytes before, base64 bytes after)
+    """
+    start = time.perf_counter()
+    if normalizer.executor is None:
+        results = [normalizer.normalize(str(number), cover)
+                   for number, cover in enumerate(covers)]
+    else:
+        # The download threads of CoverFetcher submit covers concurrently.
+        futures = [normalizer.executor.submit(
+            normalize_image, cover, normalizer.max_dimension,
+            normalizer.quality) for cover in covers]
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - start
+    before = sum(-(-len(cover) // 3) * 4 for cover in covers)
+    after = sum(-(-len(result) // 3) * 4 for result in results)
+    return seconds, before, after
+
+
+def main():
+    """
+    Benchmark entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--covers", type=int, default=32)
+    parser.add_argument("--max-dimension", type=int, default=1600)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    if Image is None:
+        sys.exit("bench_covers.py needs the Pillow package")
+
+    covers = [make_cover(number) for number in range(args.covers)]
+    print("%12s %14s %14s %8s %10s" % ("processes", "base64 before",
+                                       "base64 after", "seconds",
+                                       "covers/s"))
+    for processes in (0, args.processes):
+        normalizer = CoverNormalizer(args.max_dimension, args.quality,
+                                     processes=processes)
+        try:
+            seconds, before, after = run(normalizer, covers)
+        finally:
+            normalizer.close()
+        print("%12d %14d %14d %8.2f %10.1f" % (
+            processes, before, after, seconds, len(covers) / seconds))
+
+
+if __name__ == "__main__":
+    main()
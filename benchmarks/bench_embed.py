@@ -0,0 +1,101 @@
+"""
+ Benchmark for embedding PDFs in the XML
+
+ Writes a <revision> element embedding a large file through
+ ojs_writer.XMLStreamWriter and reports throughput and peak memory. Each
+ measurement runs in its own process so peak RSS is not carried over. The
+ --naive flag also measures reading and encoding the whole file in memory
+ for comparison.
+
+ Usage:
+    python benchmarks/bench_embed.py [--sizes 100 300 600] [--naive]
+"""
+
+import argparse
+import base64
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ojs_writer import EmbeddedFile, XMLStreamWriter  # pylint: disable=wrong-import-position
+
+MEGABYTE = 1024 * 1024
+
+
+def make_pdf(path, megabytes):
+    """
+    Write a file of the given size filled with random bytes.
+    """
+    block = os.urandom(MEGABYTE)
+    with open(path, "wb") as pdf:
+        for _ in range(megabytes):
+            pdf.write(block)
+
+
+def peak_rss_megabytes():
+    """
+    Returns:
+        float: Peak resident set size of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def streamed(path):
+    with open(os.devnull, "w", encoding="ascii") as output:
+        writer = XMLStreamWriter(output)
+        writer.start("revision", {})
+        writer.start("embed", {"encoding": "base64"})
+        writer.data(EmbeddedFile(path))
+        writer.end("embed")
+        writer.end("revision")
+
+
+def naive(path):
+    with open(path, "rb") as pdf, \
+            open(os.devnull, "w", encoding="ascii") as output:
+        output.write(str(base64.b64encode(pdf.read()), "ascii"))
+
+
+def measure(mode, path, results):
+    baseline = peak_rss_megabytes()
+    start = time.perf_counter()
+    {"streamed": streamed, "naive": naive}[mode](path)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, baseline, peak_rss_megabytes()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 600],
+                        help="PDF sizes in MB")
+    parser.add_argument("--naive", action="store_true",
+                        help="also measure in-memory encoding")
+    args = parser.parse_args()
+
+    modes = ["streamed"] + (["naive"] if args.naive else [])
+    print("%8s %9s %8s %8s %14s" % ("size MB", "mode", "seconds", "MB/s",
+                                    "peak RSS +MB"))
+    with tempfile.TemporaryDirectory() as directory:
+        for megabytes in args.sizes:
+            path = os.path.join(directory, "article.pdf")
+            make_pdf(path, megabytes)
+            for mode in modes:
+                results = multiprocessing.Queue()
+                process = multiprocessing.Process(target=measure,
+                                                  args=(mode, path, results))
+                process.start()
+                elapsed, baseline, peak = results.get()
+                process.join()
+                print("%8d %9s %8.2f %8.1f %14.1f" % (
+                    megabytes, mode, elapsed, megabytes / elapsed,
+                    peak - baseline))
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
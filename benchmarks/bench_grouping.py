@@ -0,0 +1,115 @@
+"""
+ Benchmark for the CSV grouping stage
+
+ Compares the single pass ojs_reader.index_issues against the nested
+ issues x rows scan the drivers used before, over synthetic rows of growing
+ size. index_issues time per row should stay flat as the row count grows
+ (linear scaling), while the nested scan grows with the number of issues.
+
+ Usage:
+    python benchmarks/bench_grouping.py [--rows 1000 10000 100000]
+                                        [--rows-per-issue 50] [--skip-nested]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ojs_reader import index_issues  # pylint: disable=wrong-import-position
+
+
+def synthetic_rows(row_count, rows_per_issue):
+    """
+    Parameters:
+        row_count (int): Number of rows to generate.
+        rows_per_issue (int): Number of consecutive rows sharing an issue.
+
+    Returns:
+        generator: Dictionaries shaped like csv.DictReader rows.
+    """
+    for number in range(row_count):
+        issue = number // rows_per_issue
+        yield {"issueTitle": "Issue " + str(issue),
+               "issueYear": "1975",
+               "issueVolume": str(issue),
+               "issueNumber": "1",
+               "issueDatepublished": "1975-04-01",
+               "issueCover": "",
+               "sectionTitle": "Articles",
+               "sectionAbbrev": "ART",
+               "title": "Article " + str(number)}
+
+
+def nested_scan(rows):
+    """
+    The issues x rows grouping previously copy-pasted in the drivers.
+
+    Parameters:
+        rows (iterable): CSV row dictionaries.
+
+    Returns:
+        tuple: (issues, sections, articles) like index_issues.
+    """
+    import_list = list(rows)
+    issues = {}
+    sections = {}
+    articles = {}
+    for import_dict in import_list:
+        if import_dict['issueTitle'] not in issues:
+            issues[import_dict['issueTitle']] = {
+                "issueYear": import_dict['issueYear'],
+                "issueVolume": import_dict['issueVolume'],
+                "issueNumber": import_dict['issueNumber'],
+                "issueDatepublished": import_dict['issueDatepublished'],
+                "issueTitle": import_dict['issueTitle'],
+                "issueCover": import_dict['issueCover']}
+    for issue_title in issues:
+        sections[issue_title] = []
+        articles[issue_title] = []
+        for import_row in import_list:
+            if import_row['issueTitle'] == issue_title:
+                sections[issue_title].append({
+                    "sectionTitle": import_row['sectionTitle'],
+                    "sectionAbbrev": import_row['sectionAbbrev']})
+                articles[issue_title].append(import_row)
+    return issues, sections, articles
+
+
+def time_grouping(group, row_count, rows_per_issue):
+    """
+    Returns:
+        float: Seconds taken by group() over freshly generated rows.
+    """
+    rows = list(synthetic_rows(row_count, rows_per_issue))
+    start = time.perf_counter()
+    group(iter(rows))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--rows-per-issue", type=int, default=50)
+    parser.add_argument("--skip-nested", action="store_true",
+                        help="only time index_issues")
+    args = parser.parse_args()
+
+    print("%10s %8s %14s %14s %14s" % ("rows", "issues", "index_issues s",
+                                       "us/row", "nested scan s"))
+    for row_count in args.rows:
+        indexed = time_grouping(index_issues, row_count, args.rows_per_issue)
+        nested = "-"
+        if not args.skip_nested:
+            nested = "%.3f" % time_grouping(nested_scan, row_count,
+                                            args.rows_per_issue)
+        print("%10d %8d %14.3f %14.2f %14s" % (
+            row_count, -(-row_count // args.rows_per_issue), indexed,
+            indexed / row_count * 1e6, nested))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+ Benchmark suite for the whole conversion pipeline
+
+ Generates a synthetic import.csv (see generate_csv.py), serves its covers
+ from a local HTTP server standing in for the cover bucket, and runs the
+ conversion stage by stage. Each stage reports wall time, rows per second
+ and the peak resident memory reached while it ran. Results are printed as
+ a table and written as JSON so runs of different versions can be compared.
+
+ Stages:
+    parse: ojs_reader.read_records over the CSV file
+    group: ojs_reader.index_issues
+    prepare: ojs_reader.number_articles, as done by the drivers
+    plan: ojs_batching.plan_batches
+    covers: downloading and encoding every cover through CoverFetcher
+    build: the ojs_builder build_* calls, building every Element
+    render: building, serializing and pretty-printing every output file into
+            a byte counter. These are a single streaming step since
+            ojs_writer, so they are measured together.
+    write: ojs_pipeline.write_batches to files on disk, which renders again,
+           so write minus render is the cost of the file I/O
+
+ Peak memory per stage uses the Linux VmHWM counter, reset before each stage
+ through /proc/self/clear_refs. Elsewhere the process-wide peak so far is
+ reported instead.
+
+ Usage:
+    python benchmarks/bench_pipeline.py [--rows 1000 100000] [--issues 100]
+                                        [--authors 3] [--no-covers]
+                                        [--workers 1] [--output results.json]
+"""
+
+import argparse
+import datetime
+import functools
+import http.server
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import generate_csv
+from ojs_batching import plan_batches
+from ojs_builder import (build_article,
+                         build_cover,
+                         build_date_published,
+                         build_identification,
+                         build_issue_galleys,
+                         build_issue_id,
+                         build_sections)
+from ojs_covers import CoverFetcher
+from ojs_pipeline import write_batch, write_batches
+from ojs_reader import index_issues, number_articles, read_records
+
+STAGES = ("parse", "group", "prepare", "plan", "covers", "build", "render",
+          "write")
+
+
+class ByteCounter:
+    """
+    Text sink counting the UTF-8 bytes written to it.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8"))
+        return len(text)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_covers(directory):
+    """
+    Parameters:
+        directory (str): Directory holding the cover files.
+
+    Returns:
+        ThreadingHTTPServer: Server on a free local port, already serving.
+    """
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_peak_memory():
+    """
+    Returns:
+        bool: Whether the peak resident memory counter could be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as refs:
+            refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_megabytes():
+    """
+    Returns:
+        float: Peak resident memory in MB since the last reset.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stages:
+    """
+    Times each stage and records its peak memory.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.results = {}
+
+    def run(self, name, function, *args):
+        reset = reset_peak_memory()
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        self.results[name] = {
+            "seconds": round(seconds, 6),
+            "rows_per_second": round(self.rows / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(peak_memory_megabytes(), 1),
+            "peak_is_per_stage": reset}
+        return result
+
+
+def run_benchmark(rows, issues, authors, covers, workers, directory):
+    """
+    Returns:
+        dict: Results of each stage plus the total bytes written.
+    """
+    csv_path = os.path.join(directory, "import.csv")
+    covers_dir = os.path.join(directory, "covers")
+    output_dir = os.path.join(directory, "output")
+    os.makedirs(output_dir)
+    generate_csv.write_csv(csv_path, rows, issues, authors, covers)
+    if covers:
+        generate_csv.write_covers(covers_dir, max(1, min(issues, rows)))
+    else:
+        os.makedirs(covers_dir)
+    server = serve_covers(covers_dir)
+    base_url = "http://127.0.0.1:%d/" % server.server_address[1]
+
+    stages = Stages(rows)
+    try:
+        def parse():
+            with open(csv_path, encoding="utf-8-sig") as input_file:
+                return list(read_records(
+                    input_file,
+                    {'bucket_location': "http://mybucket.s3.amazonaws.com/pdf/"}))
+        parsed = stages.run("parse", parse)
+        issue_map, sections, articles = stages.run("group", index_issues,
+                                                   parsed)
+        del parsed
+        issue_identifiers = stages.run("prepare", number_articles, issue_map,
+                                       articles)
+        batches = stages.run("plan", plan_batches, issue_map, sections,
+                             articles)
+
+        def fetch_covers():
+            fetcher = CoverFetcher(base_url)
+            fetcher.prefetch(issue['issueCover']
+                             for issue in issue_map.values())
+            payloads = {issue['issueCover']: fetcher.get(issue['issueCover'])
+                        for issue in issue_map.values()
+                        if issue['issueCover'] != ''}
+            fetcher.close()
+            return payloads
+        cover_payloads = stages.run("covers", fetch_covers)
+
+        def build():
+            for issue_key, issue_metadata in issue_map.items():
+                build_issue_id(issue_identifiers[issue_key])
+                build_identification(issue_metadata)
+                build_date_published(issue_metadata)
+                build_sections(sections[issue_key])
+                if issue_metadata['issueCover'] != '':
+                    build_cover(issue_metadata,
+                                cover_payloads[issue_metadata['issueCover']])
+                build_issue_galleys()
+                for article in articles[issue_key]:
+                    build_article(article)
+        stages.run("build", build)
+
+        def render():
+            counter = ByteCounter()
+            for batch in batches:
+                write_batch(counter, batch, issue_map, sections, articles,
+                            issue_identifiers, cover_payloads)
+            return counter.bytes
+        output_bytes = stages.run("render", render)
+
+        def write():
+            return list(write_batches(
+                batches,
+                [os.path.join(output_dir, "conversion%d.xml" % number)
+                 for number in range(1, len(batches) + 1)],
+                issue_map, sections, articles, issue_identifiers,
+                cover_payloads, workers))
+        stages.run("write", write)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {"rows": rows,
+            "issues": len(issue_map),
+            "output_files": len(batches),
+            "output_bytes": output_bytes,
+            "stages": stages.results}
+
+
+def version():
+    """
+    Returns:
+        str: git commit of the converter being measured, if known.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True,
+            capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--issues", type=int, default=100)
+    parser.add_argument("--authors", type=int, default=3)
+    parser.add_argument("--no-covers", action="store_true")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used by the write stage")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    report = {"version": version(),
+              "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "parameters": {"issues": args.issues, "authors": args.authors,
+                             "covers": not args.no_covers,
+                             "workers": args.workers},
+              "runs": []}
+    for rows in args.rows:
+        directory = tempfile.mkdtemp(prefix="ojs_bench_")
+        try:
+            run = run_benchmark(rows, args.issues, args.authors,
+                                not args.no_covers, args.workers, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        report["runs"].append(run)
+
+        print("%d rows, %d issues, %d files, %d bytes" % (
+            rows, run["issues"], run["output_files"], run["output_bytes"]))
+        print("%10s %10s %14s %12s" % ("stage", "seconds", "rows/s",
+                                       "peak MB"))
+        for name in STAGES:
+            stage = run["stages"][name]
+            print("%10s %10.3f %14.0f %12.1f" % (
+                name, stage["seconds"], stage["rows_per_second"] or 0,
+                stage["peak_rss_mb"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
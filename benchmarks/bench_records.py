@@ -0,0 +1,107 @@
+"""
+ Benchmark for the memory taken by parsed CSV rows
+
+ Compares ojs_reader.read_records against the csv.DictReader dictionaries
+ the drivers used to keep, with the article defaults added to each of
+ them, over a synthetic CSV (see generate_csv.py). Reports the memory
+ retained per row, measured with tracemalloc, and the parse time.
+
+ Usage:
+    python benchmarks/bench_records.py [--rows 100000] [--issues 1000]
+                                       [--authors 3]
+"""
+
+import argparse
+import csv
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import generate_csv
+from ojs_reader import read_records
+
+BUCKET_LOCATION = "http://mybucket.s3.amazonaws.com/pdf/"
+
+
+def dict_rows(input_file):
+    """
+    The rows as the drivers kept them before ArticleRecord: one DictReader
+    dictionary per row, with the defaults added to every row.
+    """
+    rows = []
+    for file_number, row in enumerate(csv.DictReader(input_file), 1):
+        for number in range(1, 6):
+            row.setdefault('authorEmail' + str(number), '')
+        row.setdefault('submission_stage', 'submission')
+        row.setdefault('revision_number', "1")
+        if row['fileGenre1'] == '':
+            row['fileGenre1'] = 'Article Text'
+        if not row['authorFamilyname1']:
+            row['authorFamilyname1'] = "Unknown"
+        if not row['authorGivenname1']:
+            row['authorGivenname1'] = "Unknown"
+        row['bucket_location'] = BUCKET_LOCATION
+        row['file_number'] = str(file_number)
+        rows.append(row)
+    return rows
+
+
+def record_rows(input_file):
+    rows = []
+    for file_number, record in enumerate(
+            read_records(input_file, {'bucket_location': BUCKET_LOCATION}), 1):
+        record.file_number = str(file_number)
+        rows.append(record)
+    return rows
+
+
+def measure(parse, path):
+    """
+    Returns:
+        tuple: (bytes retained by the parsed rows, seconds, row count)
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, encoding="utf-8-sig") as input_file:
+        rows = parse(input_file)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    row_count = len(rows)
+    del rows
+    return retained, elapsed, row_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--issues", type=int, default=1000)
+    parser.add_argument("--authors", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.csv")
+        generate_csv.write_csv(path, args.rows, args.issues, args.authors)
+        print("%14s %14s %10s %10s" % ("rows as", "bytes/row", "MB", "seconds"))
+        results = {}
+        for name, parse in (("DictReader", dict_rows),
+                            ("ArticleRecord", record_rows)):
+            retained, elapsed, row_count = measure(parse, path)
+            results[name] = retained / row_count
+            print("%14s %14.0f %10.1f %10.3f" % (
+                name, retained / row_count, retained / 1024 / 1024, elapsed))
+        print("ArticleRecord rows take %.1fx less memory"
+              % (results["DictReader"] / results["ArticleRecord"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+ Benchmark for the long-running conversion service
+
+ Generates a synthetic import.csv (see generate_csv.py) and serves its
+ covers from a local HTTP server standing in for the cover bucket, then
+ converts it a number of times: once per run of convert_journals.py, each
+ paying for interpreter start-up, imports and new pools, and as jobs
+ submitted to one ojs_service.ConversionService, which keeps them warm.
+ Reports the latency of each conversion and the total time.
+
+ Usage:
+    python benchmarks/bench_service.py [--conversions 10] [--rows 1000]
+                                       [--issues 10] [--workers 2]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import generate_csv
+from bench_pipeline import serve_covers
+from ojs_service import ConversionService
+
+
+def run_cold(csv_path, output, conversions, workers, cover_base_url):
+    """
+    Returns:
+        list: Seconds of each convert_journals.py run.
+    """
+    latencies = []
+    for conversion in range(conversions):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, "convert_journals.py"),
+             csv_path, "--output", os.path.join(output, str(conversion)),
+             "--workers", str(workers), "--cover-base-url", cover_base_url],
+            check=True, stdout=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_warm(csv_path, output, conversions, workers, cover_base_url):
+    """
+    Returns:
+        tuple: Seconds of each job from submission to completion, and
+               seconds taken to start the service.
+    """
+    start = time.perf_counter()
+    with ConversionService({"cover_base_url": cover_base_url}, output,
+                           jobs=1, workers=workers) as service:
+        started = time.perf_counter() - start
+        latencies = []
+        for conversion in range(conversions):
+            job = service.submit(csv_path, str(conversion))
+            service.join()
+            latencies.append(service.job(job["id"])["latency_seconds"])
+    return latencies, started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversions", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--issues", type=int, default=10)
+    parser.add_argument("--authors", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="ojs_bench_")
+    try:
+        csv_path = os.path.join(directory, "import.csv")
+        covers_dir = os.path.join(directory, "covers")
+        generate_csv.write_csv(csv_path, args.rows, args.issues, args.authors)
+        generate_csv.write_covers(covers_dir, args.issues)
+        server = serve_covers(covers_dir)
+        cover_base_url = "http://127.0.0.1:%d/" % server.server_address[1]
+
+        cold = run_cold(csv_path, os.path.join(directory, "cold"),
+                        args.conversions, args.workers, cover_base_url)
+        warm, started = run_warm(csv_path, os.path.join(directory, "warm"),
+                                 args.conversions, args.workers,
+                                 cover_base_url)
+        server.shutdown()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print("%d conversions of %d rows, %d workers" % (
+        args.conversions, args.rows, args.workers))
+    print("%22s %10s %10s %10s %10s" % ("", "first", "mean", "max",
+                                         "total"))
+    for name, latencies, extra in (("convert_journals.py", cold, 0.0),
+                                   ("ConversionService", warm, started)):
+        print("%22s %10.3f %10.3f %10.3f %10.3f" % (
+            name, latencies[0], sum(latencies) / len(latencies),
+            max(latencies), sum(latencies) + extra))
+    print("Starting the service took %.3fs, included in its total" % started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+ Benchmark for the validation pre-pass
+
+ Generates a synthetic import.csv (see generate_csv.py), optionally with
+ errors planted in every Nth row, reads it into records and times
+ ojs_validation.validate_records over them. Validation runs on every upload
+ before anything is converted, so it has to stay a small fraction of the
+ time taken to read the CSV.
+
+ Usage:
+    python benchmarks/bench_validation.py [--rows 1000000] [--issues 10000]
+                                          [--authors 1] [--errors 1000]
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import generate_csv
+from ojs_reader import read_records
+from ojs_validation import ERROR, validate_records
+
+
+def planted_rows(rows, issues, authors, errors):
+    """
+    Returns:
+        generator: Synthetic rows, every errors-th row of which has an
+                   invalid date, a duplicate seq or a volume differing from
+                   the rest of its issue in turn.
+    """
+    for number, row in enumerate(generate_csv.synthetic_rows(
+            rows, issues, authors)):
+        if errors and number % errors == errors - 1:
+            kind = number // errors % 3
+            if kind == 0:
+                row["issueDatepublished"] = row["issueDatepublished"].replace(
+                    "-", "/")
+            elif kind == 1:
+                row["seq"] = "1"
+            else:
+                row["issueVolume"] = str(int(row["issueVolume"]) + 1)
+        yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--issues", type=int, default=10000)
+    parser.add_argument("--authors", type=int, default=1)
+    parser.add_argument("--errors", type=int, default=0,
+                        help="plant an error in every Nth row, 0 for none")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.csv")
+        with open(path, "w", newline="", encoding="utf-8") as output:
+            writer = csv.DictWriter(output, generate_csv.columns(args.authors),
+                                    restval="")
+            writer.writeheader()
+            writer.writerows(planted_rows(args.rows, args.issues,
+                                          args.authors, args.errors))
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        with open(path, encoding="utf-8-sig") as input_file:
+            records = list(read_records(input_file))
+        read_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        problems = validate_records(records)
+        validate_seconds = time.perf_counter() - start
+
+    errors = sum(problem.severity == ERROR for problem in problems)
+    print("%d rows, %d issues, %.1f MB CSV" % (
+        len(records), args.issues, size / 1024 / 1024))
+    print("%10s %10s %14s" % ("step", "seconds", "rows/s"))
+    print("%10s %10.3f %14.0f" % ("read", read_seconds,
+                                  len(records) / read_seconds))
+    print("%10s %10.3f %14.0f" % ("validate", validate_seconds,
+                                  len(records) / validate_seconds))
+    print("%d error(s), %d warning(s) covering %d rows" % (
+        errors, len(problems) - errors,
+        sum(len(problem.rows) for problem in problems)))
+
+
+if __name__ == "__main__":
+    main()
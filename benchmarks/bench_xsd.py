@@ -0,0 +1,123 @@
+"""
+ Benchmark for schema validation of the conversion files
+
+ Writes a conversion file of one issue with many articles, each embedding a
+ PDF, then checks it against the schema with ojs_xsd, which checks one
+ article at a time, and by parsing the whole file and validating the tree.
+ Each check runs in a fresh process and reports its time and peak memory.
+ Needs the lxml package.
+
+ Usage:
+    python benchmarks/bench_xsd.py [--articles 300] [--pdf-size 1000000]
+"""
+
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ojs_xsd import etree, load_schema, validate_file
+
+ARTICLE = """\
+			<article stage="production">
+				<id type="internal" advice="ignore">%(number)d</id>
+				<submission_file stage="proof" id="%(number)d">
+					<revision number="1" genre="Article Text" filename="%(number)d.pdf" filetype="application/pdf" uploader="admin">
+						<name locale="en_US">%(number)d.pdf</name>
+						<embed encoding="base64">%(pdf)s</embed>
+					</revision>
+				</submission_file>
+				<publication locale="en_US" version="1" status="3" seq="%(number)d" section_ref="ART" access_status="0">
+					<id type="internal" advice="ignore">%(number)d</id>
+					<title locale="en_US">Article %(number)d</title>
+					<authors>
+						<author include_in_browse="true" user_group_ref="Author">
+							<givenname locale="en_US">A.</givenname>
+							<familyname locale="en_US">Author</familyname>
+							<email/>
+						</author>
+					</authors>
+					<article_galley locale="en_US" approved="false">
+						<name locale="en_US">PDF</name>
+						<seq>0</seq>
+						<submission_file_ref id="%(number)d" revision="1"/>
+					</article_galley>
+					<pages>1-10</pages>
+				</publication>
+			</article>
+"""
+
+
+def write_file(path, articles, pdf_size):
+    """
+    Write a conversion file of one issue with articles articles.
+    """
+    pdf = base64.b64encode(os.urandom(pdf_size)).decode("ascii")
+    with open(path, "w", encoding="utf-8") as output:
+        output.write('<?xml version="1.0" ?>\n'
+                     '<issues xmlns="http://pkp.sfu.ca">\n'
+                     '\t<issue published="1" current="0" access_status="1">\n'
+                     '\t\t<issue_identification><volume>1</volume>'
+                     '<number>1</number><year>2020</year>'
+                     '</issue_identification>\n'
+                     '\t\t<articles>\n')
+        for number in range(1, articles + 1):
+            output.write(ARTICLE % {"number": number, "pdf": pdf})
+        output.write('\t\t</articles>\n\t</issue>\n</issues>\n')
+
+
+def check(path, method):
+    """
+    Check path in this process, print the violations found, the seconds
+    taken and the peak memory in KB.
+    """
+    start = time.perf_counter()
+    if method == "stream":
+        violations = len(validate_file(path))
+    else:
+        schema = load_schema()
+        tree = etree.parse(path, etree.XMLParser(huge_tree=True))
+        violations = 0 if schema.validate(tree) else len(schema.error_log)
+    print(violations, time.perf_counter() - start,
+          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    """
+    Benchmark entry point.
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == "--check":
+        check(sys.argv[2], sys.argv[3])
+        return
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=300)
+    parser.add_argument("--pdf-size", type=int, default=1000000)
+    args = parser.parse_args()
+    if etree is None:
+        sys.exit("bench_xsd.py needs the lxml package")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "conversion1.xml")
+        write_file(path, args.articles, args.pdf_size)
+        size = os.path.getsize(path)
+        print("%d articles, %d bytes" % (args.articles, size))
+        print("%8s %10s %8s %8s %12s" % ("method", "violations", "seconds",
+                                         "MB/s", "peak RSS KB"))
+        for method in ("stream", "tree"):
+            violations, seconds, peak = subprocess.run(
+                [sys.executable, __file__, "--check", path, method],
+                check=True, capture_output=True, text=True).stdout.split()
+            print("%8s %10s %8.2f %8.1f %12s" % (
+                method, violations, float(seconds),
+                size / float(seconds) / 1e6, peak))
+
+
+if __name__ == "__main__":
+    main()
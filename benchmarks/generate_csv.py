@@ -0,0 +1,184 @@
+"""
+ Synthetic OJS import CSV generator
+
+ Writes an import.csv with the columns of examples/import.csv, plus
+ authorEmailN and keywords, filled with realistic looking values so the
+ converter can be measured at any scale. Optionally writes a JPEG-sized
+ cover file for each issue, to be served by a local stand-in for the cover
+ bucket.
+
+ Usage:
+    python benchmarks/generate_csv.py import.csv [--rows 100000]
+                                      [--issues 1000] [--authors 3]
+                                      [--covers-dir covers/]
+"""
+
+import argparse
+import csv
+import os
+import random
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "examples", "import.csv")
+
+SECTIONS = [("Articles", "ART"), ("Departments", "Dept"),
+            ("Reviews", "REV"), ("Letters", "LET")]
+WORDS = ("organ theatre console pipe wurlitzer kimball morton barton "
+         "chapter convention restoration concert organist history society "
+         "relay chest rank tibia vox humana chrysoglott").split()
+
+
+def columns(authors):
+    """
+    Parameters:
+        authors (int): Number of authorGivennameN... column groups.
+
+    Returns:
+        list: Header of the CSV, the columns of examples/import.csv with
+              author columns for every author, authorEmailN and keywords.
+    """
+    with open(EXAMPLE_CSV, encoding="utf-8-sig") as example:
+        header = next(csv.reader(example))
+    header = [name for name in header if not name.startswith("author")]
+    first_file = header.index("file1")
+    author_columns = []
+    for number in range(1, authors + 1):
+        suffix = str(number)
+        author_columns += ["authorGivenname" + suffix,
+                           "authorFamilyname" + suffix,
+                           "authorAffiliation" + suffix,
+                           "authorEmail" + suffix]
+    return header[:first_file] + author_columns + header[first_file:] \
+        + ["keywords"]
+
+
+def issue_cover(issue):
+    """
+    Parameters:
+        issue (int): Index of the issue.
+
+    Returns:
+        str: issueCover file name of the issue.
+    """
+    return "atoj_to_%d_v%03d_n%02d_cover.jpg" % (
+        1959 + issue // 12, issue // 12 + 1, issue % 12 + 1)
+
+
+def _words(generator, count):
+    return " ".join(generator.choice(WORDS) for _ in range(count))
+
+
+def synthetic_rows(rows, issues, authors, covers=True, seed=0):
+    """
+    Parameters:
+        rows (int): Number of article rows.
+        issues (int): Number of issues the rows are spread over, in order.
+        authors (int): Maximum number of authors per article.
+        covers (bool): Whether issues name a cover image.
+        seed (int): Seed of the random values, the same seed gives the same
+                    rows.
+
+    Returns:
+        generator: Dictionaries keyed by the names returned by columns.
+    """
+    generator = random.Random(seed)
+    issues = max(1, min(issues, rows))
+    # Articles are numbered within their section of an issue, so the rows
+    # pass ojs_validation.
+    sequences = {}
+    for number in range(rows):
+        issue = number * issues // rows
+        year = 1959 + issue // 12
+        volume = issue // 12 + 1
+        issue_number = issue % 12 + 1
+        stem = "atoj_to_%d_v%03d_n%02d" % (year, volume, issue_number)
+        section_title, section_abbrev = generator.choice(SECTIONS)
+        sequence = sequences.get((issue, section_abbrev), 0) + 1
+        sequences[(issue, section_abbrev)] = sequence
+        page = generator.randint(1, 80)
+        row = {
+            "uploader": "jdoe",
+            "title": _words(generator, generator.randint(2, 8)).title(),
+            "abstract": _words(generator, generator.randint(20, 80)).capitalize() + ".",
+            "issueCover": issue_cover(issue) if covers else "",
+            "issueDatepublished": "%d-%02d-01" % (year, issue_number),
+            "issueVolume": str(volume),
+            "issueNumber": str(issue_number),
+            "issueYear": str(year),
+            "issueTitle": "Vol %d No %d (%d)" % (volume, issue_number, year),
+            "sectionTitle": section_title,
+            "sectionAbbrev": section_abbrev,
+            "pages": "%d-%d" % (page, page + generator.randint(0, 6)),
+            "seq": str(sequence),
+            "file1": "%s_access_%d.pdf" % (stem, number),
+            "keywords": ";".join(generator.sample(WORDS, generator.randint(1, 5))),
+        }
+        for author in range(1, generator.randint(1, max(authors, 1)) + 1):
+            suffix = str(author)
+            given = generator.choice(("Ann", "Bob", "Cleo", "Dmitri", "Eve",
+                                      "Frank", "Gwen", "Hiro", "Ines"))
+            family = generator.choice(("Smith", "Jones", "Miller", "Nguyen",
+                                       "O'Brien", "Schmidt", "Rossi"))
+            row["authorGivenname" + suffix] = given
+            row["authorFamilyname" + suffix] = family
+            row["authorAffiliation" + suffix] = "ATOS " + generator.choice(
+                SECTIONS)[0] + " Chapter"
+            row["authorEmail" + suffix] = "%s.%s@example.org" % (
+                given.lower(), family.lower().replace("'", ""))
+        yield row
+
+
+def write_covers(directory, issues):
+    """
+    Write a cover file of a typical size for each issue.
+
+    Parameters:
+        directory (str): Directory the covers are written to.
+        issues (int): Number of issues.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for issue in range(issues):
+        cover = issue_cover(issue)
+        with open(os.path.join(directory, cover), "wb") as image:
+            image.write(os.urandom(random.Random(cover).randint(
+                40 * 1024, 160 * 1024)))
+
+
+def write_csv(path, rows, issues, authors, covers=True, seed=0):
+    """
+    Parameters:
+        path (str): CSV file to write.
+        rows (int): Number of article rows.
+        issues (int): Number of issues.
+        authors (int): Maximum number of authors per article.
+        covers (bool): Whether issues name a cover image.
+        seed (int): Seed of the random values.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.DictWriter(output, columns(authors), restval="")
+        writer.writeheader()
+        writer.writerows(synthetic_rows(rows, issues, authors, covers, seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="CSV file to write")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--issues", type=int, default=1000)
+    parser.add_argument("--authors", type=int, default=3,
+                        help="maximum number of authors per article")
+    parser.add_argument("--no-covers", action="store_true",
+                        help="leave issueCover empty")
+    parser.add_argument("--covers-dir",
+                        help="also write a cover file for each issue here")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_csv(args.path, args.rows, args.issues, args.authors,
+              not args.no_covers, args.seed)
+    if args.covers_dir and not args.no_covers:
+        write_covers(args.covers_dir, max(1, min(args.issues, args.rows)))
+
+
+if __name__ == "__main__":
+    main()
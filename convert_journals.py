@@ -0,0 +1,374 @@
+"""
+ Converts the import CSVs of many journals in one run
+
+ Each CSV is a journal, converted like generate_xml.py does into its own
+ output directory with its own bucket, prefix and output settings. Journals
+ are converted concurrently in one process: they share the urllib3 pool of
+ ojs_builder, one set of cover download threads, the on-disk cover cache and
+ one pool of worker processes rendering the output files. A summary of the
+ run is written as JSON once every journal is done.
+
+ Usage:
+    python convert_journals.py CSV_OR_DIRECTORY [...] [--output converted]
+                               [--config journals.json] [--jobs 4]
+                               [--workers N] [--bucket mybucket]
+                               [--bucket-prefix /pdf/] [--max-file-size N]
+                               [--compression gzip] [--incremental]
+                               [--preflight] [--cover-max-dimension 1600]
+                               [--cover-quality 85] [--validate-xml]
+                               [--summary run_summary.json]
+
+ Directories are searched for *.csv files. Every setting can be given on
+ the command line for all journals, or per journal in a JSON config file:
+
+    {"defaults": {"bucket": "mybucket"},
+     "journals": [{"input_csv": "atos.csv", "bucket": "atos-bucket",
+                   "output_dir": "out/atos", "max_file_size": 50000000}]}
+
+ Functions:
+    find_csvs: Lists the CSV files given as files or directories
+    journal_settings: Works out the settings of each journal to convert
+    convert_journal: Converts the CSV of one journal
+    add_journal_options: Adds the journal settings to a command line
+    journal_overrides: Takes the journal settings given on a command line
+    main: Command-line entry point
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from ojs_builder import COVER_BASE_URL
+from ojs_conversion import convert_files
+from ojs_covers import CoverCache
+from ojs_preflight import pdf_objects
+from ojs_reader import read_records
+from ojs_s3 import s3_client
+from ojs_validation import ValidationError
+from ojs_xsd import SchemaViolations
+
+"""
+Settings of a journal, as named in generate_xml.py, and their defaults.
+"""
+JOURNAL_DEFAULTS = {
+    "input_csv": None,
+    "output_dir": None,
+    "bucket": "mybucket",
+    "bucket_schema": "http://",
+    "bucket_prefix": "/pdf/",
+    # When set, PDFs are embedded from this folder like
+    # generate_xml_embedded.py does instead of linked from the bucket.
+    "pdf_folder": None,
+    "cover_base_url": COVER_BASE_URL,
+    "max_file_size": None,
+    "compression": None,
+    "incremental": False,
+    # Look up every PDF and cover before writing any XML, see ojs_preflight.
+    "preflight": False,
+    # Scale down covers larger than this many pixels and recompress them,
+    # see ojs_images. Needs the Pillow package.
+    "cover_max_dimension": None,
+    "cover_quality": 85,
+    # Check the conversion files against the PKP native.xsd once written,
+    # see ojs_xsd. Needs the lxml package and the schemas in schemas/.
+    "validate_xml": False,
+    "manifest_file": "conversion_manifest.json",
+}
+
+
+def find_csvs(paths):
+    """
+    Parameters:
+    paths (list): CSV files, and directories whose *.csv files are taken
+
+    Returns:
+    list: Paths of the CSV files, those of a directory in name order
+    """
+    csvs = []
+    for path in paths:
+        if os.path.isdir(path):
+            csvs.extend(os.path.join(path, name)
+                        for name in sorted(os.listdir(path))
+                        if name.lower().endswith(".csv"))
+        else:
+            csvs.append(path)
+    return csvs
+
+
+def journal_settings(paths, overrides, output_root, config=None):
+    """
+    Parameters:
+    paths (list): CSV files or directories given on the command line
+    overrides (dict): Settings given on the command line, for every journal
+    output_root (str): Directory each journal gets an output directory in,
+    named after its CSV
+    config (dict): Contents of the JSON config file, with optional
+    "defaults" and "journals" lists of settings
+
+    Returns:
+    list: Complete settings of each journal, in the order given
+    """
+    config = config or {}
+    defaults = dict(JOURNAL_DEFAULTS)
+    defaults.update(config.get("defaults", {}))
+    defaults.update(overrides)
+    journals = [dict(journal) for journal in config.get("journals", [])]
+    journals += [{"input_csv": path} for path in find_csvs(paths)]
+
+    settings = []
+    for journal in journals:
+        unknown = set(journal) - set(JOURNAL_DEFAULTS)
+        if unknown:
+            raise ValueError("Unknown journal settings: "
+                             + ", ".join(sorted(unknown)))
+        if not journal.get("input_csv"):
+            raise ValueError("Journal without an input_csv: "
+                             + json.dumps(journal))
+        journal_setting = dict(defaults)
+        journal_setting.update(journal)
+        if not journal_setting["output_dir"]:
+            name = os.path.splitext(os.path.basename(
+                journal_setting["input_csv"]))[0]
+            journal_setting["output_dir"] = os.path.join(output_root, name)
+        settings.append(journal_setting)
+
+    output_dirs = [os.path.abspath(journal["output_dir"])
+                   for journal in settings]
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError("Journals must have different output directories, "
+                         "set output_dir in the config file")
+    return settings
+
+
+def convert_journal(journal, cover_cache=None, cover_executor=None,
+                    executor=None, workers=1, client=None):
+    """
+    Convert the CSV of one journal into conversionN.xml files and a manifest
+    in its output directory.
+
+    Parameters:
+    journal (dict): Settings of the journal, see journal_settings
+    cover_cache (CoverCache): Cover cache shared by the journals
+    cover_executor (ThreadPoolExecutor): Cover download threads shared by
+    the journals
+    executor (ProcessPoolExecutor): Worker processes shared by the journals,
+    None renders in this process
+    workers (int): Number of worker processes of the executor
+    client (S3.Client): boto3 S3 client shared by the journals, used to
+    look up the PDFs of a journal with preflight set
+
+    Returns:
+    dict: Summary of the journal's conversion, its status is "converted",
+    "invalid" when the CSV has errors or the conversion files do not match
+    the schema, or "failed"
+    """
+    started = time.perf_counter()
+    summary = {"input_csv": journal["input_csv"],
+               "output_dir": journal["output_dir"]}
+    try:
+        if journal["pdf_folder"]:
+            defaults = {'pdf_folder': journal["pdf_folder"]}
+        else:
+            defaults = {'bucket_location': (
+                journal["bucket_schema"] + journal["bucket"]
+                + ".s3.amazonaws.com" + journal["bucket_prefix"])}
+        # The PDFs are looked up for the fingerprints where they are linked
+        # to, or in the bucket itself for the preflight check.
+        if not journal["preflight"] or journal["pdf_folder"]:
+            client = None
+        elif client is None:
+            client = s3_client()
+        pdfs = pdf_objects(defaults, client, journal["bucket"],
+                           journal["bucket_prefix"])
+
+        def warn(warnings):
+            summary["warnings"] = warnings
+
+        with open(journal["input_csv"], encoding='utf-8-sig') as input_file:
+            files = convert_files(
+                read_records(input_file, defaults),
+                output_dir=journal["output_dir"],
+                manifest_file=journal["manifest_file"],
+                cover_base_url=journal["cover_base_url"], pdfs=pdfs,
+                preflight=journal["preflight"],
+                incremental=journal["incremental"],
+                max_file_size=journal["max_file_size"],
+                compression=journal["compression"],
+                cover_max_dimension=journal["cover_max_dimension"],
+                cover_quality=journal["cover_quality"],
+                validate_xml=journal["validate_xml"], workers=workers,
+                executor=executor, cover_cache=cover_cache,
+                cover_executor=cover_executor, warn=warn)
+
+        conversion = files.conversion
+        if conversion.plan is not None:
+            summary["changes"] = {change: len(issue_keys) for change, issue_keys
+                                  in conversion.plan['changes'].items()}
+        summary.update({
+            "status": "converted",
+            "issues": len(conversion.issues),
+            "articles": conversion.article_count,
+            "files": [os.path.basename(output_file)
+                      for output_file in files.output_files],
+            "bytes": files.bytes})
+        if files.covers is not None:
+            summary["covers"] = files.covers
+        if files.violations:
+            raise SchemaViolations(files.violations)
+    except (ValidationError, SchemaViolations) as error:
+        summary.update({"status": "invalid", "error": str(error)})
+    except Exception as error:  # pylint: disable=broad-except
+        # One journal failing does not stop the others, it is reported in
+        # the summary.
+        summary.update({"status": "failed",
+                        "error": type(error).__name__ + ": " + str(error)})
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def add_journal_options(parser):
+    """
+    Add an option for each journal setting given on the command line.
+
+    Parameters:
+    parser (ArgumentParser): Parser the options are added to
+    """
+    for name in ("bucket", "bucket_schema", "bucket_prefix", "pdf_folder",
+                 "cover_base_url", "compression"):
+        parser.add_argument("--" + name.replace("_", "-"), dest=name)
+    parser.add_argument("--max-file-size", dest="max_file_size", type=int)
+    parser.add_argument("--cover-max-dimension", dest="cover_max_dimension",
+                        type=int, help="scale down covers larger than this "
+                                       "many pixels, needs Pillow")
+    parser.add_argument("--cover-quality", dest="cover_quality", type=int)
+    parser.add_argument("--incremental", action="store_const", const=True)
+    parser.add_argument("--preflight", action="store_const", const=True,
+                        help="look up every PDF and cover before converting")
+    parser.add_argument("--validate-xml", action="store_const", const=True,
+                        help="check the conversion files against the PKP "
+                             "native.xsd, needs lxml")
+
+
+def journal_overrides(args):
+    """
+    Parameters:
+    args (Namespace): Parsed command line, see add_journal_options
+
+    Returns:
+    dict: The journal settings given on the command line
+    """
+    return {name: value for name, value in vars(args).items()
+            if name in JOURNAL_DEFAULTS and value is not None}
+
+
+def main(argv=None):
+    """
+    Parameters:
+    argv (list): Command-line arguments, sys.argv when None
+
+    Returns:
+    int: Exit status, 1 when any journal was not converted
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert the OJS import CSVs of many journals.")
+    parser.add_argument("paths", nargs="*",
+                        help="CSV files, or directories holding CSV files")
+    parser.add_argument("--config", help="JSON file of per-journal settings")
+    parser.add_argument("--output", default="converted",
+                        help="directory the journals' output directories "
+                             "are made in")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="journals converted at the same time")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes rendering output files, shared by "
+                             "the journals")
+    parser.add_argument("--cover-downloads", type=int, default=8,
+                        help="covers downloaded at the same time, shared by "
+                             "the journals")
+    parser.add_argument("--cover-cache-max-age", type=int,
+                        help="seconds a cached cover is used before checking "
+                             "it has not changed, forever by default")
+    parser.add_argument("--summary",
+                        help="file the run summary is written to, "
+                             "OUTPUT/run_summary.json by default")
+    add_journal_options(parser)
+    args = parser.parse_args(argv)
+
+    config = None
+    if args.config:
+        with open(args.config, encoding='utf-8') as config_file:
+            config = json.load(config_file)
+    overrides = journal_overrides(args)
+    try:
+        journals = journal_settings(args.paths, overrides, args.output, config)
+    except ValueError as error:
+        parser.error(str(error))
+    if not journals:
+        parser.error("no CSV files to convert")
+
+    started = datetime.datetime.now()
+    start = time.perf_counter()
+    cover_cache = CoverCache(max_age=args.cover_cache_max_age)
+    client = None
+    if any(journal["preflight"] and not journal["pdf_folder"]
+           for journal in journals):
+        # Clients are thread-safe once made, making them is not.
+        client = s3_client()
+    executor = None
+    if args.workers and args.workers > 1:
+        # Spawned rather than forked, like write_batches does, so the
+        # download threads are not copied into the workers.
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with ThreadPoolExecutor(max_workers=args.cover_downloads) \
+                as cover_executor, \
+                ThreadPoolExecutor(max_workers=args.jobs) as journal_executor:
+            summaries = list(journal_executor.map(
+                lambda journal: convert_journal(journal, cover_cache,
+                                                cover_executor, executor,
+                                                args.workers, client),
+                journals))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    converted = [summary for summary in summaries
+                 if summary["status"] == "converted"]
+    run_summary = {
+        "started": started.isoformat(timespec="seconds"),
+        "seconds": round(time.perf_counter() - start, 3),
+        "journals": len(summaries),
+        "converted": len(converted),
+        "not_converted": len(summaries) - len(converted),
+        "issues": sum(summary["issues"] for summary in converted),
+        "articles": sum(summary["articles"] for summary in converted),
+        "files": sum(len(summary["files"]) for summary in converted),
+        "bytes": sum(summary["bytes"] for summary in converted),
+        "cover_cache": cover_cache.stats(),
+        "results": summaries}
+    summary_file = args.summary or os.path.join(args.output,
+                                                "run_summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(summary_file)), exist_ok=True)
+    with open(summary_file, 'w', encoding='utf-8') as output:
+        json.dump(run_summary, output, indent=2)
+
+    for summary in summaries:
+        line = summary["input_csv"] + ": " + summary["status"]
+        if summary["status"] == "converted":
+            line += " (%d issues, %d articles, %d files)" % (
+                summary["issues"], summary["articles"], len(summary["files"]))
+        print(line)
+        if "error" in summary:
+            print(summary["error"])
+    print("Summary written to " + summary_file)
+    return 0 if len(converted) == len(summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
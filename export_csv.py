@@ -0,0 +1,60 @@
+"""
+ Converts OJS native XML exports back into an import CSV
+
+ Each article of the exports becomes a row of the examples/import.csv
+ layout, which generate_xml.py and the Lambda convert again once edited.
+ Exports are read incrementally, so multi-GB exports with embedded covers
+ and galleys are converted with flat memory use. With --extract-to the
+ embedded covers and PDFs are decoded into that directory under their file
+ names, e.g. to be used as the pdf_folder of generate_xml_embedded.py.
+
+ Usage:
+    python export_csv.py EXPORT [...] [--output import.csv]
+                         [--extract-to pdf] [--locale en_US]
+
+ Exports compressed with gzip (.gz) or zstd (.zst) are read as they are.
+"""
+
+import argparse
+import collections
+import sys
+from ojs_export import DEFAULT_LOCALE, read_exports, write_csv
+
+
+def main(argv=None):
+    """
+    Parameters:
+    argv (list): Command-line arguments, sys.argv when None
+
+    Returns:
+    int: Exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert OJS native XML exports into an import CSV.")
+    parser.add_argument("exports", nargs="+",
+                        help="native XML export or conversion files")
+    parser.add_argument("--output", default="import.csv",
+                        help="CSV file written")
+    parser.add_argument("--extract-to",
+                        help="directory the embedded covers and PDFs are "
+                             "written to, they are skipped when not given")
+    parser.add_argument("--locale", default=DEFAULT_LOCALE,
+                        help="locale of the titles, abstracts and names "
+                             "taken")
+    args = parser.parse_args(argv)
+
+    stats = collections.Counter()
+    with open(args.output, 'w', newline='', encoding='utf-8') as output:
+        write_csv(read_exports(args.exports, args.extract_to, args.locale,
+                               stats),
+                  output)
+    print("Exported %d articles of %d issues to %s" % (
+        stats['articles'], stats['issues'], args.output))
+    if args.extract_to:
+        print("Extracted %d embedded files, %d bytes, to %s" % (
+            stats['files'], stats['bytes'], args.extract_to))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,127 +10,93 @@
     to XML output_file: Resulting XML document for OJS Import
 """
 
-import csv
-import datetime
-import xml.dom.minidom
-from xml.etree import ElementTree
-from ojs_builder import (build_identification,
-                         build_date_published,
-                         build_article,
-                         build_sections,
-                         build_cover,
-                         build_issue_galleys,
-                         build_issue_id)
+import os
+import sys
+from ojs_builder import COVER_BASE_URL
+from ojs_conversion import SCRIPT_SETTINGS, convert_files, print_summary
+from ojs_covers import CoverCache
+from ojs_metrics import enable
+from ojs_preflight import pdf_objects
+from ojs_reader import read_records
+from ojs_s3 import s3_client
+from ojs_validation import ValidationError
+from ojs_xsd import SchemaViolations
 
-import_list = []
 bucket = "mybucket"
 bucket_schema = "http://"
 bucket_url = bucket + ".s3.amazonaws.com"
 bucket_prefix = "/pdf/"
 bucket_location = bucket_schema + bucket_url + bucket_prefix
 input_csv = "import.csv"
-input_file = csv.DictReader(open(input_csv, encoding='utf-8-sig'))
-#output_file = "conversion.xml"
-issues = {}
-articles = {}
-sections = {}
-xml_version = "<?xml version=\"1.0\"?>"
-xmlns = "xmlns=\"http://pkp.sfu.ca\""
-xmlns_xsi = "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\""
-schema_location = "xsi:schemaLocation=\"http://pkp.sfu.ca native.xsd\">"
-xml_header = (xml_version + " <issues " + xmlns
-              + " " + xmlns_xsi + " " + schema_location + "</issues>")
+cover_base_url = COVER_BASE_URL
+# Largest size in bytes of an output file. When set, issues are packed
+# together, or split by article, into files under this size; when None each
+# issue gets its own file.
+max_file_size = None
+manifest_file = "conversion_manifest.json"
+# Number of processes rendering output files in parallel, the files are
+# identical whatever the number.
+workers = os.cpu_count()
+# When True only issues added or changed since the run that wrote
+# manifest_file are converted, into new conversion files; the files holding
+# unchanged issues are kept so they are not imported twice.
+incremental = False
+# "gzip", or "zstd" when the zstandard package is installed, compresses the
+# output files while they are written, into conversionN.xml.gz or .xml.zst.
+compression = None
+# When True every PDF is looked up in the bucket, and every cover at
+# cover_base_url, before any XML is written, and missing or empty ones are
+# reported with the rows using them. Needs AWS credentials that can read,
+# and for large CSVs list, the bucket.
+preflight = False
+# When set, issue covers wider or higher than this many pixels are scaled
+# down, and every cover is recompressed at cover_quality, before they are
+# embedded. Needs the Pillow package.
+cover_max_dimension = None
+cover_quality = 85
+# Seconds a cover in the on-disk cache is used before a conditional request
+# checks it has not been replaced at cover_base_url. When None cached covers
+# are used without any request, remove the cache directory, see
+# ojs_covers.DEFAULT_CACHE_DIR, after replacing a cover.
+cover_cache_max_age = None
+# When True every conversion file written is checked against the PKP
+# native.xsd and pkp-native.xsd, in parallel, and the elements that do not
+# match them are reported with the file_number of their article. Needs the
+# lxml package and the schemas downloaded into schemas/, see
+# ojs_xsd.SCHEMA_SOURCES.
+validate_xml = False
+# When True the duration of each stage and builder, the bytes transferred
+# and the peak memory are printed as a JSON line at the end of the run. With
+# several workers the builders run in the worker processes and are not
+# included.
+metrics = False
 
-#ElementTree.register_namespace("", "http://pkp.sfu.ca")
-#doc = ElementTree.ElementTree(ElementTree.fromstring(xml_header))
-#root = doc.getroot()
 
-for row in input_file:
-    import_list.append(row)
+def main():
+    """
+    Convert input_csv to conversionN.xml files in the current directory.
+    """
+    if metrics:
+        enable()
+    defaults = {'bucket_location': bucket_location}
+    # The PDFs are looked up for the fingerprints at bucket_location, or in
+    # the bucket itself for the preflight check
+    pdfs = pdf_objects(defaults, s3_client() if preflight else None, bucket,
+                       bucket_prefix)
+    # The rows are checked, grouped by issue and numbered, then the covers
+    # are downloaded in parallel while the files are written, see
+    # ojs_conversion. Covers downloaded by earlier runs are reused from the
+    # on-disk cache
+    with open(input_csv, encoding='utf-8-sig') as input_file:
+        files = convert_files(
+            read_records(input_file, defaults), pdfs=pdfs,
+            cover_cache=CoverCache(max_age=cover_cache_max_age),
+            **{name: globals()[name] for name in SCRIPT_SETTINGS})
+    print_summary(files)
 
-for import_dict in import_list:
-    if import_dict['issueTitle'] not in issues:
-        issues[import_dict['issueTitle']] = {
-            "issueYear": import_dict['issueYear'],
-            "issueVolume": import_dict['issueVolume'],
-            "issueNumber": import_dict['issueNumber'],
-            "issueDatepublished": import_dict['issueDatepublished'],
-            "issueTitle": import_dict['issueTitle'],
-            "issueCover": import_dict['issueCover']}
 
-for issue_title in issues:
-    sections[issue_title] = []
-    articles[issue_title] = []
-    for import_row in import_list:
-        if import_row['issueTitle'] == issue_title:
-            section = {"sectionTitle": import_row['sectionTitle'],
-                       "sectionAbbrev": import_row['sectionAbbrev']}
-            sections[issue_title].append(section)
-            articles[issue_title].append(import_row)
-
-file_number = 0
-issue_identifier = 1
-for issue_key, issue_metadata in issues.items():
-    ElementTree.register_namespace("", "http://pkp.sfu.ca")
-    doc = ElementTree.ElementTree(ElementTree.fromstring(xml_header))
-    root = doc.getroot()
-    # The issue element in the resulting XML can take a published attribute
-    # of either a 0 or a 1. This logic tells OJS whether the article should
-    # show as published or not in OJS.
-    if datetime.datetime.strptime(issue_metadata['issueDatepublished'], \
-            "%Y-%m-%d") < datetime.datetime.today():
-        is_published = 1
-    elif datetime.datetime.strptime(issue_metadata['issueDatepublished'], \
-            "%Y-%m-%d") > datetime.datetime.today():
-        is_published = 0
-    issue = ElementTree.Element("issue", attrib={"current":"0", "published": str(is_published)})
-    issue.append(build_issue_id(issue_identifier))
-
-    issue.append(build_identification(issue_metadata))
-    issue.append(build_date_published(issue_metadata))
-    issue.append(build_sections(sections[issue_key]))
-    if issue_metadata['issueCover'] != '':
-        issue.append(build_cover(issue_metadata))
-    issue.append(build_issue_galleys())
-    doc_articles = ElementTree.Element("articles", {})
-    for import_dict in articles[issue_key]:
-        if 'authorEmail1' not in import_dict:
-            import_dict['authorEmail1'] = ''
-        if 'authorEmail2' not in import_dict:
-            import_dict['authorEmail2'] = ''
-        if 'authorEmail3' not in import_dict:
-            import_dict['authorEmail3'] = ''
-        if 'authorEmail4' not in import_dict:
-            import_dict['authorEmail4'] = ''
-        if 'authorEmail5' not in import_dict:
-            import_dict['authorEmail5'] = ''
-        if 'submission_stage' not in import_dict:
-            import_dict['submission_stage'] = 'submission'
-        if import_dict['fileGenre1'] == '':
-            import_dict['fileGenre1'] = 'Article Text'
-        if 'revision_number' not in import_dict:
-            import_dict['revision_number'] = "1"
-        if import_dict['authorFamilyname1'] == '' \
-                or import_dict['authorFamilyname1'] is None \
-                or 'authorFamilyname1' not in import_dict:
-            import_dict['authorFamilyname1'] = "Unknown"
-        if import_dict['authorGivenname1'] == '' \
-                or import_dict['authorGivenname1'] is None \
-                or 'authorGivenname1' not in import_dict:
-            import_dict['authorGivenname1'] = "Unknown"
-
-
-        import_dict['bucket_location'] = bucket_location
-        file_number += 1
-        import_dict['file_number'] = str(file_number)
-        doc_articles.append(build_article(import_dict))
-    issue.append(doc_articles)
-    root.append(issue)
-
-    output_file = "conversion" + str(issue_identifier) + ".xml"
-    
-    issue_identifier += 1
-
-    doc._setroot(root)
-    pretty_xml = xml.dom.minidom.parseString(ElementTree.tostring(doc.getroot()))
-    open(output_file, 'w').write((pretty_xml.toprettyxml()))
+if __name__ == "__main__":
+    try:
+        main()
+    except (ValidationError, SchemaViolations) as error:
+        sys.exit(str(error))
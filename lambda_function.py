@@ -5,23 +5,61 @@
  The final XML Tree that is built is then dumped to a file for import into OJS
 
  Vars:
-    input_csv: CSV containing OJS fields to conver to XML
-    output_file: Resulting XML document for OJS Import
+    key: CSV containing OJS fields to convert to XML, streamed from S3
+    conversion_file: Resulting XML document for OJS Import, streamed to S3
 """
 
 import json
-import csv
-import xml.dom.minidom
-import xml.etree.ElementTree as ElementTree
-import boto3
-import datetime
-from ojs_builder import (build_identification,
-                         build_date_published,
-                         build_article,
-                         build_sections,
-                         build_cover,
-                         build_issue_galleys,
-                         build_issue_id)
+import os
+import uuid
+from ojs_builder import COVER_BASE_URL
+from ojs_compression import CompressedWriter, get_codec
+from ojs_conversion import start_conversion
+from ojs_covers import environment_cache
+from ojs_images import environment_normalizer
+from ojs_incremental import format_changes
+from ojs_fanout import (MANIFEST_KEY,
+                        dispatch_batches,
+                        status_response,
+                        worker_handler,
+                        LambdaDispatcher,
+                        LocalDispatcher,
+                        ProcessPoolDispatcher)
+from ojs_metrics import count, disable, enable, stage
+from ojs_preflight import pdf_objects
+from ojs_reader import read_records
+from ojs_s3 import S3UploadStream, iter_lines, s3_client, upload_options
+from ojs_validation import ValidationError
+from ojs_xsd import (StreamValidator,
+                     ValidatingWriter,
+                     format_violation,
+                     load_schema)
+
+
+def report_metrics(response, context):
+    """
+    Log the metrics recorded during the invocation, if any, and add their
+    summary to the response body.
+
+    Parameters:
+    response (dict): Response of the invocation
+    context: Lambda context, None when run outside Lambda
+
+    Returns:
+    dict: The response, its body holding the original message and the
+    metrics summary when metrics were recorded
+    """
+    metrics = disable()
+    if metrics is None:
+        return response
+    metrics.log(dimensions={"FunctionName": context.function_name}
+                if context else None)
+    if 'body' in response:
+        response['body'] = json.dumps({"message": json.loads(response['body']),
+                                       "metrics": metrics.summary()})
+    else:
+        response['metrics'] = metrics.summary()
+    return response
 
 
 def lambda_handler(event, context):
@@ -35,134 +73,199 @@ def lambda_handler(event, context):
     Returns:
     json: Response and Status of Lambda Function
     """
-    import_list = []
+    # Setting METRICS records the duration of each stage and builder, the
+    # bytes transferred and the peak memory. They are logged in CloudWatch
+    # embedded metric format and added to the response body.
+    if os.environ.get('METRICS'):
+        enable()
+
+    # Invocations dispatched by a fan-out coordinator convert a single job.
+    if 'ojs_fanout_job' in event:
+        return report_metrics(worker_handler(event, context), context)
+
     bucket = event['Records'][0]['s3']['bucket']['name']
     bucket_schema = "http://"
     bucket_url = bucket + ".s3.amazonaws.com"
     bucket_prefix = "/pdf/"
     bucket_location = bucket_schema + bucket_url + bucket_prefix
-    s3_resource = boto3.resource('s3')
-    client = boto3.client('s3')
-    s3_resource.meta.client.download_file(bucket,
-                                          'csv/import.csv',
-                                          '/tmp/import.csv')
-    input_csv = "/tmp/import.csv"
-    input_file = csv.DictReader(open(input_csv))
-    #output_file = "/tmp/conversion.xml"
-    issues = {}
-    articles = {}
-    sections = {}
-    xml_version = "<?xml version=\"1.0\"?>"
-    xmlns = "xmlns=\"http://pkp.sfu.ca\""
-    xmlns_xsi = "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\""
-    schema_location = "xsi:schemaLocation=\"http://pkp.sfu.ca native.xsd\">"
-    xml_header = (xml_version + " <issues " + xmlns
-                  + " " + xmlns_xsi + " " + schema_location + "</issues>")
-
-    #ElementTree.register_namespace("", "http://pkp.sfu.ca")
-    #doc = ElementTree.ElementTree(ElementTree.fromstring(xml_header))
-    #root = doc.getroot()
-
-    # Tag Uploaded CSV for object lifecycle management
+    # Covers are downloaded from COVER_BASE_URL unless overridden in the
+    # function's environment.
+    cover_base_url = os.environ.get('COVER_BASE_URL', COVER_BASE_URL)
+    # Setting MAX_FILE_SIZE (bytes) packs issues together, or splits them by
+    # article, into conversion files under that size.
+    max_file_size = os.environ.get('MAX_FILE_SIZE')
+    if max_file_size:
+        max_file_size = int(max_file_size)
+    else:
+        max_file_size = None
+    # Setting FANOUT spreads the conversion over worker invocations instead
+    # of converting everything here: "lambda" invokes FANOUT_FUNCTION (this
+    # function by default) once per output file, "local" and "process" run
+    # the workers in this container, mainly for testing.
+    fanout = os.environ.get('FANOUT')
+    # Setting INCREMENTAL only converts the issues added or changed since
+    # the conversion recorded in conversion_manifest.json, into new
+    # conversion files, so unchanged issues are not imported twice.
+    incremental = bool(os.environ.get('INCREMENTAL'))
+    # Setting COMPRESSION to gzip, or zstd when the zstandard package is
+    # deployed, compresses the conversion files while they are uploaded.
+    # They keep their names and are stored with a Content-Encoding, so
+    # HTTP clients decompress them on download.
+    compression = os.environ.get('COMPRESSION') or None
+    codec = get_codec(compression)
+    # Setting PREFLIGHT looks up every PDF in the bucket, and every cover at
+    # the COVER_BASE_URL, before any XML is written. Missing or empty ones
+    # are returned with the rows using them, like validation errors. Large
+    # CSVs list the bucket, which needs s3:ListBucket.
+    preflight = bool(os.environ.get('PREFLIGHT'))
+    # Setting VALIDATE_XML checks each conversion file against the PKP
+    # native.xsd while it is uploaded, one article at a time. The elements
+    # that do not match it are recorded in the manifest and returned with
+    # the file_number of their article. Needs lxml in the deployment and
+    # the schemas downloaded into schemas/, see ojs_xsd.SCHEMA_SOURCES;
+    # without them nothing is converted. Fan-out workers check their own
+    # file.
+    validate_xml = bool(os.environ.get('VALIDATE_XML'))
+    if validate_xml:
+        try:
+            load_schema()
+        except ValueError as error:
+            print(error)
+            return report_metrics({'statusCode': 400,
+                                   'body': json.dumps(str(error))}, context)
+    client = s3_client()
     key = 'csv/import.csv'
-    client.put_object_tagging(
+    # The CSV is decoded and parsed as it streams in from S3 rather than
+    # being downloaded to /tmp first.
+    with stage("read_csv"):
+        input_file = iter_lines(
+            client.get_object(Bucket=bucket, Key=key)['Body'])
+        # Tag Uploaded CSV for object lifecycle management
+        client.put_object_tagging(
+            Bucket=bucket,
+            Key=key,
+            Tagging={
+                'TagSet': [
+                    {
+                        'Key': 'upload_type',
+                        'Value': 'csv'
+                    },
+                ]
+            }
+        )
+
+    defaults = {'bucket_location': bucket_location}
+    # The PDFs are looked up for the fingerprints at bucket_location, or in
+    # the bucket itself with PREFLIGHT.
+    pdfs = pdf_objects(defaults, client if preflight else None, bucket,
+                       bucket_prefix)
+
+    # An incremental conversion compares the fingerprints of the issues
+    # against the previous manifest and skips the issues that did not change.
+    def previous_manifest():
+        try:
+            return json.loads(client.get_object(
+                Bucket=bucket, Key=MANIFEST_KEY)['Body'].read().decode('utf-8'))
+        except client.exceptions.NoSuchKey:
+            return None
+
+    # The whole CSV is checked before any cover is downloaded or any XML is
+    # written. A CSV with errors is not converted, every problem is logged
+    # and returned at once.
+    # Every issue cover starts downloading in parallel before any XML is
+    # built. Covers downloaded by earlier invocations are reused from the
+    # cache in /tmp while the Lambda container stays warm. Fan-out workers
+    # download their own covers.
+    # Setting COVER_MAX_DIMENSION scales down covers larger than that many
+    # pixels, and recompresses every cover at COVER_QUALITY (85 by
+    # default), before they are embedded. Needs Pillow in the deployment.
+    # Cached covers are checked again once COVER_CACHE_MAX_AGE seconds old.
+    normalizer = environment_normalizer()
+    try:
+        conversion = start_conversion(
+            read_records(input_file, defaults), cover_base_url=cover_base_url,
+            pdfs=pdfs, preflight=preflight,
+            previous=previous_manifest if incremental else None,
+            max_file_size=max_file_size, cover_cache=environment_cache(),
+            normalizer=normalizer, prefetch=not fanout or max_file_size,
+            validate_xml=validate_xml)
+    except ValidationError as error:
+        print(error)
+        return report_metrics({'statusCode': 400,
+                               'body': json.dumps(str(error))}, context)
+    if conversion.plan is not None:
+        print(format_changes(conversion.plan['changes']))
+    covers = conversion.covers
+    conversion_files = conversion.file_names()
+
+    if fanout:
+        covers.close()
+        if fanout == 'lambda':
+            dispatcher = LambdaDispatcher(
+                os.environ.get('FANOUT_FUNCTION', context.function_name))
+        elif fanout == 'process':
+            dispatcher = ProcessPoolDispatcher()
+        else:
+            dispatcher = LocalDispatcher()
+        run_id = context.aws_request_id if context else uuid.uuid4().hex
+        with stage("dispatch"):
+            response = dispatch_batches(
+                client, bucket, run_id, conversion.batches, conversion.issues,
+                conversion.sections, conversion.articles,
+                conversion.issue_identifiers, dispatcher, max_file_size,
+                conversion_files, conversion.fingerprints, conversion.plan,
+                compression)
+        return report_metrics(response, context)
+
+    # Each conversion file is uploaded as a parallel multipart upload once
+    # it outgrows a single part. Unless SKIP_UNCHANGED is 0 it is held until
+    # written and not uploaded when the bucket already holds the same bytes,
+    # otherwise it is uploaded while it is written. Lambda has no /dev/shm
+    # for multiprocessing, so files are rendered in this process.
+    uploads = {}
+    validators = {}
+    options = upload_options()
+
+    def open_upload(conversion_file):
+        uploads[conversion_file] = S3UploadStream(
+            client, bucket, conversion_file,
+            content_encoding=codec.content_encoding if codec else None,
+            **options)
+        output = uploads[conversion_file]
+        if codec is not None:
+            output = CompressedWriter(output, codec)
+        if validate_xml:
+            validators[conversion_file] = StreamValidator(conversion_file)
+            output = ValidatingWriter(output, validators[conversion_file])
+        return output
+
+    output_files = conversion.write_batches(conversion_files,
+                                            opener=open_upload)
+
+    conversion.close()
+    print('Cover cache: ' + json.dumps(covers.cache.stats()))
+
+    sizes = [uploads[output_file].bytes_written for output_file in output_files]
+    count("bytes_written", sum(sizes))
+    if normalizer is not None:
+        print(normalizer.report(conversion.issues, sum(sizes)))
+    manifest = conversion.manifest(
+        output_files, sizes, compression,
+        [uploads[output_file].uploaded for output_file in output_files])
+    files = [entry for entry in manifest['files']
+             if entry['file'] in output_files]
+    for entry in files:
+        if entry['file'] in validators:
+            entry['schema_violations'] = [
+                format_violation(violation)
+                for violation in validators[entry['file']].close()]
+    client.put_object(
         Bucket=bucket,
-        Key=key,
-        Tagging={
-            'TagSet': [
-                {
-                    'Key': 'upload_type',
-                    'Value': 'csv'
-                },
-            ]
-        }
-    )
-
-    # Add CSV records as dictionaries to import_list
-    for row in input_file:
-        import_list.append(row)
-
-    # Check to see if record is already in issues dictionary.
-    # If not, add the following metadata from import_list to
-    # a new_dictionary in issues.
-    for import_dict in import_list:
-        if import_dict['issueTitle'] not in issues:
-            issues[import_dict['issueTitle']] = {
-                "issueYear": import_dict['issueYear'],
-                "issueVolume": import_dict['issueVolume'],
-                "issueNumber": import_dict['issueNumber'],
-                "issueDatepublished": import_dict['issueDatepublished'],
-                "issueTitle": import_dict['issueTitle'],
-                "issueCover": import_dict['issueCover']}
-
-    for issue_title in issues:
-        sections[issue_title] = []
-        articles[issue_title] = []
-        for import_row in import_list:
-            if import_row['issueTitle'] == issue_title:
-                section = {"sectionTitle": import_row['sectionTitle'],
-                           "sectionAbbrev": import_row['sectionAbbrev']}
-                sections[issue_title].append(section)
-                articles[issue_title].append(import_row)
-    file_number = 0
-    issue_identifier = 1
-    for issue_key, issue_metadata in issues.items():
-        ElementTree.register_namespace("", "http://pkp.sfu.ca")
-        doc = ElementTree.ElementTree(ElementTree.fromstring(xml_header))
-        root = doc.getroot()
-        # The issue element in the resulting XML can take a published attribute
-        # of either a 0 or a 1. This logic tells OJS whether the article should
-        # show as published or not in OJS.
-        if datetime.datetime.strptime(issue_metadata['issueDatepublished'], "%Y-%m-%d") < datetime.datetime.today():
-            is_published = 1
-        elif datetime.datetime.strptime(issue_metadata['issueDatepublished'], "%Y-%m-%d") > datetime.datetime.today():
-            is_published = 0
-        issue = ElementTree.Element("issue", attrib={"current":"0", "published": str(is_published)})
-        issue.append(build_issue_id(issue_identifier))
-
-        issue.append(build_identification(issue_metadata))
-        issue.append(build_date_published(issue_metadata))
-        issue.append(build_sections(sections[issue_key]))
-        if issue_metadata['issueCover'] != '':
-            issue.append(build_cover(issue_metadata))
-        issue.append(build_issue_galleys())
-        doc_articles = ElementTree.Element("articles", {})
-        for import_dict in articles[issue_key]:
-            if 'authorEmail1' not in import_dict:
-                import_dict['authorEmail1'] = ''
-            if 'authorEmail2' not in import_dict:
-                import_dict['authorEmail2'] = ''
-            if 'submission_stage' not in import_dict:
-                import_dict['submission_stage'] = 'submission'
-            if import_dict['fileGenre1'] == '':
-                import_dict['fileGenre1'] = 'Article Text'
-            if 'revision_number' not in import_dict:
-                import_dict['revision_number'] = "1"
-            if import_dict['authorFamilyname1'] == '' or import_dict['authorFamilyname1'] == None or 'authorFamilyname1' not in import_dict:
-                import_dict['authorFamilyname1'] = "Unknown"
-            if import_dict['authorGivenname1'] == '' or import_dict['authorGivenname1'] == None or 'authorGivenname1' not in import_dict:
-                import_dict['authorGivenname1'] = "Unknown"
-
-            import_dict['bucket_location'] = bucket_location
-            file_number += 1
-            import_dict['file_number'] = str(file_number)
-            doc_articles.append(build_article(import_dict))
-        issue.append(doc_articles)
-        root.append(issue)
-
-        conversion_file = "conversion" + str(issue_identifier) + ".xml"
-        output_file = "/tmp/" + conversion_file
-
-        # Increment the issue identifier to create a unique ID for each issue on the fly.
-        # As of version 3.2.1-4, OJS requires these elements.
-        issue_identifier += 1
-
-        pretty_xml = xml.dom.minidom.parseString(ElementTree.tostring(root))
-        open(output_file, 'w').write((pretty_xml.toprettyxml()))
-        s3_resource.meta.client.upload_file(output_file, bucket, conversion_file)
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Converted:\n\t'
-                           + 'Articles: ' + str(file_number) + '\n\t'
-                           + 'Issues: ' + str(len(issues)))}
+        Key=MANIFEST_KEY,
+        Body=json.dumps(manifest, indent=2).encode('utf-8'),
+        ContentType='application/json')
+
+    return report_metrics(
+        status_response(conversion.article_count, len(conversion.issues),
+                        files),
+        context)
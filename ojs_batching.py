@@ -0,0 +1,246 @@
+"""
+ Size-aware batching of issues into OJS import files
+
+ OJS rejects import files above its upload limit, so issues are packed into
+ output files that each stay under a byte limit, and issues too large for one
+ file are split between files by article. Sizes are estimated from the CSV
+ text plus the byte lengths of covers and embedded PDFs, so batches are
+ planned without rendering anything twice.
+
+ Classes:
+    Batch: Issues and article ranges that go into one output file
+
+ Functions:
+    estimate_issue_size: Estimated bytes of an issue without its articles
+    estimate_article_size: Estimated bytes of a single article
+    plan_batches: Packs issues and articles into batches
+    build_manifest: Describes which issues and articles went into which file
+    manifest_entry: Describes a single file of the manifest
+"""
+
+import os
+
+# Bytes of markup written around the text of an issue, of each of its
+# sections and of an article, measured on conversions of examples/import.csv
+# with some headroom.
+ISSUE_MARKUP_BYTES = 700
+SECTION_MARKUP_BYTES = 160
+ARTICLE_MARKUP_BYTES = 1100
+# Keywords and authors add markup per entry on top of ARTICLE_MARKUP_BYTES.
+ENTRY_MARKUP_BYTES = 150
+
+
+class Batch:
+    """
+    The contents of one output file.
+
+    entries holds (issueTitle, first, last) tuples, the issue's articles
+    first to last - 1 are written to the file. An issue split between files
+    appears in several batches with consecutive article ranges.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.estimated_size = 0
+
+    def add(self, issue_key, first, last, size):
+        """
+        Parameters:
+            issue_key (str): issueTitle of the issue.
+            first (int): Index of the first article to include.
+            last (int): Index after the last article to include.
+            size (int): Estimated bytes added to the file.
+        """
+        self.entries.append((issue_key, first, last))
+        self.estimated_size += size
+
+
+def _text_size(text):
+    return len(text.encode("utf-8")) if isinstance(text, str) else 0
+
+
+def estimate_issue_size(issue_metadata, sections, cover_size=0):
+    """
+    Parameters:
+    issue_metadata (dict): Issue key,value pairs
+    sections (dict): Section key,value pairs of the issue keyed by
+    sectionAbbrev
+    cover_size (int): Length of the base64 encoded cover, 0 for none
+
+    Returns:
+    int: Estimated bytes of the issue element excluding its articles
+    """
+    size = ISSUE_MARKUP_BYTES + cover_size
+    size += sum(_text_size(value) for value in issue_metadata.values())
+    for section in sections.values():
+        size += (SECTION_MARKUP_BYTES + 2 * _text_size(section['sectionAbbrev'])
+                 + _text_size(section['sectionTitle']))
+    return size
+
+
+def estimate_article_size(article):
+    """
+    Parameters:
+    article (dict): Article dictionary as passed to build_article
+
+    Returns:
+    int: Estimated bytes of the article element, including the base64
+    encoding of its PDF when it is embedded
+    """
+    size = ARTICLE_MARKUP_BYTES
+    size += sum(_text_size(value) for value in article.values())
+    size += ENTRY_MARKUP_BYTES * article.get('keywords', '').count(';')
+    size += ENTRY_MARKUP_BYTES * sum(
+        1 for key, value in article.items()
+        if key.startswith('authorGivenname') and value)
+    if 'pdf_folder' in article and article['file1']:
+        pdf_size = os.path.getsize(os.path.join(article['pdf_folder'],
+                                                article['file1']))
+        size += -(-pdf_size // 3) * 4
+    return size
+
+
+def plan_batches(issues, sections, articles, max_bytes=None,
+                 cover_size=None):
+    """
+    Pack issues, in order, into batches that each stay under max_bytes.
+
+    An issue that does not fit in the remaining space of the current batch
+    starts a new one. An issue larger than max_bytes on its own is split by
+    article over as many batches as needed; a single article larger than
+    max_bytes gets a batch of its own.
+
+    Parameters:
+    issues (dict): Issue metadata keyed by issueTitle
+    sections (dict): Sections of each issue keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    max_bytes (int): Size limit per file. When None each issue gets its own
+    batch, as the drivers have always done.
+    cover_size (callable): Returns the encoded cover length for an issue's
+    metadata, covers are not counted when None
+
+    Returns:
+    list: Batch objects in output order
+    """
+    if max_bytes is None:
+        batches = []
+        for issue_key in issues:
+            batch = Batch()
+            batch.add(issue_key, 0, len(articles[issue_key]), 0)
+            batches.append(batch)
+        return batches
+
+    batches = [Batch()]
+    for issue_key, issue_metadata in issues.items():
+        cover = 0
+        if cover_size is not None and issue_metadata['issueCover'] != '':
+            cover = cover_size(issue_metadata)
+        first_overhead = estimate_issue_size(issue_metadata,
+                                             sections[issue_key], cover)
+        overhead = first_overhead - cover
+        article_sizes = [estimate_article_size(article)
+                         for article in articles[issue_key]]
+        total = first_overhead + sum(article_sizes)
+
+        current = batches[-1]
+        if current.entries and current.estimated_size + total > max_bytes:
+            current = Batch()
+            batches.append(current)
+        if current.estimated_size + total <= max_bytes:
+            current.add(issue_key, 0, len(article_sizes), total)
+            continue
+
+        # The issue does not fit in a file by itself, split it by article.
+        first = 0
+        size = first_overhead
+        for index, article_size in enumerate(article_sizes):
+            if index > first and size + article_size > max_bytes:
+                current.add(issue_key, first, index, size)
+                current = Batch()
+                batches.append(current)
+                first = index
+                size = overhead
+            size += article_size
+        current.add(issue_key, first, len(article_sizes), size)
+    return [batch for batch in batches if batch.entries]
+
+
+def build_manifest(output_files, batches, issues, articles, issue_identifiers,
+                   max_bytes=None, sizes=None, fingerprints=None,
+                   compression=None, uploaded=None):
+    """
+    Parameters:
+    output_files (list): File names the batches were written to, in order
+    batches (list): Batch objects as returned by plan_batches
+    issues (dict): Issue metadata keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    issue_identifiers (dict): Issue identifiers keyed by issueTitle
+    max_bytes (int): Size limit the batches were planned with
+    sizes (list): Size in bytes of each output file, read from the local
+    files when None
+    fingerprints (dict): Fingerprint of each issue keyed by issueTitle, see
+    ojs_incremental
+    compression (str): Codec the files were compressed with, see
+    ojs_compression
+    uploaded (list): Whether each output file was uploaded, False when the
+    bucket already held it, see ojs_s3.S3UploadStream
+
+    Returns:
+    dict: JSON serializable manifest listing, for each output file, its size
+    and the issues and articles (by file_number) it contains
+    """
+    files = []
+    if sizes is None:
+        sizes = [os.path.getsize(output_file) for output_file in output_files]
+    if uploaded is None:
+        uploaded = [None] * len(output_files)
+    for output_file, batch, size, was_uploaded in zip(output_files, batches,
+                                                      sizes, uploaded):
+        files.append(manifest_entry(output_file, batch, issues, articles,
+                                    issue_identifiers, size, max_bytes,
+                                    fingerprints, compression, was_uploaded))
+    return {"max_bytes": max_bytes, "files": files}
+
+
+def manifest_entry(output_file, batch, issues, articles, issue_identifiers,
+                   size, max_bytes=None, fingerprints=None, compression=None,
+                   uploaded=None):
+    """
+    Parameters:
+    output_file (str): File name the batch was written to
+    batch (Batch): The batch written to the file
+    issues (dict): Issue metadata keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    issue_identifiers (dict): Issue identifiers keyed by issueTitle
+    size (int): Size of the file in bytes, compressed when compression is
+    given
+    max_bytes (int): Size limit the batches were planned with
+    fingerprints (dict): Fingerprint of each issue keyed by issueTitle,
+    recorded with the issues when given
+    compression (str): Codec the file was compressed with, recorded when
+    given. max_bytes and estimated_bytes are uncompressed sizes, the limit
+    applies to the XML OJS imports.
+    uploaded (bool): Whether the file was uploaded, recorded when given
+
+    Returns:
+    dict: The entry describing one file in the manifest
+    """
+    entries = []
+    for issue_key, first, last in batch.entries:
+        issue = {"issueTitle": issues[issue_key]['issueTitle'],
+                 "issue_identifier": issue_identifiers[issue_key]}
+        if fingerprints is not None:
+            issue["fingerprint"] = fingerprints[issue_key]
+        issue["articles"] = [article['file_number'] for article
+                             in articles[issue_key][first:last]]
+        entries.append(issue)
+    entry = {"file": os.path.basename(output_file),
+             "bytes": size}
+    if compression:
+        entry["compression"] = compression
+    if uploaded is not None:
+        entry["uploaded"] = uploaded
+    if max_bytes is not None:
+        entry["estimated_bytes"] = batch.estimated_size
+    entry["issues"] = entries
+    return entry
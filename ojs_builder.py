@@ -5,21 +5,40 @@
     build_sections: Builds SECTIONS Element, a set of Key, Value mappings
     build_article: Builds individual ARTICLE Element,
                    OJS ISSUES comprise of multiple articles
+    write_article: Writes an ARTICLE Element straight to an XMLStreamWriter
+                   using the compiled ARTICLE_SCHEMA
     build_identification: Builds ISSUE IDENTIFICATION Element,
                           ARTICLES use this to map parent-child relationship
 """
 
 import xml.etree.ElementTree as ElementTree
 import base64
+import os
 import urllib3
+from ojs_images import (NormalizedCover,
+                        cover_file_name,
+                        name_mime_type,
+                        sniff_mime_type)
+from ojs_metrics import instrumented
+from ojs_schema import Element, Repeat, field
+from ojs_writer import EmbeddedFile
 
 """
 Instantiate object to handle http connections to retrieve covers
-from s3 bucket (see build_cover function for more details).
+from s3 bucket (see build_cover function for more details). The pool keeps
+enough connections open per host for the concurrent cover downloads done by
+ojs_covers.CoverFetcher to reuse them.
 """
-http = urllib3.PoolManager()
+http = urllib3.PoolManager(maxsize=16)
 
+"""
+Default location covers are downloaded from, the issueCover file name is
+appended to it.
+"""
+COVER_BASE_URL = 'https://ul-theatreorgan.s3.amazonaws.com/pdf/'
 
+
+@instrumented("build_issue_id")
 def build_issue_id(issue_id):
     """
     Parameters:
@@ -36,6 +55,7 @@ def build_issue_id(issue_id):
     return TREE_BUILDER.close()
 
 
+@instrumented("build_issue_galleys")
 def build_issue_galleys():
     """
     Returns:
@@ -52,13 +72,15 @@ def build_issue_galleys():
     return TREE_BUILDER.close()
 
 
+@instrumented("build_sections")
 def build_sections(children):
     """
     Build OJS Sections XML Element
 
     Parameters:
-    children (dict): A Dictionary containing section key,value pairs for OJS
-    import
+    children (dict): Section key,value pairs of an issue keyed by
+    sectionAbbrev, see ojs_reader.index_issues. Sections are numbered in
+    order, so the same issue always gets the same section ids.
 
     Returns:
     Element: XML Element Object containing OJS Sections
@@ -66,7 +88,7 @@ def build_sections(children):
     TREE_BUILDER = ElementTree.TreeBuilder()
     TREE_BUILDER.start("sections", {})
     section_id = 1
-    for element in children:
+    for element in children.values():
         TREE_BUILDER.start("section", {"ref": element['sectionAbbrev']})
         TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
         TREE_BUILDER.data(str(section_id))
@@ -83,6 +105,7 @@ def build_sections(children):
     return TREE_BUILDER.close()
 
 
+@instrumented("build_identification")
 def build_identification(children):
     """
     Build OJS Identification XML Element
@@ -113,32 +136,60 @@ def build_identification(children):
     return TREE_BUILDER.close()
 
 
-def build_cover(children):
+@instrumented("build_cover")
+def build_cover(children, cover_base64=None):
+    """
+    Build OJS Covers XML Element
+
+    Parameters:
+    children (dict): A Dictionary containing issue key,value pairs for OJS
+    import
+    cover_base64 (str): The cover image already encoded as base64, as
+    returned by ojs_covers.CoverFetcher. When omitted the cover is
+    downloaded from COVER_BASE_URL while building the element.
+
+    Returns:
+    Element: XML Element Object containing OJS Covers
+    """
+    if cover_base64 is None:
+        cover_base64 = str(base64.b64encode(http.request(
+            'GET', COVER_BASE_URL + children['issueCover']).data), "utf-8")
+    # A cover normalized by ojs_images is labelled with the type of the
+    # image it was converted to and renamed to match. Other covers keep
+    # their name and are labelled by its extension.
+    cover_image = children['issueCover']
+    mime_type = None
+    if isinstance(cover_base64, NormalizedCover):
+        mime_type = sniff_mime_type(base64.b64decode(cover_base64[:16]))
+    if mime_type is None:
+        mime_type = name_mime_type(cover_image) or "image/jpeg"
+    else:
+        cover_image = cover_file_name(cover_image, mime_type)
     TREE_BUILDER = ElementTree.TreeBuilder()
     TREE_BUILDER.start("covers", {})
     TREE_BUILDER.start("cover", {})
     TREE_BUILDER.start("cover_image", {})
-    TREE_BUILDER.data(children['issueCover'])
+    TREE_BUILDER.data(cover_image)
     TREE_BUILDER.end("cover_image")
     TREE_BUILDER.start("cover_image_alt_text", {})
     TREE_BUILDER.data("")
     TREE_BUILDER.end("cover_image_alt_text")
     TREE_BUILDER.start("embed", {
             "encoding": "base64",
-            "mime_type": "image/jpeg"
+            "mime_type": mime_type
         })
-    # OJS expects cover images to be encoded in the XML as base64. The code
-    # below retrieves the relevant cover images from the s3 bucket using the
-    # urllib3 library, encodes the image, and converts it to a string to be
-    # appended to the embed XML element.
-    TREE_BUILDER.data(str(base64.b64encode(http.request('GET', 'https://ul-theatreorgan.s3.amazonaws.com/pdf/'
-        + children['issueCover']).data), "utf-8"))
+    # OJS expects cover images to be encoded in the XML as base64. The
+    # relevant cover image is retrieved from the s3 bucket using the urllib3
+    # library, encoded, and converted to a string to be appended to the
+    # embed XML element.
+    TREE_BUILDER.data(cover_base64)
     TREE_BUILDER.end("embed")
     TREE_BUILDER.end("cover")
     TREE_BUILDER.end("covers")
     return TREE_BUILDER.close()
 
 
+@instrumented("build_date_published")
 def build_date_published(children):
     """
     Build OJS Publication XML Element
@@ -158,205 +209,164 @@ def build_date_published(children):
     return TREE_BUILDER.close()
 
 
+def _embeds_pdf(children):
+    # generate_xml_embedded.py sets pdf_folder to embed the PDF itself in
+    # the XML, the other drivers set bucket_location to link to it.
+    return 'pdf_folder' in children
+
+
+def _has_pdf(children):
+    # Articles with an empty file1 are imported without a PDF, ojs_validation
+    # warns about them.
+    return bool(children['file1'])
+
+
+def _embedded_pdf(children):
+    return EmbeddedFile(os.path.join(children['pdf_folder'], children['file1']))
+
+
+def _has_keywords(children):
+    return 'keywords' in children
+
+
+def _keywords(children):
+    # Subject/Keywords are separated by a ';' in the spreadsheet therefore
+    # parse it
+    return [{'keyword': keyword} for keyword in children['keywords'].split(';')]
+
+
+def _authors(children):
+    """
+    The authors of an article, from the numbered authorGivennameN,
+    authorFamilynameN, authorAffiliationN and authorEmailN columns. The
+    first author is always included, the others when they have a given name.
+    """
+    authors = []
+    number = 1
+    while 'authorGivenname' + str(number) in children:
+        suffix = str(number)
+        givenname = children['authorGivenname' + suffix]
+        if number == 1 or givenname != '':
+            authors.append({
+                'include_in_browse': "true" if number == 1 else None,
+                'seq': suffix,
+                'givenname': givenname,
+                'familyname': children.get('authorFamilyname' + suffix, ''),
+                'affiliation': children.get('authorAffiliation' + suffix, ''),
+                'email': children.get('authorEmail' + suffix, '')})
+        number += 1
+    return authors
+
+
+INTERNAL_ID = {"type": "internal", "advice": "ignore"}
+
+"""
+Schema of the OJS Article Element written for each row of the CSV, compiled
+into a writer by ojs_schema the first time an article is written.
+"""
+ARTICLE_SCHEMA = Element("article", {
+    "status": "3",
+    "current_publication_id": field('file_number'),
+    "stage": "production"
+}, children=[
+    Element("id", INTERNAL_ID, field('file_number')),
+    Element("submission_file", {
+        "stage": field('submission_stage'),
+        "id": field('file_number')
+    }, children=[
+        Element("revision", {
+            "number": field('revision_number'),
+            "genre": field('fileGenre1'),
+            "filename": field('file1'),
+            "viewable": "true",
+            "filetype": "application/pdf",
+            "uploader": field('uploader')
+        }, children=[
+            Element("name", {"locale": "en_US"}, field('file1')),
+            Element("embed", {"encoding": "base64"}, _embedded_pdf,
+                    when=_embeds_pdf),
+            Element("href", {
+                "src": lambda children: (children['bucket_location']
+                                         + children['file1']),
+                "mime_type": "application/pdf"
+            }, when=lambda children: not _embeds_pdf(children)),
+        ]),
+    ], when=_has_pdf),
+    Element("publication", {
+        "locale": "en_US",
+        "version": "1",
+        "status": "3",
+        "date_published": field('issueDatepublished'),
+        "seq": field('seq'),
+        "section_ref": field('sectionAbbrev')
+    }, children=[
+        Element("id", INTERNAL_ID, field('file_number')),
+        Element("title", {}, field('title')),
+        Element("abstract", {}, field('abstract')),
+        Element("keywords", {}, children=[
+            Repeat(_keywords, Element("keyword", {}, field('keyword'))),
+        ], when=_has_keywords),
+        Element("subjects", {}, children=[
+            Element("subject"),
+        ], when=lambda children: not _has_keywords(children)),
+        Element("authors", {}, children=[
+            Repeat(_authors, Element("author", {
+                "include_in_browse": field('include_in_browse'),
+                "user_group_ref": "Author",
+                "seq": field('seq'),
+                "id": field('seq')
+            }, children=[
+                Element("givenname", {"locale": "en_US"}, field('givenname')),
+                Element("familyname", {"locale": "en_US"},
+                        field('familyname')),
+                Element("affiliation", {}, field('affiliation')),
+                Element("email", {}, field('email')),
+            ])),
+        ]),
+        Element("article_galley", {
+            "locale": "en_US",
+            "approved": "false"
+        }, children=[
+            Element("id", INTERNAL_ID, field('file_number')),
+            Element("name", {"locale": "en_US"}, "PDF"),
+            Element("seq", {}, field('seq')),
+            Element("submission_file_ref", {
+                "id": field('file_number'),
+                "revision": "1"
+            }),
+        ], when=_has_pdf),
+        Element("pages", {}, field('pages')),
+    ]),
+])
+
+
+@instrumented("build_article")
 def build_article(children):
     """
     Build OJS Article XML Element
 
     Parameters:
     children (dict): A Dictionary containing section key,value pairs for OJS
-    import
+    import. When it holds a pdf_folder the PDF is embedded in the revision
+    as base64, otherwise the revision links to bucket_location.
 
     Returns:
-    Element: XML Element Object containing OJS Article
+    Element: XML Element Object containing OJS Article. An embedded PDF is
+    left as an EmbeddedFile so it is only encoded while being written out by
+    ojs_writer.XMLStreamWriter.
     """
+    return ARTICLE_SCHEMA.build(children)
 
-    TREE_BUILDER = ElementTree.TreeBuilder()
-    TREE_BUILDER.start("article", {"status": "3", "current_publication_id": children['file_number'], "stage": "production"})
-    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
-    TREE_BUILDER.data(children["file_number"])
-    TREE_BUILDER.end("id")
-    TREE_BUILDER.start("submission_file", {
-        "stage": children['submission_stage'],
-        "id": children['file_number']
-    })
-    TREE_BUILDER.start("revision", {
-        "number": children['revision_number'],
-        "genre": children['fileGenre1'],
-        "filename": children['file1'],
-        "viewable": "true",
-        "filetype": "application/pdf",
-        "uploader": children['uploader']
-    })
-    TREE_BUILDER.start("name", {"locale": "en_US"})
-    TREE_BUILDER.data(children['file1'])
-    TREE_BUILDER.end("name")
-    # When using this file in conjunction with the generate_xml_embedded.py
-    # script to create the XML file locally, bucket_location below needs
-    # to be switched to pdf_folder.
-    TREE_BUILDER.start("href", {
-        "src": children['bucket_location'] + children['file1'],
-        "mime_type": "application/pdf"
-    })
-    TREE_BUILDER.end("href")
-    TREE_BUILDER.end("revision")
-    TREE_BUILDER.end("submission_file")
-    TREE_BUILDER.start("publication", {
-        "locale": "en_US",
-        "version": "1",
-        "status": "3",
-        "date_published": children['issueDatepublished'],
-        "seq": children['seq'],
-        "section_ref": children['sectionAbbrev']
-    })
-    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
-    TREE_BUILDER.data(children['file_number'])
-    TREE_BUILDER.end("id")
-    TREE_BUILDER.start("title", {})
-    TREE_BUILDER.data(children['title'])
-    TREE_BUILDER.end("title")
-    TREE_BUILDER.start("abstract", {})
-    TREE_BUILDER.data(children['abstract'])
-    TREE_BUILDER.end("abstract")
-    # Subject/Keywords are separated by a ';' in the spreadsheet therefore
-    # parse it
-    if 'keywords' in children:
-        TREE_BUILDER.start('keywords', {})
-        for keyword in children['keywords'].split(';'):
-            TREE_BUILDER.start('keyword', {})
-            TREE_BUILDER.data(keyword)
-            TREE_BUILDER.end("keyword")
-        TREE_BUILDER.end("keywords")
-    elif 'keywords' in children:
-        TREE_BUILDER.start('keywords', {})
-        for keyword in children['keywords'].split(';'):
-            TREE_BUILDER.start('subject', {})
-            TREE_BUILDER.data(keyword)
-            TREE_BUILDER.end("subject")
-        TREE_BUILDER.end("subjects")
-    else:
-        TREE_BUILDER.start("subjects", {})
-        TREE_BUILDER.start("subject", {})
-        TREE_BUILDER.end("subject")
-        TREE_BUILDER.end("subjects")
-    TREE_BUILDER.start("authors", {})
-    TREE_BUILDER.start("author", {
-        "include_in_browse": "true",
-        "user_group_ref": "Author",
-        "seq": "1",
-        "id": "1"
-        })
-    TREE_BUILDER.start("givenname", {"locale":"en_US"})
-    TREE_BUILDER.data(children['authorGivenname1'])
-    TREE_BUILDER.end("givenname")
-    TREE_BUILDER.start("familyname", {"locale":"en_US"})
-    TREE_BUILDER.data(children['authorFamilyname1'])
-    TREE_BUILDER.end("familyname")
-    TREE_BUILDER.start("affiliation", {})
-    TREE_BUILDER.data(children['authorAffiliation1'])
-    TREE_BUILDER.end("affiliation")
-    TREE_BUILDER.start("email", {})
-    TREE_BUILDER.data(children['authorEmail1'])
-    TREE_BUILDER.end("email")
-    TREE_BUILDER.end("author")
-    if children['authorGivenname2'] != '':
-        TREE_BUILDER.start("author", {
-            "user_group_ref": "Author",
-            "seq": "2",
-            "id": "2"
-            })
-        TREE_BUILDER.start("givenname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorGivenname2'])
-        TREE_BUILDER.end("givenname")
-        TREE_BUILDER.start("familyname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorFamilyname2'])
-        TREE_BUILDER.end("familyname")
-        TREE_BUILDER.start("affiliation", {})
-        TREE_BUILDER.data(children['authorAffiliation2'])
-        TREE_BUILDER.end("affiliation")
-        TREE_BUILDER.start("email", {})
-        TREE_BUILDER.data(children['authorEmail2'])
-        TREE_BUILDER.end("email")
-        TREE_BUILDER.end("author")
-    if children['authorGivenname3'] != '':
-        TREE_BUILDER.start("author", {
-            "user_group_ref": "Author",
-            "seq": "3",
-            "id": "3"
-            })
-        TREE_BUILDER.start("givenname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorGivenname3'])
-        TREE_BUILDER.end("givenname")
-        TREE_BUILDER.start("familyname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorFamilyname3'])
-        TREE_BUILDER.end("familyname")
-        TREE_BUILDER.start("affiliation", {})
-        TREE_BUILDER.data(children['authorAffiliation3'])
-        TREE_BUILDER.end("affiliation")
-        TREE_BUILDER.start("email", {})
-        TREE_BUILDER.data(children['authorEmail3'])
-        TREE_BUILDER.end("email")
-        TREE_BUILDER.end("author")
-    if children['authorGivenname4'] != '':
-        TREE_BUILDER.start("author", {
-            "user_group_ref": "Author",
-            "seq": "4",
-            "id": "4"
-            })
-        TREE_BUILDER.start("givenname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorGivenname4'])
-        TREE_BUILDER.end("givenname")
-        TREE_BUILDER.start("familyname", {"locale":"en_US"})
-        TREE_BUILDER.data(children['authorFamilyname4'])
-        TREE_BUILDER.end("familyname")
-        TREE_BUILDER.start("affiliation", {})
-        TREE_BUILDER.data(children['authorAffiliation4'])
-        TREE_BUILDER.end("affiliation")
-        TREE_BUILDER.start("email", {})
-        TREE_BUILDER.data(children['authorEmail4'])
-        TREE_BUILDER.end("email")
-        TREE_BUILDER.end("author")
-    if children['authorGivenname5'] != '':
-        TREE_BUILDER.start("author", {
-            "user_group_ref": "Author",
-            "seq": "5",
-            "id": "5"
-        })
-        TREE_BUILDER.start("givenname", {"locale": "en_US"})
-        TREE_BUILDER.data(children['authorGivenname5'])
-        TREE_BUILDER.end("givenname")
-        TREE_BUILDER.start("familyname", {"locale": "en_US"})
-        TREE_BUILDER.data(children['authorFamilyname5'])
-        TREE_BUILDER.end("familyname")
-        TREE_BUILDER.start("affiliation", {})
-        TREE_BUILDER.data(children['authorAffiliation5'])
-        TREE_BUILDER.end("affiliation")
-        TREE_BUILDER.start("email", {})
-        TREE_BUILDER.data(children['authorEmail5'])
-        TREE_BUILDER.end("email")
-        TREE_BUILDER.end("author")
-    TREE_BUILDER.end("authors")
-    TREE_BUILDER.start("article_galley", {
-        "locale": "en_US",
-        "approved": "false"
-    })
-    TREE_BUILDER.start("id", {"type": "internal", "advice": "ignore"})
-    TREE_BUILDER.data(children['file_number'])
-    TREE_BUILDER.end("id")
-    TREE_BUILDER.start("name", {"locale": "en_US"})
-    TREE_BUILDER.data("PDF")
-    TREE_BUILDER.end("name")
-    TREE_BUILDER.start("seq", {})
-    TREE_BUILDER.data(children['seq'])
-    TREE_BUILDER.end("seq")
-    TREE_BUILDER.start("submission_file_ref", {
-        "id": children['file_number'],
-        "revision": "1"
-    })
-    TREE_BUILDER.end("submission_file_ref")
-    TREE_BUILDER.end("article_galley")
-    TREE_BUILDER.start("pages", {})
-    TREE_BUILDER.data(children['pages'])
-    TREE_BUILDER.end("pages")
-    TREE_BUILDER.end("publication")
-    TREE_BUILDER.end("article")
-    return TREE_BUILDER.close()
+
+@instrumented("write_article")
+def write_article(writer, children):
+    """
+    Write an OJS Article Element straight to the output, the same XML as
+    writing build_article(children) without building any Element.
+
+    Parameters:
+    writer (XMLStreamWriter): Writer positioned inside the <articles> element
+    children (dict): A Dictionary containing section key,value pairs for OJS
+    import, see build_article
+    """
+    ARTICLE_SCHEMA.write(writer, children)
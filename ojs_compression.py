@@ -0,0 +1,198 @@
+"""
+ Compressed output files
+
+ Conversion files are compressed while they are written instead of in a
+ separate step afterwards: the XML text is buffered, encoded and passed
+ through the compressor in chunks, so the uncompressed document is never
+ held in memory or written to disk. gzip is always available, zstd when the
+ zstandard package is installed.
+
+ Functions:
+    get_codec: Looks up a codec by name, None for uncompressed output
+    compressed_name: Output file name with the extension of a codec
+    open_compressed: Opens a local file for reading, decompressing it by
+                     its extension
+
+ Classes:
+    Codec: File extension, HTTP Content-Encoding and compressor of a format
+    CompressedWriter: Text file-like object compressing what is written to
+                      it into a binary stream
+"""
+
+import collections
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codec(collections.namedtuple("Codec", ("name", "extension",
+                                             "content_encoding", "level",
+                                             "compressobj"))):
+    """
+    A compression format.
+
+    Attributes:
+        name (str): Name the format is selected by.
+        extension (str): Added to the name of local output files.
+        content_encoding (str): HTTP Content-Encoding of the format.
+        level (int): Default compression level.
+        compressobj (callable): Takes a level and returns an object with
+                                compress and flush methods.
+    """
+
+    __slots__ = ()
+
+
+def _gzip_compressobj(level):
+    # wbits 31 writes the gzip header and trailer around the deflate stream.
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _zstd_compressobj(level):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+CODECS = {
+    "gzip": Codec("gzip", ".gz", "gzip", 6, _gzip_compressobj),
+    "zstd": Codec("zstd", ".zst", "zstd", 3, _zstd_compressobj),
+}
+
+
+def get_codec(name):
+    """
+    Parameters:
+        name (str): gzip or zstd, None or '' for uncompressed output.
+
+    Returns:
+        Codec: The codec, None for uncompressed output.
+
+    Raises:
+        ValueError: When the codec is unknown or its package is missing.
+    """
+    if not name:
+        return None
+    if name not in CODECS:
+        raise ValueError("Unknown compression %r, expected one of %s"
+                         % (name, ", ".join(CODECS)))
+    if name == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return CODECS[name]
+
+
+def compressed_name(output_file, compression):
+    """
+    Parameters:
+        output_file (str): Name of the uncompressed file, e.g.
+                           conversion1.xml.
+        compression (str): Codec name, None for uncompressed output.
+
+    Returns:
+        str: The name with the codec's extension, e.g. conversion1.xml.gz.
+    """
+    codec = get_codec(compression)
+    return output_file if codec is None else output_file + codec.extension
+
+
+def open_compressed(path):
+    """
+    Parameters:
+        path (str): A local file, compressed when its name ends in the
+                    extension of a codec, e.g. conversion1.xml.gz.
+
+    Returns:
+        file: Binary file object reading the decompressed bytes.
+
+    Raises:
+        ValueError: When the file is zstd compressed and the zstandard
+                    package is missing.
+    """
+    if path.endswith(CODECS["gzip"].extension):
+        return gzip.open(path, "rb")
+    if path.endswith(CODECS["zstd"].extension):
+        get_codec("zstd")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"),
+                                                          closefd=True)
+    return open(path, "rb")
+
+
+class CompressedWriter:
+    """
+    Compress text written to this object into a binary stream.
+
+    Writes are collected until BUFFER_SIZE characters are pending and then
+    encoded and compressed together, the XML writer making many small
+    writes. Closing ends the compressed stream and closes the binary
+    stream. Used as a context manager, an exception is passed on to the
+    binary stream, e.g. so an S3UploadStream aborts its upload.
+    """
+
+    BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, raw, codec, level=None, encoding='utf-8'):
+        """
+        Parameters:
+            raw (file): Binary stream the compressed data is written to, a
+                        file opened in "wb" mode or an S3UploadStream.
+            codec (Codec): Compression format, see get_codec.
+            level (int): Compression level, the codec's default when None.
+            encoding (str): Encoding of the text before compression.
+        """
+        self.raw = raw
+        self.codec = codec
+        self.compressor = codec.compressobj(codec.level if level is None
+                                            else level)
+        self.encoding = encoding
+        self.pending = []
+        self.pending_size = 0
+        self.uncompressed_bytes = 0
+        self.finished = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.finish()
+        return self.raw.__exit__(exc_type, *exc_info)
+
+    def write(self, text):
+        """
+        Parameters:
+            text (str): Text to compress.
+        """
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.BUFFER_SIZE:
+            self._compress_pending()
+        return len(text)
+
+    def _compress_pending(self):
+        data = "".join(self.pending).encode(self.encoding)
+        self.pending = []
+        self.pending_size = 0
+        self.uncompressed_bytes += len(data)
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.raw.write(compressed)
+
+    def finish(self):
+        """
+        Compress the pending text and end the compressed stream, leaving the
+        binary stream open.
+        """
+        if self.finished:
+            return
+        self._compress_pending()
+        self.raw.write(self.compressor.flush())
+        self.finished = True
+
+    def close(self):
+        """
+        End the compressed stream and close the binary stream.
+        """
+        self.finish()
+        self.raw.close()
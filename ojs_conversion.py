@@ -0,0 +1,596 @@
+"""
+ Conversion API
+
+ The conversion pipeline as a library, used by generate_xml.py,
+ generate_xml_embedded.py, convert_journals.py and the Lambda alike: rows
+ of an import CSV in, OJS native import XML out. Rows can come from any
+ iterable, a CSV file, an S3 stream or a database query, and the XML can be
+ written to conversion files, streamed to S3 uploads or handed to the
+ caller one issue at a time as it is rendered.
+
+    for issue, chunks in convert(csv.DictReader(csv_file),
+                                 {'bucket_location': bucket_location}):
+        for chunk in chunks:
+            sock.sendall(chunk)
+
+ The drivers share the steps around it: start_conversion takes a
+ conversion as far as planning its files, convert_files goes on to write
+ them, check them against the schema and record the manifest.
+
+ Functions:
+    convert: Lazily yields each issue of some rows as an import document
+    read_manifest: Reads the manifest of a previous conversion
+    start_conversion: Checks, plans and starts the covers of a conversion
+    convert_files: Converts rows into conversion files and a manifest
+    print_summary: Prints what convert_files did, for the scripts
+
+ Classes:
+    Conversion: The rows of one conversion, checked, grouped by issue and
+                numbered, and the steps converting them
+    ConvertedFiles: What convert_files wrote
+"""
+
+import collections
+import functools
+import json
+import os
+from ojs_batching import build_manifest, plan_batches
+from ojs_builder import COVER_BASE_URL
+from ojs_compression import compressed_name
+from ojs_covers import CoverFetcher
+from ojs_images import DEFAULT_QUALITY, CoverNormalizer
+from ojs_incremental import (fingerprint_issues,
+                             format_changes,
+                             merge_manifest,
+                             plan_incremental)
+from ojs_metrics import active, count, stage
+from ojs_pipeline import (CHUNK_SIZE,
+                          iter_issue_document,
+                          open_output,
+                          write_batches)
+from ojs_preflight import (HTTPObjects,
+                           check_references,
+                           collect_references)
+from ojs_reader import index_issues, number_articles, read_rows
+from ojs_validation import ValidationError, format_problems, validate
+from ojs_xsd import SchemaViolations, load_schema, validate_files
+
+"""
+Name of the manifest the drivers write next to the conversion files.
+"""
+MANIFEST_FILE = "conversion_manifest.json"
+
+"""
+Parameters of convert_files that generate_xml.py and
+generate_xml_embedded.py set as module variables of the same name.
+"""
+SCRIPT_SETTINGS = ("manifest_file", "cover_base_url", "preflight",
+                   "incremental", "max_file_size", "compression",
+                   "cover_max_dimension", "cover_quality", "validate_xml",
+                   "workers")
+
+
+class Conversion:
+    """
+    Rows of an import CSV ready to be converted: checked, grouped by issue,
+    numbered and fingerprinted.
+
+    The steps of a conversion are methods called in order: preflight and
+    plan_incremental when wanted, fetch_covers, then either iter_issues for
+    one document per issue, or plan_batches, write_batches and manifest for
+    conversion files. close stops the cover downloads.
+    """
+
+    def __init__(self, rows, defaults=None, cover_base_url=COVER_BASE_URL,
+                 pdfs=None):
+        """
+        Parameters:
+            rows (iterable): Rows of an import CSV, ArticleRecords as read
+                             by ojs_reader.read_records or dictionaries such
+                             as csv.DictReader rows. Every row is read up
+                             front: the whole CSV is checked before anything
+                             is converted, and the rows of an issue need not
+                             be next to each other.
+            defaults (dict): Values of extra keys every dictionary row
+                             should have, bucket_location to link the PDFs
+                             or pdf_folder to embed them.
+            cover_base_url (str): URL the issueCover file names are
+                                  appended to.
+            pdfs: Where the PDFs are, an ojs_preflight S3Objects,
+                  HTTPObjects or LocalFiles, looked up by preflight and
+                  plan_incremental. Their sizes and ETags, or modification
+                  times, are then part of the fingerprints. PDFs only count
+                  by name in the fingerprints when None.
+
+        Raises:
+            ValidationError: When the rows have errors, the warnings are
+                             kept in warnings otherwise.
+        """
+        self.cover_base_url = cover_base_url
+        self.pdfs = pdfs
+        self.cover_files = HTTPObjects(cover_base_url)
+        # Rows are read into compact records carrying the article defaults.
+        with stage("read_csv"):
+            self.records = list(read_rows(rows, defaults))
+        # The whole CSV is checked before any cover is downloaded or any XML
+        # is written, every problem is reported at once.
+        with stage("validate"):
+            self.warnings = validate(self.records)
+        # Number the issues and articles up front so the output can be split
+        # into files independently of the order they are written in.
+        with stage("prepare"):
+            self.issues, self.sections, self.articles = index_issues(
+                self.records)
+            self.issue_identifiers = number_articles(self.issues,
+                                                     self.articles)
+        self._fingerprints = None
+        self.looked_up = False
+        self.plan = None
+        self.first_file = 1
+        self.covers = None
+        self.batches = None
+        self.max_file_size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def article_count(self):
+        """
+        int: Number of articles in the issues converted.
+        """
+        return sum(len(self.articles[issue_key]) for issue_key in self.issues)
+
+    @property
+    def fingerprints(self):
+        """
+        dict: Fingerprint of each issue keyed by issueTitle, see
+              ojs_incremental.fingerprint_issue. They are recorded in the
+              manifest, an incremental conversion compares them against the
+              previous manifest and skips the issues that did not change.
+              The sizes and ETags of the PDFs and covers are only part of
+              them once preflight or plan_incremental looked the files up,
+              otherwise, or when looking them up again fails, issues are
+              fingerprinted with the names of their files.
+        """
+        if self._fingerprints is None:
+            with stage("fingerprint"):
+                try:
+                    self._fingerprints = self._fingerprint(self.looked_up)
+                except Exception:  # pylint: disable=broad-except
+                    # The XML may already be written, the manifest must
+                    # still be.
+                    self._fingerprints = self._fingerprint(False)
+        return self._fingerprints
+
+    def _fingerprint(self, look_up):
+        pdfs = covers = None
+        if look_up:
+            if self.pdfs is not None:
+                pdfs = self.pdfs.lookup(
+                    collect_references(self.records, 'file1'))
+            covers = self.cover_files.lookup(
+                collect_references(self.records, 'issueCover'))
+        return fingerprint_issues(self.issues, self.sections, self.articles,
+                                  self.cover_base_url, pdfs, covers)
+
+    def preflight(self, pdfs=None):
+        """
+        Look up every PDF and cover before any XML is written.
+
+        Parameters:
+            pdfs: Where the PDFs are, an ojs_preflight S3Objects,
+                  HTTPObjects or LocalFiles, the pdfs of the conversion when
+                  None. Covers are looked up at cover_base_url.
+
+        Raises:
+            ValidationError: Listing the missing and empty files with the
+                             rows using them.
+        """
+        with stage("preflight"):
+            problems = check_references(
+                self.records, pdfs if pdfs is not None else self.pdfs,
+                self.cover_files)
+        # The sizes found are kept by the stores for the fingerprints.
+        self.looked_up = pdfs is None
+        if problems:
+            raise ValidationError(problems)
+
+    def plan_incremental(self, previous):
+        """
+        Only convert the issues added or changed since a previous
+        conversion, into files numbered after the ones it wrote.
+
+        Parameters:
+            previous (dict): Manifest of the previous conversion, None when
+                             there was none.
+
+        Returns:
+            dict: The plan, see ojs_incremental.plan_incremental.
+
+        The PDFs and covers are looked up before anything is converted, a
+        failed lookup is raised rather than every issue counting as changed.
+        """
+        with stage("fingerprint"):
+            self._fingerprints = self._fingerprint(True)
+            names_only = self._fingerprint(False)
+        self.looked_up = True
+        self.plan = plan_incremental(previous, self._fingerprints, names_only)
+        self.issues = {issue_key: self.issues[issue_key]
+                       for issue_key in self.plan['convert']}
+        self.first_file = self.plan['next_file']
+        return self.plan
+
+    def fetch_covers(self, cache=None, executor=None, normalizer=None,
+                     prefetch=True):
+        """
+        Start downloading the covers of the issues converted in parallel,
+        before any XML is built.
+
+        Parameters:
+            cache (CoverCache): Cache of the covers downloaded earlier.
+            executor (ThreadPoolExecutor): Download threads shared with
+                                           other conversions.
+            normalizer (CoverNormalizer): Scales down and recompresses the
+                                          covers, see ojs_images.
+            prefetch (bool): When False covers are only downloaded once
+                             asked for.
+
+        Returns:
+            CoverFetcher: The fetcher the covers are taken from.
+        """
+        self.covers = CoverFetcher(self.cover_base_url, cache=cache,
+                                   executor=executor, normalizer=normalizer)
+        if prefetch:
+            self.covers.prefetch(issue['issueCover']
+                                 for issue in self.issues.values())
+        return self.covers
+
+    def iter_issues(self, chunk_size=CHUNK_SIZE):
+        """
+        Render each issue as a complete import document, lazily.
+
+        Parameters:
+            chunk_size (int): Characters rendered before a chunk is handed
+                              out, see ojs_pipeline.iter_issue_document.
+
+        Returns:
+            generator: (issue metadata, chunks) for each issue, in the order
+                       it first appears in the rows. chunks is a generator
+                       of the UTF-8 bytes of the issue's document, rendered
+                       as they are taken.
+        """
+        if self.covers is None:
+            self.fetch_covers()
+        for issue_key, issue_metadata in self.issues.items():
+            cover_base64 = None
+            if issue_metadata['issueCover'] != '':
+                cover_base64 = self.covers.get(issue_metadata['issueCover'])
+            yield issue_metadata, iter_issue_document(
+                self.issue_identifiers[issue_key], issue_metadata,
+                self.sections[issue_key], self.articles[issue_key],
+                cover_base64, chunk_size)
+
+    def plan_batches(self, max_file_size=None):
+        """
+        Parameters:
+            max_file_size (int): Largest size in bytes of a conversion file,
+                                 each issue gets its own file when None.
+
+        Returns:
+            list: The Batch of each conversion file, see
+                  ojs_batching.plan_batches.
+        """
+        if self.covers is None:
+            self.fetch_covers()
+        with stage("plan"):
+            self.batches = plan_batches(
+                self.issues, self.sections, self.articles, max_file_size,
+                lambda issue: self.covers.encoded_size(issue['issueCover']))
+        self.max_file_size = max_file_size
+        return self.batches
+
+    def file_names(self, compression=None, directory=""):
+        """
+        Parameters:
+            compression (str): Codec whose extension the names take.
+            directory (str): Directory the files are written to.
+
+        Returns:
+            list: conversionN.xml file name of each batch, numbered after
+                  the files kept by an incremental conversion.
+        """
+        return [os.path.join(directory, compressed_name(
+                    "conversion" + str(number) + ".xml", compression))
+                for number in range(self.first_file,
+                                    self.first_file + len(self.batches))]
+
+    def write_batches(self, output_files, opener=open_output, workers=1,
+                      executor=None):
+        """
+        Write each batch to its conversion file.
+
+        Parameters:
+            output_files (list): Name of the file of each batch.
+            opener (callable): Opens a file for writing given its name, see
+                               ojs_pipeline.write_batches.
+            workers (int): Processes rendering the files, 1 renders them in
+                           this process.
+            executor (ProcessPoolExecutor): Processes shared with other
+                                            conversions.
+
+        Returns:
+            list: The names of the files written.
+        """
+        with stage("write"):
+            return list(write_batches(
+                self.batches, output_files, self.issues, self.sections,
+                self.articles, self.issue_identifiers, self.covers, workers,
+                opener, executor))
+
+    def manifest(self, output_files, sizes=None, compression=None,
+                 uploaded=None):
+        """
+        Parameters:
+            output_files (list): Names of the files written.
+            sizes (list): Bytes of each file, read from the files when None.
+            compression (str): Codec the files were compressed with.
+            uploaded (list): Whether each file was uploaded.
+
+        Returns:
+            dict: The manifest of the conversion, see
+                  ojs_batching.build_manifest, listing the files kept by an
+                  incremental conversion before the ones written.
+        """
+        manifest = build_manifest(output_files, self.batches, self.issues,
+                                  self.articles, self.issue_identifiers,
+                                  self.max_file_size, sizes,
+                                  self.fingerprints, compression, uploaded)
+        if self.plan is not None:
+            manifest = merge_manifest(manifest, self.plan)
+        return manifest
+
+    def close(self):
+        """
+        Stop the cover downloads.
+        """
+        if self.covers is not None:
+            self.covers.close()
+
+
+def convert(rows, defaults=None, cover_base_url=COVER_BASE_URL,
+            cover_cache=None, normalizer=None, chunk_size=CHUNK_SIZE):
+    """
+    Convert rows of an import CSV into OJS import documents, one per issue,
+    lazily.
+
+    Parameters:
+    rows (iterable): Rows of an import CSV, see Conversion
+    defaults (dict): Values of extra keys every dictionary row should have,
+    bucket_location to link the PDFs or pdf_folder to embed them
+    cover_base_url (str): URL the issueCover file names are appended to
+    cover_cache (CoverCache): Cache of the covers downloaded earlier
+    normalizer (CoverNormalizer): Scales down and recompresses the covers
+    chunk_size (int): Characters rendered before a chunk is handed out
+
+    Returns:
+    generator: (issue metadata, chunks) for each issue, see
+    Conversion.iter_issues. The rows are read and checked when the first
+    issue is taken, which raises ValidationError when they have errors.
+    """
+    with Conversion(rows, defaults, cover_base_url) as conversion:
+        conversion.fetch_covers(cache=cover_cache, normalizer=normalizer)
+        yield from conversion.iter_issues(chunk_size)
+
+
+class ConvertedFiles(collections.namedtuple(
+        "ConvertedFiles", ("conversion", "output_files", "manifest", "bytes",
+                           "covers", "violations"))):
+    """
+    What convert_files wrote.
+
+    Attributes:
+        conversion (Conversion): The conversion, its plan holding the
+                                 changes of an incremental one.
+        output_files (list): Paths of the conversion files written.
+        manifest (dict): The manifest written.
+        bytes (int): Size of the conversion files written.
+        covers (str): Report of the covers normalized, None when they were
+                      not.
+        violations (list): Every ojs_xsd.Violation found in the files, empty
+                           when they were not checked.
+    """
+
+    __slots__ = ()
+
+
+def read_manifest(path):
+    """
+    Parameters:
+    path (str): Path of the manifest of a previous conversion
+
+    Returns:
+    dict: The manifest, None when there is none
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as manifest:
+        return json.load(manifest)
+
+
+def start_conversion(rows, defaults=None, cover_base_url=COVER_BASE_URL,
+                     pdfs=None, preflight=False, previous=None,
+                     max_file_size=None, cover_cache=None,
+                     cover_executor=None, normalizer=None, prefetch=True,
+                     validate_xml=False, warn=print):
+    """
+    Check the rows of a conversion, plan its files and start downloading
+    the covers, the steps every driver takes before writing any XML.
+
+    Parameters:
+    rows (iterable): Rows of an import CSV, see Conversion
+    defaults (dict): Values of extra keys every dictionary row should have
+    cover_base_url (str): URL the issueCover file names are appended to
+    pdfs: Where the PDFs are, see ojs_preflight.pdf_objects
+    preflight (bool): Look up every PDF and cover first
+    previous (callable): Returns the manifest of the previous conversion, or
+    None when there was none, for an incremental conversion. Every issue is
+    converted when None
+    max_file_size (int): Largest size in bytes of a conversion file, each
+    issue gets its own file when None
+    cover_cache (CoverCache): Cache of the covers downloaded earlier
+    cover_executor (ThreadPoolExecutor): Download threads shared with other
+    conversions
+    normalizer (CoverNormalizer): Scales down and recompresses the covers
+    prefetch (bool): When False covers are only downloaded once asked for
+    validate_xml (bool): The files will be checked against the schema, which
+    is loaded first so a missing lxml fails before anything is converted
+    warn (callable): Given the warnings about the rows, when there are any
+
+    Returns:
+    Conversion: The conversion, its batches planned
+
+    Raises:
+    ValidationError: When the rows have errors, or preflight finds missing
+    or empty files
+    """
+    if validate_xml:
+        load_schema()
+    conversion = Conversion(rows, defaults, cover_base_url, pdfs)
+    if conversion.warnings:
+        warn(format_problems(conversion.warnings))
+    if preflight:
+        conversion.preflight()
+    if previous is not None:
+        conversion.plan_incremental(previous())
+    try:
+        conversion.fetch_covers(cover_cache, cover_executor, normalizer,
+                                prefetch)
+        conversion.plan_batches(max_file_size)
+    except BaseException:
+        conversion.close()
+        raise
+    return conversion
+
+
+def convert_files(rows, defaults=None, output_dir="",
+                  manifest_file=MANIFEST_FILE, cover_base_url=COVER_BASE_URL,
+                  pdfs=None, preflight=False, incremental=False,
+                  max_file_size=None, compression=None,
+                  cover_max_dimension=None, cover_quality=DEFAULT_QUALITY,
+                  validate_xml=False, workers=1, executor=None,
+                  cover_cache=None, cover_executor=None, warn=print):
+    """
+    Convert rows of an import CSV into conversionN.xml files and a
+    manifest, as generate_xml.py, generate_xml_embedded.py and
+    convert_journals.py do.
+
+    Parameters:
+    rows (iterable): Rows of an import CSV, see Conversion
+    defaults (dict): Values of extra keys every dictionary row should have,
+    bucket_location to link the PDFs or pdf_folder to embed them
+    output_dir (str): Directory the files are written to, made once the
+    rows are checked
+    manifest_file (str): Name of the manifest in output_dir
+    cover_base_url (str): URL the issueCover file names are appended to
+    pdfs: Where the PDFs are, see ojs_preflight.pdf_objects
+    preflight (bool): Look up every PDF and cover before writing any XML
+    incremental (bool): Only convert the issues added or changed since the
+    conversion recorded in the manifest, into new files
+    max_file_size (int): Largest size in bytes of a conversion file, each
+    issue gets its own file when None
+    compression (str): Codec compressing the files, see ojs_compression
+    cover_max_dimension (int): Covers larger than this many pixels are
+    scaled down, and every cover recompressed at cover_quality, see
+    ojs_images. Covers are embedded as they are when None
+    cover_quality (int): Quality covers are recompressed at
+    validate_xml (bool): Check the files written against the schema
+    workers (int): Processes rendering, and checking, the files, 1 renders
+    them in this process
+    executor (ProcessPoolExecutor): Processes shared with other
+    conversions, used instead of workers
+    cover_cache (CoverCache): Cache of the covers downloaded earlier
+    cover_executor (ThreadPoolExecutor): Download threads shared with other
+    conversions
+    warn (callable): Given the warnings about the rows, when there are any
+
+    Returns:
+    ConvertedFiles: What was written. Violations of the schema are returned
+    rather than raised, the manifest is written either way
+
+    Raises:
+    ValidationError: When the rows have errors, or preflight finds missing
+    or empty files
+    """
+    manifest_path = os.path.join(output_dir, manifest_file)
+    normalizer = None
+    if cover_max_dimension:
+        # Covers are normalized by the rendering workers, shared or not, or
+        # in the download threads when files are rendered in this process.
+        processes = 0
+        if executor is None and workers is not None and workers > 1:
+            processes = workers
+        normalizer = CoverNormalizer(cover_max_dimension, cover_quality,
+                                     processes, executor)
+    try:
+        with start_conversion(
+                rows, defaults, cover_base_url, pdfs, preflight,
+                functools.partial(read_manifest, manifest_path)
+                if incremental else None,
+                max_file_size, cover_cache, cover_executor, normalizer,
+                validate_xml=validate_xml, warn=warn) as conversion:
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            output_files = conversion.write_batches(
+                conversion.file_names(compression, output_dir),
+                functools.partial(open_output, compression=compression),
+                workers, executor)
+    finally:
+        if normalizer is not None:
+            normalizer.close()
+
+    violations = []
+    if validate_xml:
+        # Files are checked by the rendering workers when they are shared,
+        # and in this process when they are rendered in it.
+        checkers = workers if executor is None and workers else 1
+        with stage("validate_xml"):
+            violations = validate_files(output_files, checkers, executor)
+
+    manifest = conversion.manifest(output_files, compression=compression)
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_output:
+        json.dump(manifest, manifest_output, indent=2)
+
+    xml_bytes = sum(entry["bytes"] for entry in manifest["files"]
+                    if os.path.join(output_dir, entry["file"]) in output_files)
+    count("bytes_written", xml_bytes)
+    covers = None
+    if normalizer is not None:
+        covers = normalizer.report(conversion.issues, xml_bytes)
+    return ConvertedFiles(conversion, output_files, manifest, xml_bytes,
+                          covers, violations)
+
+
+def print_summary(files):
+    """
+    Print the changes of an incremental conversion, the covers normalized
+    and the metrics recorded, if any.
+
+    Parameters:
+    files (ConvertedFiles): What convert_files wrote
+
+    Raises:
+    SchemaViolations: When the files do not match the schema
+    """
+    if files.conversion.plan is not None:
+        print(format_changes(files.conversion.plan['changes']))
+    if files.covers is not None:
+        print(files.covers)
+    if active() is not None:
+        print(json.dumps({"metrics": active().summary()}))
+    if files.violations:
+        raise SchemaViolations(files.violations)
+
@@ -0,0 +1,485 @@
+"""
+ Concurrent retrieval of OJS issue cover images
+
+ Covers are downloaded ahead of time through a bounded thread pool that
+ shares the ojs_builder urllib3.PoolManager, so building the XML never waits
+ on a network round-trip once the first few covers have arrived. Only a
+ window of covers is downloaded ahead of the ones built.
+
+ Encoded covers can be kept in an on-disk CoverCache so repeated conversions
+ of the same CSV, or warm Lambda containers, do not download them again:
+ a cached cover is used without any request, or once it is older than the
+ cache's max_age, after a conditional request checking it has not changed.
+ Covers can also be scaled down and recompressed before they are encoded,
+ see ojs_images.CoverNormalizer.
+
+ Classes:
+    CoverFetcher: Downloads and base64-encodes covers in parallel, handing
+                  the results to ojs_builder.build_cover
+    CoverCache: Size-bounded LRU cache of base64-encoded covers on disk
+    CoverFetchError: Raised when a cover cannot be retrieved
+
+ Functions:
+    environment_cache: CoverCache set by the Lambda environment
+"""
+
+import base64
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+import ojs_builder
+from ojs_images import NormalizedCover
+from ojs_metrics import count, instrumented
+
+"""
+Default cache location, /tmp on Lambda so warm containers share it.
+"""
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "ojs_cover_cache")
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _decoded_size(payload):
+    """
+    Returns:
+        int: Bytes encoded by a base64 payload.
+    """
+    return len(payload) // 4 * 3 - (len(payload) - len(payload.rstrip("=")))
+
+
+def environment_cache():
+    """
+    Returns:
+    CoverCache: Cache in DEFAULT_CACHE_DIR whose entries are checked again
+    once they are COVER_CACHE_MAX_AGE seconds old, never when it is not set.
+    """
+    max_age = os.environ.get('COVER_CACHE_MAX_AGE')
+    return CoverCache(max_age=int(max_age) if max_age else None)
+
+
+class CoverFetchError(Exception):
+    """
+    A cover image could not be downloaded.
+    """
+
+
+class CoverCache:
+    """
+    On-disk cache of base64-encoded covers keyed by cover URL.
+
+    Each entry is stored as <directory>/<xx>/<sha256 of url>.b64, where xx is
+    the first two characters of the digest, with the time the cover was
+    last known current and its validator on the first line: its ETag, or
+    its length when the server gave none. Entries are used as they are
+    until they are max_age seconds old; CoverFetcher then sends the
+    validator with a conditional request, so a cover replaced in the bucket
+    under the same name is downloaded again. Reading an entry refreshes its
+    modification time, and the least recently used entries are removed once
+    the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_CACHE_MAX_BYTES, max_age=None):
+        """
+        Parameters:
+            directory (str): Directory to keep cached covers in.
+            max_bytes (int): Size the cache is trimmed back to.
+            max_age (int): Seconds an entry is used without checking that
+                           the cover has not changed, forever when None.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _path(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".b64")
+
+    def _entries(self):
+        """
+        Returns:
+            list: (modification time, path, size) for every cached cover.
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".b64"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, url):
+        """
+        Parameters:
+            url (str): URL the cover was downloaded from.
+
+        Returns:
+            tuple: The validator, the cached base64 payload and whether the
+                   entry is older than max_age, or None when the cover is
+                   not cached.
+        """
+        path = self._path(url)
+        try:
+            with open(path, encoding="ascii") as cached:
+                entry = cached.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        if "\n" not in entry:
+            # Entries cached without a validator cannot be checked.
+            return None
+        validator, payload = entry.split("\n", 1)
+        checked, _, stamped = validator.partition(" ")
+        if checked.isdigit():
+            validator = stamped
+        else:
+            # Entries cached before they were stamped are as old as can be.
+            checked = 0
+        stale = (self.max_age is not None
+                 and time.time() - int(checked) >= self.max_age)
+        return validator, payload, stale
+
+    def record(self, hit):
+        """
+        Count a lookup, as a hit when the cached cover was still current.
+        """
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, url, payload, validator):
+        """
+        Parameters:
+            url (str): URL the cover was downloaded from.
+            payload (str): The cover encoded as base64.
+            validator (str): ETag of the downloaded cover, or its length.
+                             The entry is stamped with the current time.
+        """
+        path = self._path(url)
+        entry = "%d %s\n%s" % (time.time(), validator, payload)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers, including
+        # other processes sharing the directory, never see a partial entry.
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, "w", encoding="ascii") as cached:
+            cached.write(entry)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += len(entry) - replaced
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used covers until the cache is back under
+        max_bytes.
+        """
+        entries = sorted(self._entries())
+        self.size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters and the current cache size in bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size}
+
+
+class CoverFetcher:
+    """
+    Prefetch issue covers in parallel.
+
+    Call prefetch with every issueCover up front, then get for each issue as
+    its XML is built. Covers are downloaded in the order they were
+    prefetched, at most lookahead of them ahead of the ones handed out, so
+    memory use does not grow with the number of issues. Each cover is
+    released as soon as it has been handed out for every prefetch
+    reference.
+
+    Covers whose size is asked for by encoded_size are downloaded ahead of
+    the others. The first lookahead of them are kept for get, the later ones
+    are downloaded again when their turn comes, from the cache if the
+    fetcher has one.
+    """
+
+    def __init__(self, base_url=ojs_builder.COVER_BASE_URL, max_workers=8,
+                 retries=3, timeout=30.0, pool=None, cache=None,
+                 executor=None, normalizer=None, lookahead=None):
+        """
+        Parameters:
+            base_url (str): URL the issueCover file name is appended to.
+            max_workers (int): Number of concurrent downloads.
+            retries (int): Retries for connection errors and 5xx responses.
+            timeout (float): Connect and read timeout in seconds.
+            pool (PoolManager): urllib3 pool to use, defaults to the one
+                                shared with ojs_builder.
+            cache (CoverCache): Cache consulted before downloading a cover
+                                and filled after downloading it.
+            executor (ThreadPoolExecutor): Download threads shared with other
+                                           fetchers, e.g. when converting
+                                           several journals at once. It is
+                                           left running on close. A pool of
+                                           max_workers threads is made for
+                                           this fetcher when None.
+            normalizer (CoverNormalizer): Scales down and recompresses each
+                                          cover before it is encoded, see
+                                          ojs_images. Covers are embedded
+                                          as downloaded when None.
+            lookahead (int): Covers downloaded, or held, ahead of the one
+                             handed out, twice max_workers when None.
+        """
+        self.base_url = base_url
+        self.cache = cache
+        self.normalizer = normalizer
+        self.pool = pool if pool is not None else ojs_builder.http
+        self.retries = urllib3.Retry(total=retries, backoff_factor=0.5,
+                                     status_forcelist=(500, 502, 503, 504))
+        self.timeout = urllib3.Timeout(connect=timeout, read=timeout)
+        self.shared_executor = executor is not None
+        self.executor = (executor if executor is not None
+                         else ThreadPoolExecutor(max_workers=max_workers))
+        self.lookahead = lookahead or 2 * max_workers
+        # Prefetched covers waiting for room in the lookahead window.
+        self.waiting = collections.deque()
+        # cover name -> number of pending get() calls
+        self.references = collections.Counter()
+        # cover name -> future, the covers of the lookahead window
+        self.futures = {}
+        # cover name -> payload kept after encoded_size, and its length
+        self.sized = {}
+        self.sizes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method, url, headers=None):
+        try:
+            return self.pool.request(method, url, headers=headers,
+                                     retries=self.retries,
+                                     timeout=self.timeout)
+        except urllib3.exceptions.HTTPError as error:
+            raise CoverFetchError("Could not retrieve cover " + url + ": "
+                                  + str(error)) from error
+
+    def _cached(self, url, key):
+        """
+        Look a cover up in the cache, and when the entry is older than the
+        cache's max_age check that it is still current: with a conditional
+        GET when it was cached with an ETag, which is answered 304 without
+        the cover, or comparing its length with the Content-Length of a HEAD
+        request otherwise. Fresh entries are used without a request.
+
+        Returns:
+            tuple: The cached payload, or None when the cover is not cached
+                   or has changed, and the response to the conditional GET
+                   when it returned the changed cover.
+        """
+        cached = self.cache.get(key)
+        if cached is None:
+            self.cache.record(False)
+            return None, None
+        validator, payload, stale = cached
+        if not stale:
+            self.cache.record(True)
+            count("cover_cache_hits")
+            return payload, None
+        if validator.startswith("length:"):
+            response = self._request('HEAD', url)
+            current = (response.status == 200
+                       and "length:" + str(response.headers.get(
+                           'Content-Length')) == validator)
+            response = None
+        else:
+            response = self._request('GET', url,
+                                     headers={'If-None-Match': validator})
+            current = response.status == 304
+        self.cache.record(current)
+        if not current:
+            return None, response
+        # Good for another max_age seconds.
+        self.cache.put(key, payload, validator)
+        count("cover_cache_hits")
+        return payload, None
+
+    @instrumented("fetch_cover")
+    def fetch(self, cover):
+        """
+        Download a single cover, or read it from the cache.
+
+        Parameters:
+            cover (str): issueCover file name.
+
+        Returns:
+            str: The cover image encoded as base64, normalized when the
+                 fetcher has a normalizer.
+        """
+        url = self.base_url + cover
+        key = url
+        if self.normalizer is not None:
+            # Normalized covers are cached apart from the downloaded ones,
+            # for each setting, with the downloaded size in front of the
+            # payload for the report.
+            key = url + "#" + self.normalizer.settings
+        response = None
+        if self.cache is not None:
+            payload, response = self._cached(url, key)
+            if payload is not None:
+                if self.normalizer is None:
+                    return payload
+                original_size, payload = payload.split(":", 1)
+                self.normalizer.record(cover, int(original_size),
+                                       _decoded_size(payload))
+                return NormalizedCover(payload)
+        if response is None:
+            response = self._request('GET', url)
+        if response.status != 200:
+            raise CoverFetchError("Could not retrieve cover " + url
+                                  + ": HTTP " + str(response.status))
+        count("bytes_fetched", len(response.data))
+        validator = (response.headers.get('ETag')
+                     or "length:" + str(len(response.data)))
+        if self.normalizer is None:
+            payload = str(base64.b64encode(response.data), "utf-8")
+            if self.cache is not None:
+                self.cache.put(key, payload, validator)
+            return payload
+        payload = NormalizedCover(base64.b64encode(
+            self.normalizer.normalize(cover, response.data)).decode("utf-8"))
+        if self.cache is not None:
+            self.cache.put(key, str(len(response.data)) + ":" + payload,
+                           validator)
+        return payload
+
+    def prefetch(self, covers):
+        """
+        Start downloading covers in the background.
+
+        Parameters:
+            covers (iterable): issueCover file names, empty names are ignored.
+        """
+        for cover in covers:
+            if cover == '':
+                continue
+            if self.references[cover] == 0:
+                self.waiting.append(cover)
+            self.references[cover] += 1
+        self._fill()
+
+    def _fill(self):
+        """
+        Start the waiting downloads that fit in the lookahead window.
+        """
+        while self.waiting and len(self.futures) < self.lookahead:
+            cover = self.waiting.popleft()
+            if cover not in self.futures and cover not in self.sized:
+                self.futures[cover] = self.executor.submit(self.fetch, cover)
+
+    def _future(self, cover):
+        """
+        Returns:
+            Future: The download of a prefetched cover, started now if it
+                    has not had its turn yet.
+        """
+        future = self.futures.get(cover)
+        if future is None:
+            if cover in self.waiting:
+                self.waiting.remove(cover)
+            future = self.futures[cover] = self.executor.submit(self.fetch,
+                                                                cover)
+        return future
+
+    def encoded_size(self, cover):
+        """
+        Parameters:
+            cover (str): issueCover file name.
+
+        Returns:
+            int: Length of the base64 encoded cover, waiting for its download
+                 if needed. The cover stays available to get.
+        """
+        if cover in self.sizes:
+            return self.sizes[cover]
+        if self.references[cover] == 0:
+            self.prefetch([cover])
+        payload = self._future(cover).result()
+        del self.futures[cover]
+        self.sizes[cover] = len(payload)
+        if len(self.sized) < self.lookahead:
+            self.sized[cover] = payload
+        else:
+            self.waiting.append(cover)
+        self._fill()
+        return len(payload)
+
+    def get(self, cover):
+        """
+        Parameters:
+            cover (str): issueCover file name.
+
+        Returns:
+            str: The cover image encoded as base64, waiting for its download
+                 if it is still in flight. Covers that were not prefetched
+                 are downloaded on the spot.
+        """
+        if self.references[cover] == 0:
+            return self.fetch(cover)
+        self.references[cover] -= 1
+        if cover in self.sized:
+            payload = self.sized[cover]
+        else:
+            payload = self._future(cover).result()
+        if self.references[cover] == 0:
+            # Released once handed out for every reference, making room
+            # for the next download.
+            del self.references[cover]
+            self.futures.pop(cover, None)
+            self.sized.pop(cover, None)
+            self.sizes.pop(cover, None)
+            self._fill()
+        return payload
+
+    def close(self):
+        """
+        Cancel downloads that were never collected and stop the workers,
+        unless they are shared.
+        """
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        self.waiting.clear()
+        self.references.clear()
+        self.sized.clear()
+        self.sizes.clear()
+        if not self.shared_executor:
+            self.executor.shutdown(wait=True)
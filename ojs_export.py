@@ -0,0 +1,480 @@
+"""
+ OJS native XML export reader functions
+
+ The reverse of ojs_builder: reads OJS native import/export documents, such
+ as issue exports from Tools > Import/Export or conversion files, back into
+ rows of the examples/import.csv layout so content already in OJS can be
+ edited and converted again. Documents are parsed incrementally and each
+ article is dropped once its row is read, so memory use stays flat however
+ large the export. The base64 text of embedded covers and PDFs is never
+ held: it is decoded to disk in chunks as it is parsed when the files are
+ extracted, and skipped otherwise.
+
+ Functions:
+    read_identification: Issue columns of an ISSUE IDENTIFICATION Element
+    read_sections: Sections of a SECTIONS Element
+    read_cover: issueCover column of a COVERS Element
+    read_article: The CSV row of an ARTICLE Element
+    read_exports: Streams the rows of export files
+    write_csv: Writes rows in the import CSV layout
+
+ Classes:
+    ExportParser: XMLParser target reading rows while it is fed
+"""
+
+import base64
+import collections
+import csv
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from ojs_compression import open_compressed
+
+# Bytes read from an export at a time.
+CHUNK_SIZE = 1024 * 1024
+
+"""
+Locale whose text is taken from localized elements, ojs_builder writes
+en_US.
+"""
+DEFAULT_LOCALE = "en_US"
+
+"""
+Columns of the import CSV, in the order of examples/import.csv. The keywords
+column and one set of author columns per author are added by write_csv.
+"""
+ARTICLE_COLUMNS = ("uploader", "prefix", "title", "subtitle", "abstract",
+                   "issueCover", "issueDatepublished", "issueVolume",
+                   "issueNumber", "issueYear", "issueTitle", "sectionTitle",
+                   "sectionAbbrev", "pages", "seq")
+AUTHOR_COLUMNS = ("authorGivenname", "authorFamilyname", "authorAffiliation",
+                  "authorEmail")
+FILE_COLUMNS = ("file1", "fileLabel1", "fileGenre1", "fileLocale1")
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _child(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child
+    return None
+
+
+def _localized(element, name, locale):
+    # The child in locale, else one without a locale, else the first.
+    children = _children(element, name)
+    for child in children:
+        if child.get("locale") == locale:
+            return child
+    for child in children:
+        if child.get("locale") is None:
+            return child
+    return children[0] if children else None
+
+
+def _text(element, name, locale=DEFAULT_LOCALE):
+    if element is None:
+        return ""
+    child = _localized(element, name, locale)
+    if child is None or child.text is None:
+        return ""
+    return child.text
+
+
+def read_identification(element, locale=DEFAULT_LOCALE):
+    """
+    Read an OJS Identification XML Element, see
+    ojs_builder.build_identification
+
+    Parameters:
+    element (Element): issue_identification Element
+    locale (str): Locale of the title taken
+
+    Returns:
+    dict: issueVolume, issueNumber, issueYear and issueTitle
+    """
+    return {'issueVolume': _text(element, "volume"),
+            'issueNumber': _text(element, "number"),
+            'issueYear': _text(element, "year"),
+            'issueTitle': _text(element, "title", locale)}
+
+
+def read_sections(element, locale=DEFAULT_LOCALE):
+    """
+    Read an OJS Sections XML Element, see ojs_builder.build_sections
+
+    Parameters:
+    element (Element): sections Element
+    locale (str): Locale of the titles taken
+
+    Returns:
+    dict: sectionTitle and sectionAbbrev of each section keyed by the ref
+    articles use for it, as ojs_reader.index_issues returns them
+    """
+    sections = {}
+    for section in _children(element, "section"):
+        abbrev = section.get("ref") or _text(section, "abbrev", locale)
+        sections.setdefault(abbrev, {
+            'sectionTitle': _text(section, "title", locale),
+            'sectionAbbrev': abbrev})
+    return sections
+
+
+def read_cover(element, locale=DEFAULT_LOCALE):
+    """
+    Read an OJS Covers XML Element, see ojs_builder.build_cover
+
+    Parameters:
+    element (Element): covers Element, its embed is not needed
+    locale (str): Locale of the cover taken when there are several
+
+    Returns:
+    dict: issueCover, the file name of the cover
+    """
+    cover = _localized(element, "cover", locale)
+    return {'issueCover': _text(cover, "cover_image")}
+
+
+def _publication(element):
+    # The current publication, the last one when it is not marked.
+    publications = _children(element, "publication")
+    current = element.get("current_publication_id")
+    for publication in publications:
+        if current is not None and _text(publication, "id") == current:
+            return publication
+    return publications[-1] if publications else None
+
+
+def _galley_file(element, galley):
+    # The submission file of a galley, the first one when it has no ref.
+    submission_files = _children(element, "submission_file")
+    file_ref = _child(galley, "submission_file_ref") \
+        if galley is not None else None
+    if file_ref is not None:
+        for submission_file in submission_files:
+            if submission_file.get("id") == file_ref.get("id"):
+                return submission_file, file_ref.get("revision")
+    if submission_files:
+        return submission_files[0], None
+    return None, None
+
+
+def _file_columns(element, galley, locale):
+    submission_file, revision_number = _galley_file(element, galley)
+    if submission_file is None:
+        return {}
+    # OJS 3.1 and 3.2 describe each file in revisions, OJS 3.3 on the
+    # submission_file itself.
+    revisions = _children(submission_file, "revision")
+    described = submission_file
+    for revision in revisions:
+        described = revision
+        if revision.get("number") == revision_number:
+            break
+    return {'uploader': (described.get("uploader")
+                         or submission_file.get("uploader") or ""),
+            'file1': (described.get("filename")
+                      or _text(described, "name", locale)),
+            'fileLabel1': _text(galley, "name", locale),
+            'fileGenre1': (described.get("genre")
+                           or submission_file.get("genre") or ""),
+            'fileLocale1': galley.get("locale", "") if galley is not None
+                           else ""}
+
+
+def read_article(element, issue, sections, locale=DEFAULT_LOCALE):
+    """
+    Read an OJS Article XML Element, see ojs_builder.build_article
+
+    Parameters:
+    element (Element): article Element
+    issue (dict): Issue columns of the issue holding the article
+    sections (dict): Sections of the issue, see read_sections
+    locale (str): Locale of the text taken from localized elements
+
+    Returns:
+    dict: The CSV row of the article. keywords is only set when the article
+    has keywords, and authorGivennameN, authorFamilynameN,
+    authorAffiliationN and authorEmailN for each of its authors.
+    """
+    publication = _publication(element)
+    if publication is None:
+        publication = element
+    row = dict.fromkeys(ARTICLE_COLUMNS, "")
+    row.update(issue)
+    # Articles exported on their own from OJS 3.2 name their issue.
+    identification = _child(publication, "issue_identification")
+    if identification is not None:
+        row.update(read_identification(identification, locale))
+    section_ref = publication.get("section_ref", "")
+    row.update({
+        'prefix': _text(publication, "prefix", locale),
+        'title': _text(publication, "title", locale),
+        'subtitle': _text(publication, "subtitle", locale),
+        'abstract': _text(publication, "abstract", locale),
+        'sectionTitle': sections.get(section_ref, {}).get('sectionTitle', ""),
+        'sectionAbbrev': section_ref,
+        'pages': _text(publication, "pages"),
+        'seq': publication.get("seq", "")})
+    keywords = _localized(publication, "keywords", locale)
+    if keywords is not None:
+        # Keywords are separated by a ';' in the spreadsheet.
+        row['keywords'] = ";".join(keyword.text or ""
+                                   for keyword in keywords)
+    authors = _child(publication, "authors")
+    for number, author in enumerate(
+            _children(authors, "author") if authors is not None else (), 1):
+        suffix = str(number)
+        row['authorGivenname' + suffix] = _text(author, "givenname", locale)
+        row['authorFamilyname' + suffix] = _text(author, "familyname",
+                                                 locale)
+        row['authorAffiliation' + suffix] = _text(author, "affiliation",
+                                                  locale)
+        row['authorEmail' + suffix] = _text(author, "email")
+    galley = _localized(publication, "article_galley", locale)
+    row.update(_file_columns(element, galley, locale))
+    return row
+
+
+class _Base64File:
+    """
+    Decodes base64 text fed to it in chunks into a file, or skips it when
+    it has no path.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb") if path else None
+        self.pending = ""
+        self.size = 0
+
+    def write(self, text):
+        if self.file is None:
+            return
+        text = self.pending + "".join(text.split())
+        # base64 decodes in groups of 4 characters, the rest waits for the
+        # next chunk.
+        end = len(text) - len(text) % 4
+        self.pending = text[end:]
+        if end:
+            self.size += self.file.write(base64.b64decode(text[:end]))
+
+    def close(self):
+        if self.file is not None:
+            if self.pending:
+                self.size += self.file.write(base64.b64decode(self.pending))
+            self.file.close()
+
+
+class ExportParser:
+    """
+    Target of an ElementTree.XMLParser reading the rows of an OJS native
+    export while it is fed.
+
+    Elements are built like iterparse builds them except for the text of
+    embed elements, which is decoded to extract_to as it arrives or
+    skipped. Issue elements are read as soon as they end, and each article
+    is turned into its row and removed from the tree when it ends.
+    """
+
+    def __init__(self, extract_to=None, locale=DEFAULT_LOCALE):
+        """
+        Parameters:
+            extract_to (str): Directory the embedded covers and PDFs are
+                              written to under their file names, they are
+                              not extracted when None.
+            locale (str): Locale of the text taken from localized elements.
+        """
+        self.extract_to = extract_to
+        self.locale = locale
+        self.builder = None
+        # Open elements and their local names.
+        self.elements = []
+        self.tags = []
+        self.rows = collections.deque()
+        self.issue = {}
+        self.sections = {}
+        # Covers of the issues read, the later parts of an issue split over
+        # several files have none.
+        self.covers = {}
+        self.issue_titles = set()
+        self.file_name = None
+        self.embed = None
+        self.stats = collections.Counter()
+
+    def start(self, tag, attrib):
+        """
+        Parser target callback for a start tag.
+        """
+        if not self.elements:
+            # Each document gets its own tree.
+            self.builder = ElementTree.TreeBuilder()
+        name = _local_name(tag)
+        if name == "revision":
+            self.file_name = attrib.get("filename")
+        elif name == "embed" and self.embed is None:
+            self._start_embed()
+        self.elements.append(self.builder.start(tag, attrib))
+        self.tags.append(name)
+
+    def data(self, text):
+        """
+        Parser target callback for character data.
+        """
+        if self.embed is not None:
+            self.embed.write(text)
+        else:
+            self.builder.data(text)
+
+    def end(self, tag):
+        """
+        Parser target callback for an end tag.
+        """
+        element = self.builder.end(tag)
+        self.elements.pop()
+        name = self.tags.pop()
+        parent = self.tags[-1] if self.tags else None
+        if name == "embed":
+            self._end_embed()
+        elif name == "cover_image":
+            self.file_name = element.text
+        elif name == "name" and parent == "submission_file":
+            self.file_name = element.text
+        elif parent == "issue":
+            self._read_issue_element(name, element)
+        elif name == "article":
+            self.rows.append(read_article(element, self.issue, self.sections,
+                                          self.locale))
+            self.stats['articles'] += 1
+            self.elements[-1].remove(element)
+        if name == "issue":
+            self.issue_titles.add(self.issue.get('issueTitle'))
+            self.stats['issues'] = len(self.issue_titles)
+            self.issue = {}
+            self.sections = {}
+            if self.elements:
+                self.elements[-1].remove(element)
+
+    def close(self):
+        """
+        Parser target callback for the end of the document.
+        """
+        return self.stats
+
+    def _read_issue_element(self, name, element):
+        if name == "issue_identification":
+            self.issue.update(read_identification(element, self.locale))
+            self.issue.setdefault(
+                'issueCover', self.covers.get(self.issue['issueTitle'], ""))
+        elif name == "date_published":
+            self.issue['issueDatepublished'] = element.text or ""
+        elif name == "sections":
+            self.sections = read_sections(element, self.locale)
+        elif name == "covers":
+            self.issue.update(read_cover(element, self.locale))
+            self.covers[self.issue.get('issueTitle')] = \
+                self.issue['issueCover']
+
+    def _start_embed(self):
+        path = None
+        if self.extract_to is not None:
+            self.stats['files'] += 1
+            file_name = os.path.basename(
+                self.file_name or "embed%d" % self.stats['files'])
+            path = os.path.join(self.extract_to, file_name)
+        self.embed = _Base64File(path)
+
+    def _end_embed(self):
+        self.embed.close()
+        self.stats['bytes'] += self.embed.size
+        self.embed = None
+        self.file_name = None
+
+    def take_rows(self):
+        """
+        Returns:
+            generator: The rows read since the last call.
+        """
+        while self.rows:
+            yield self.rows.popleft()
+
+
+def read_exports(paths, extract_to=None, locale=DEFAULT_LOCALE, stats=None):
+    """
+    Stream the CSV rows of OJS native export files.
+
+    Parameters:
+    paths (list): Export files, compressed when they end in .gz or .zst.
+    Issues split over several files, as conversion files of a large issue
+    are, take the cover of their first part.
+    extract_to (str): Directory the embedded covers and PDFs are written
+    to, they are not extracted when None
+    locale (str): Locale of the text taken from localized elements
+    stats (collections.Counter): Counts the issues, articles, files
+    extracted and bytes extracted when given
+
+    Returns:
+    generator: A row for each article, see read_article, in document order
+    """
+    if extract_to is not None:
+        os.makedirs(extract_to, exist_ok=True)
+    target = ExportParser(extract_to, locale)
+    for path in paths:
+        parser = ElementTree.XMLParser(target=target)
+        with open_compressed(path) as export:
+            while True:
+                chunk = export.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                yield from target.take_rows()
+        parser.close()
+        yield from target.take_rows()
+    if stats is not None:
+        stats.update(target.stats)
+
+
+def write_csv(rows, output):
+    """
+    Write rows in the examples/import.csv layout, with a keywords column when
+    any article has keywords and author columns for as many authors as the
+    article with the most. The rows are spooled to a temporary file since
+    the columns are only known once every row is read.
+
+    Parameters:
+    rows (iterable): Rows as returned by read_article
+    output (file): Text file the CSV is written to, opened with newline=''
+
+    Returns:
+    int: Number of rows written
+    """
+    authors = 1
+    keywords = False
+    written = 0
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        for row in rows:
+            spool.write(json.dumps(row) + "\n")
+            while 'authorGivenname' + str(authors + 1) in row:
+                authors += 1
+            keywords = keywords or 'keywords' in row
+            written += 1
+        columns = list(ARTICLE_COLUMNS)
+        if keywords:
+            columns.append('keywords')
+        for number in range(1, authors + 1):
+            columns.extend(column + str(number) for column in AUTHOR_COLUMNS)
+        columns.extend(FILE_COLUMNS)
+        writer = csv.DictWriter(output, columns, restval="",
+                                extrasaction="ignore")
+        writer.writeheader()
+        spool.seek(0)
+        for line in spool:
+            writer.writerow(json.loads(line))
+    return written
@@ -0,0 +1,339 @@
+"""
+ Fan-out/fan-in conversion for the Lambda
+
+ Large CSVs are converted by many worker invocations instead of one: the
+ coordinator parses the CSV, numbers issues and articles, plans the output
+ batches and stores each batch as a job in the bucket. Each job is handed to
+ a worker through a pluggable dispatcher. Workers write their conversion
+ file and a result record, and the results are collected into
+ conversion_manifest.json and the usual status response.
+
+ Functions:
+    dispatch_batches: Coordinator, stores the jobs and dispatches them
+    worker_handler: Renders and uploads the conversion file of one job
+    aggregate_results: Builds the manifest and response once every job is done
+    status_response: The response returned for a finished conversion
+
+ Classes:
+    LambdaDispatcher: Asynchronous invocations of a Lambda function
+    LocalDispatcher: Runs the jobs one after another in this process
+    ProcessPoolDispatcher: Runs the jobs in local worker processes
+"""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import boto3
+from ojs_batching import Batch, manifest_entry
+from ojs_builder import COVER_BASE_URL
+from ojs_compression import CompressedWriter, get_codec
+from ojs_covers import CoverFetcher, environment_cache
+from ojs_images import environment_normalizer
+from ojs_incremental import merge_manifest
+from ojs_pipeline import write_batch
+from ojs_s3 import S3UploadStream, s3_client, upload_options
+from ojs_xsd import StreamValidator, ValidatingWriter, format_violation
+
+JOB_PREFIX = "conversion_jobs/"
+MANIFEST_KEY = "conversion_manifest.json"
+
+
+def _job_key(run_id, name):
+    return JOB_PREFIX + run_id + "/" + name
+
+
+def _put_json(client, bucket, key, value):
+    client.put_object(Bucket=bucket, Key=key,
+                      Body=json.dumps(value).encode('utf-8'),
+                      ContentType='application/json')
+
+
+def _get_json(client, bucket, key):
+    return json.loads(client.get_object(Bucket=bucket,
+                                        Key=key)['Body'].read().decode('utf-8'))
+
+
+def status_response(article_count, issue_count, files=None):
+    """
+    Parameters:
+    article_count (int): Number of articles converted
+    issue_count (int): Number of issues converted
+    files (list): Manifest entries of the conversion files, the bytes
+    uploaded and the bytes left unchanged in the bucket are added to the
+    response when given
+
+    Returns:
+    dict: Lambda response with the conversion counts, a 400 listing the
+    schema violations when the files were checked against the schema and
+    do not match it
+    """
+    body = ('Converted:\n\t'
+            + 'Articles: ' + str(article_count) + '\n\t'
+            + 'Issues: ' + str(issue_count))
+    if files is not None:
+        uploaded = sum(entry['bytes'] for entry in files
+                       if entry.get('uploaded', True))
+        body += ('\n\tBytes uploaded: ' + str(uploaded) + '\n\t'
+                 + 'Bytes unchanged: '
+                 + str(sum(entry['bytes'] for entry in files) - uploaded))
+        violations = [violation for entry in files
+                      for violation in entry.get('schema_violations', ())]
+        if violations:
+            body += ('\n' + str(len(violations))
+                     + ' schema violation(s) in the conversion files:\n\t'
+                     + '\n\t'.join(violations))
+            return {'statusCode': 400, 'body': json.dumps(body)}
+    return {'statusCode': 200, 'body': json.dumps(body)}
+
+
+class LambdaDispatcher:
+    """
+    Dispatch each job as an asynchronous (Event) invocation of a Lambda
+    function, usually the function running the coordinator. The coordinator
+    does not wait for them: the last worker to finish aggregates the results.
+    """
+
+    synchronous = False
+
+    def __init__(self, function_name, client=None):
+        """
+        Parameters:
+            function_name (str): Name or ARN of the worker function.
+            client (Lambda.Client): boto3 Lambda client.
+        """
+        self.function_name = function_name
+        self.client = client if client is not None else boto3.client('lambda')
+
+    def dispatch(self, handler, payloads):
+        """
+        Parameters:
+            handler (callable): Unused, the function's own handler runs.
+            payloads (list): Event for each worker invocation.
+
+        Returns:
+            None: Results are collected by the workers themselves.
+        """
+        for payload in payloads:
+            self.client.invoke(FunctionName=self.function_name,
+                               InvocationType='Event',
+                               Payload=json.dumps(payload).encode('utf-8'))
+
+
+class LocalDispatcher:
+    """
+    Run each job in this process, one after another.
+    """
+
+    synchronous = True
+
+    def dispatch(self, handler, payloads):
+        """
+        Parameters:
+            handler (callable): Worker handler taking (event, context).
+            payloads (list): Event for each job.
+
+        Returns:
+            list: The handler's result for each job.
+        """
+        return [handler(payload, None) for payload in payloads]
+
+
+class ProcessPoolDispatcher:
+    """
+    Run the jobs in parallel local worker processes.
+    """
+
+    synchronous = True
+
+    def __init__(self, workers=None):
+        """
+        Parameters:
+            workers (int): Number of worker processes, one per CPU if None.
+        """
+        self.workers = workers
+
+    def dispatch(self, handler, payloads):
+        """
+        Parameters:
+            handler (callable): Picklable worker handler taking
+                                (event, context).
+            payloads (list): Event for each job.
+
+        Returns:
+            list: The handler's result for each job.
+        """
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(handler, payloads,
+                                     [None] * len(payloads)))
+
+
+def dispatch_batches(client, bucket, run_id, batches, issues, sections,
+                     articles, issue_identifiers, dispatcher, max_bytes=None,
+                     output_files=None, fingerprints=None, incremental=None,
+                     compression=None):
+    """
+    Store one job per batch in the bucket and dispatch them to workers.
+
+    Parameters:
+    client (S3.Client): boto3 S3 client
+    bucket (str): Bucket holding the CSV, jobs and conversion files
+    run_id (str): Unique id of this conversion, e.g. the Lambda request id
+    batches (list): Batch objects as returned by ojs_batching.plan_batches
+    issues (dict): Issue metadata keyed by issueTitle
+    sections (dict): Sections of each issue keyed by issueTitle
+    articles (dict): Numbered article lists keyed by issueTitle
+    issue_identifiers (dict): Issue identifiers keyed by issueTitle
+    dispatcher: LambdaDispatcher, LocalDispatcher or ProcessPoolDispatcher
+    max_bytes (int): Size limit the batches were planned with
+    output_files (list): Conversion file name of each batch, conversion1.xml
+    onwards when None
+    fingerprints (dict): Fingerprint of each issue keyed by issueTitle
+    incremental (dict): Plan returned by ojs_incremental.plan_incremental
+    for an incremental conversion
+    compression (str): Codec the workers compress the conversion files with,
+    see ojs_compression
+
+    Returns:
+    dict: The status response once every job is done, or an accepted
+    response when the dispatcher does not wait for the workers
+    """
+    _put_json(client, bucket, _job_key(run_id, "run.json"), {
+        "jobs": len(batches),
+        "articles": sum(len(articles[key]) for key in issues),
+        "issues": len(issues),
+        "max_bytes": max_bytes,
+        "incremental": incremental,
+        "compression": compression})
+    if output_files is None:
+        output_files = ["conversion" + str(number) + ".xml"
+                        for number in range(1, len(batches) + 1)]
+    payloads = []
+    for number, batch in enumerate(batches, 1):
+        keys = [issue_key for issue_key, _, _ in batch.entries]
+        _put_json(client, bucket, _job_key(run_id, "job%d.json" % number), {
+            "conversion_file": output_files[number - 1],
+            "entries": batch.entries,
+            "estimated_size": batch.estimated_size,
+            "issues": {key: issues[key] for key in keys},
+            "sections": {key: sections[key] for key in keys},
+            "articles": {key: [dict(article)
+                               for article in articles[key][first:last]]
+                         for key, first, last in batch.entries},
+            "issue_identifiers": {key: issue_identifiers[key]
+                                  for key in keys},
+            "fingerprints": ({key: fingerprints[key] for key in keys}
+                             if fingerprints is not None else None)})
+        payloads.append({"ojs_fanout_job": number,
+                         "bucket": bucket,
+                         "run_id": run_id,
+                         "aggregate": not dispatcher.synchronous})
+
+    dispatcher.dispatch(worker_handler, payloads)
+    # With no jobs, e.g. an incremental run where nothing changed, there is
+    # no worker to aggregate so it is done here.
+    if not dispatcher.synchronous and payloads:
+        return {
+            'statusCode': 202,
+            'body': json.dumps('Dispatched:\n\t'
+                               + 'Jobs: ' + str(len(payloads)))}
+    return aggregate_results(client, bucket, run_id)
+
+
+def worker_handler(event, context):
+    """
+    Convert the batch of one job and record the result.
+
+    Parameters:
+    event (dict): Payload built by dispatch_batches
+    context: Lambda context, unused
+
+    Returns:
+    dict: Manifest entry of the conversion file written
+    """
+    bucket = event['bucket']
+    run_id = event['run_id']
+    number = event['ojs_fanout_job']
+    client = s3_client()
+    job = _get_json(client, bucket, _job_key(run_id, "job%d.json" % number))
+
+    batch = Batch()
+    for issue_key, first, last in job['entries']:
+        batch.add(issue_key, first, last, 0)
+    batch.estimated_size = job['estimated_size']
+    # Only the articles of the batch are stored with the job, put them back
+    # at their positions in the issue so the batch's ranges apply.
+    articles = {issue_key: [None] * first + job['articles'][issue_key]
+                for issue_key, first, _ in job['entries']}
+
+    run = _get_json(client, bucket, _job_key(run_id, "run.json"))
+    codec = get_codec(run.get('compression'))
+
+    covers = CoverFetcher(os.environ.get('COVER_BASE_URL', COVER_BASE_URL),
+                          cache=environment_cache(),
+                          normalizer=environment_normalizer())
+    covers.prefetch(job['issues'][issue_key]['issueCover']
+                    for issue_key, first, _ in job['entries'] if first == 0)
+    upload = S3UploadStream(
+        client, bucket, job['conversion_file'],
+        content_encoding=codec.content_encoding if codec else None,
+        **upload_options())
+    output = upload if codec is None else CompressedWriter(upload, codec)
+    # Setting VALIDATE_XML checks the file against the schema while it is
+    # uploaded, see lambda_function.
+    validator = None
+    if os.environ.get('VALIDATE_XML'):
+        validator = StreamValidator(job['conversion_file'])
+        output = ValidatingWriter(output, validator)
+    with output:
+        write_batch(output, batch, job['issues'], job['sections'], articles,
+                    job['issue_identifiers'], covers)
+    covers.close()
+
+    result = manifest_entry(job['conversion_file'], batch, job['issues'],
+                            articles, job['issue_identifiers'],
+                            upload.bytes_written, run['max_bytes'],
+                            job.get('fingerprints'), run.get('compression'),
+                            upload.uploaded)
+    if validator is not None:
+        result['schema_violations'] = [format_violation(violation)
+                                       for violation in validator.close()]
+    _put_json(client, bucket,
+              _job_key(run_id, "results/job%d.json" % number), result)
+
+    if event.get('aggregate'):
+        aggregate_results(client, bucket, run_id)
+    return result
+
+
+def aggregate_results(client, bucket, run_id):
+    """
+    Collect the job results into conversion_manifest.json once every job
+    of the run has finished. Aggregating more than once writes the same
+    manifest, so concurrent workers finishing last do not conflict.
+
+    Parameters:
+    client (S3.Client): boto3 S3 client
+    bucket (str): Bucket holding the jobs
+    run_id (str): Unique id of the conversion
+
+    Returns:
+    dict: The status response, or None while jobs are still running
+    """
+    run = _get_json(client, bucket, _job_key(run_id, "run.json"))
+    finished = 0
+    for page in client.get_paginator('list_objects_v2').paginate(
+            Bucket=bucket, Prefix=_job_key(run_id, "results/")):
+        finished += page.get('KeyCount', 0)
+    if finished < run['jobs']:
+        return None
+    files = [_get_json(client, bucket,
+                       _job_key(run_id, "results/job%d.json" % number))
+             for number in range(1, run['jobs'] + 1)]
+    manifest = {"max_bytes": run['max_bytes'], "files": files}
+    if run.get('incremental') is not None:
+        manifest = merge_manifest(manifest, run['incremental'])
+    _put_json(client, bucket, MANIFEST_KEY, manifest)
+    return status_response(run['articles'], run['issues'], files)
@@ -0,0 +1,319 @@
+"""
+ Cover image normalization
+
+ Issue covers are embedded in the XML as base64, so a scanned cover of
+ several MB makes the file holding its issue 4/3 of that larger. When
+ enabled, covers are scaled down to a maximum width and height and
+ recompressed before they are encoded, in a pool of processes since
+ decoding and encoding images is CPU bound. Covers OJS does not take, such
+ as TIFF, are converted to JPEG, or PNG when they are transparent.
+
+ Normalizing needs the Pillow package. Covers that are not normalized are
+ embedded as downloaded, keeping their name, and labelled with the
+ mime_type of its extension.
+
+ Functions:
+    sniff_mime_type: Image type of some bytes, from their signature
+    name_mime_type: Image type of a file name, from its extension
+    cover_file_name: Cover file name with the extension of its image type
+    normalize_image: Scales down and recompresses one image
+    environment_normalizer: CoverNormalizer set by the Lambda environment
+
+ Classes:
+    CoverNormalizer: Normalizes covers and records the bytes saved
+    NormalizedCover: Base64 payload of a cover that was normalized
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from ojs_metrics import count
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+"""
+Leading bytes of the image formats covers come in.
+"""
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+)
+
+"""
+File name extensions of each image type, the first one is used when a
+cover is renamed.
+"""
+EXTENSIONS = {
+    "image/jpeg": (".jpg", ".jpeg", ".jpe"),
+    "image/png": (".png",),
+    "image/gif": (".gif",),
+    "image/webp": (".webp",),
+    "image/tiff": (".tif", ".tiff"),
+    "image/bmp": (".bmp",),
+}
+
+"""
+Image types OJS accepts as issue covers, other covers are converted when
+they are normalized.
+"""
+COVER_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+DEFAULT_MAX_DIMENSION = 1600
+DEFAULT_QUALITY = 85
+
+
+def sniff_mime_type(data):
+    """
+    Parameters:
+    data (bytes): The start of an image file, 12 bytes are enough
+
+    Returns:
+    str: Mime type of the image, None when the format is not recognized
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    return None
+
+
+def name_mime_type(name):
+    """
+    Parameters:
+    name (str): Image file name
+
+    Returns:
+    str: Mime type of its extension, None when it is not an image type
+    """
+    extension = os.path.splitext(name)[1].lower()
+    for mime_type, extensions in EXTENSIONS.items():
+        if extension in extensions:
+            return mime_type
+    return None
+
+
+def cover_file_name(name, mime_type):
+    """
+    Parameters:
+    name (str): issueCover file name
+    mime_type (str): Type of the image embedded for it
+
+    Returns:
+    str: The name, with the extension of the image type when it has
+    another one, so OJS serves a converted cover with the right type
+    """
+    stem, extension = os.path.splitext(name)
+    extensions = EXTENSIONS.get(mime_type)
+    if not extensions or extension.lower() in extensions:
+        return name
+    return stem + extensions[0]
+
+
+def _has_alpha(image):
+    return (image.mode in ("RGBA", "LA", "PA")
+            or (image.mode == "P" and "transparency" in image.info))
+
+
+def normalize_image(data, max_dimension=DEFAULT_MAX_DIMENSION,
+                    quality=DEFAULT_QUALITY):
+    """
+    Scale an image down to fit max_dimension and recompress it, as a JPEG
+    at quality or as a PNG when it is transparent.
+
+    Parameters:
+    data (bytes): The image file
+    max_dimension (int): Largest width and height in pixels
+    quality (int): JPEG quality, 1 to 95
+
+    Returns:
+    bytes: The normalized image. The image is returned unchanged when it is
+    an animated GIF, when it cannot be read, or when it fits, is of a type
+    OJS accepts and recompressing it would not make it smaller.
+    """
+    mime_type = sniff_mime_type(data)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if getattr(image, "is_animated", False):
+                return data
+            resized = max(image.size) > max_dimension
+            if resized:
+                # thumbnail keeps the aspect ratio and lets JPEGs be decoded
+                # at a reduced size, which is most of the speed up.
+                image.thumbnail((max_dimension, max_dimension),
+                                Image.LANCZOS)
+            output = io.BytesIO()
+            if _has_alpha(image):
+                image.save(output, "PNG", optimize=True)
+            else:
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.save(output, "JPEG", quality=quality, optimize=True,
+                           progressive=True)
+    except (OSError, ValueError):
+        return data
+    normalized = output.getvalue()
+    if (not resized and mime_type in COVER_TYPES
+            and len(normalized) >= len(data)):
+        return data
+    return normalized
+
+
+class NormalizedCover(str):
+    """
+    Base64 payload of a cover that went through a CoverNormalizer, as handed
+    out by ojs_covers.CoverFetcher. build_cover only renames covers of this
+    type to the extension of their image type, a cover embedded as
+    downloaded is a plain str and keeps its name.
+    """
+
+    __slots__ = ()
+
+
+def environment_normalizer():
+    """
+    Returns:
+    CoverNormalizer: Normalizer set by COVER_MAX_DIMENSION and COVER_QUALITY
+    of the Lambda environment, normalizing in the calling thread since
+    Lambda has no /dev/shm for multiprocessing. None when
+    COVER_MAX_DIMENSION is not set.
+    """
+    if not os.environ.get('COVER_MAX_DIMENSION'):
+        return None
+    return CoverNormalizer(int(os.environ['COVER_MAX_DIMENSION']),
+                           int(os.environ.get('COVER_QUALITY',
+                                              DEFAULT_QUALITY)),
+                           processes=0)
+
+
+class CoverNormalizer:
+    """
+    Normalize covers with normalize_image, in worker processes, and keep
+    the original and normalized size of each cover for the report.
+    """
+
+    def __init__(self, max_dimension=DEFAULT_MAX_DIMENSION,
+                 quality=DEFAULT_QUALITY, processes=None, executor=None):
+        """
+        Parameters:
+            max_dimension (int): Largest width and height in pixels.
+            quality (int): JPEG quality, 1 to 95.
+            processes (int): Worker processes, one per CPU when None. 0
+                             normalizes in the calling thread, e.g. on
+                             Lambda which has no /dev/shm for
+                             multiprocessing.
+            executor (ProcessPoolExecutor): Worker processes shared with
+                                            other work, e.g. the rendering
+                                            workers. It is left running on
+                                            close.
+
+        Raises:
+            ValueError: When Pillow is not installed.
+        """
+        if Image is None:
+            raise ValueError("Normalizing covers needs the Pillow package")
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.shared_executor = executor is not None
+        if executor is None and processes != 0:
+            # Spawned rather than forked, like write_batches does, so the
+            # cover download threads are not copied into the workers.
+            executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"))
+        self.executor = executor
+        # cover name -> (original bytes, normalized bytes)
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    @property
+    def settings(self):
+        """
+        Returns:
+            str: The settings, which cached normalized covers are keyed by.
+        """
+        return "max_dimension=%d,quality=%d" % (self.max_dimension,
+                                                 self.quality)
+
+    def record(self, cover, original_size, normalized_size):
+        """
+        Parameters:
+            cover (str): issueCover file name.
+            original_size (int): Bytes of the cover as downloaded.
+            normalized_size (int): Bytes of the cover as embedded.
+        """
+        with self.lock:
+            if cover in self.sizes:
+                return
+            self.sizes[cover] = (original_size, normalized_size)
+        count("bytes_cover_saved", original_size - normalized_size)
+
+    def normalize(self, cover, data):
+        """
+        Parameters:
+            cover (str): issueCover file name.
+            data (bytes): The cover as downloaded.
+
+        Returns:
+            bytes: The normalized cover.
+        """
+        if self.executor is None:
+            normalized = normalize_image(data, self.max_dimension,
+                                         self.quality)
+        else:
+            normalized = self.executor.submit(
+                normalize_image, data, self.max_dimension,
+                self.quality).result()
+        self.record(cover, len(data), len(normalized))
+        return normalized
+
+    def report(self, issues, xml_bytes=None):
+        """
+        Parameters:
+            issues (dict): Issue metadata keyed by issueTitle, of the
+                           issues converted.
+            xml_bytes (int): Total size of the conversion files written.
+
+        Returns:
+            str: The bytes saved on the cover of each issue, and how much
+                 smaller the base64 of the covers made the conversion files.
+        """
+        lines = ["Covers normalized to " + str(self.max_dimension)
+                 + " pixels at quality " + str(self.quality) + ":"]
+        original_total = normalized_total = 0
+        for issue_key, issue in issues.items():
+            sizes = self.sizes.get(issue['issueCover'])
+            if sizes is None:
+                continue
+            original, normalized = sizes
+            lines.append("\t%s: %s %d -> %d bytes, %d saved" % (
+                issue_key, issue['issueCover'], original, normalized,
+                original - normalized))
+            # Each issue embeds its cover once, as base64.
+            original_total += -(-original // 3) * 4
+            normalized_total += -(-normalized // 3) * 4
+        saved = original_total - normalized_total
+        summary = "Embedded covers: %d -> %d bytes of base64" % (
+            original_total, normalized_total)
+        if xml_bytes:
+            summary += ", the conversion files are %d bytes (%.1f%%) smaller" \
+                % (saved, 100.0 * saved / (xml_bytes + saved))
+        lines.append(summary)
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Stop the worker processes, unless they are shared.
+        """
+        if self.executor is not None and not self.shared_executor:
+            self.executor.shutdown(wait=True)
@@ -0,0 +1,209 @@
+"""
+ Incremental re-conversion
+
+ Each issue in the manifest carries a fingerprint: a hash of its metadata,
+ sections, articles and the assets they reference. A later run compares the
+ fingerprints of the CSV against the previous manifest and only converts the
+ issues that were added or changed. Files holding unchanged issues are kept
+ as they are, so those issues are not imported into OJS a second time.
+
+ Functions:
+    fingerprint_issue: Stable hash of one issue and its articles
+    fingerprint_issues: Fingerprints of every issue, keyed by issueTitle
+    previous_fingerprints: Fingerprints recorded in an earlier manifest
+    compare_fingerprints: Lists the added, changed, removed and unchanged issues
+    plan_incremental: Works out what a run has to convert and what it reuses
+    merge_manifest: Adds the reused files and the change report to a manifest
+    format_changes: Readable summary of the change report
+"""
+
+import hashlib
+import json
+import re
+
+# Keys set by the drivers that only number the output, they do not change
+# the content of an issue.
+NUMBERING_KEYS = ("file_number",)
+
+
+def _canonical(row):
+    # Empty values are left out, so a column that is added or removed while
+    # empty does not count as a change. Keys are made strings before
+    # sorting. Line endings are normalized as they are in the XML, so a CSV
+    # saved with other line breaks does not count as a change either.
+    return {str(key): (value.replace("\r\n", "\n").replace("\r", "\n")
+                       if isinstance(value, str) else value)
+            for key, value in row.items() if value is not None and value != ''}
+
+
+def fingerprint_issue(issue_metadata, sections, articles, cover_base_url='',
+                      pdfs=None, covers=None):
+    """
+    Parameters:
+    issue_metadata (dict): Issue key,value pairs
+    sections (dict): Section key,value pairs of the issue keyed by
+    sectionAbbrev
+    articles (list): Article dictionaries ready for build_article
+    cover_base_url (str): Location the issue cover is downloaded from
+    pdfs (dict): (size, ETag or modification time) of each file1, as found
+    by an ojs_preflight store, so replacing a PDF changes the fingerprint
+    without reading it. PDFs only count by name when None
+    covers (dict): (size, ETag) of each issueCover, likewise
+
+    Returns:
+    str: Hex SHA-256 digest, the same for every run over the same data
+    """
+    pdfs = pdfs or {}
+    cover = issue_metadata['issueCover']
+    content = {
+        "issue": _canonical(issue_metadata),
+        "sections": [_canonical(section) for section in sections.values()],
+        "articles": [{key: value for key, value in _canonical(article).items()
+                      if key not in NUMBERING_KEYS}
+                     for article in articles],
+        "assets": {
+            "cover": ([cover_base_url + cover, (covers or {}).get(cover)]
+                      if cover else None),
+            "pdfs": [pdfs.get(article['file1']) for article in articles]}}
+    return hashlib.sha256(json.dumps(
+        content, sort_keys=True, ensure_ascii=False,
+        separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def fingerprint_issues(issues, sections, articles, cover_base_url='',
+                       pdfs=None, covers=None):
+    """
+    Parameters:
+    issues (dict): Issue metadata keyed by issueTitle
+    sections (dict): Sections of each issue keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    cover_base_url (str): Location the issue covers are downloaded from
+    pdfs (dict): (size, validator) of each file1, see fingerprint_issue
+    covers (dict): (size, validator) of each issueCover
+
+    Returns:
+    dict: Fingerprint of each issue keyed by issueTitle
+    """
+    return {issue_key: fingerprint_issue(issue_metadata, sections[issue_key],
+                                         articles[issue_key], cover_base_url,
+                                         pdfs, covers)
+            for issue_key, issue_metadata in issues.items()}
+
+
+def previous_fingerprints(manifest):
+    """
+    Parameters:
+    manifest (dict): Manifest written by an earlier run, or None
+
+    Returns:
+    dict: Fingerprint of each issue keyed by issueTitle. When an issue
+    appears in several files the latest one listed wins.
+    """
+    fingerprints = {}
+    if not manifest:
+        return fingerprints
+    for entry in manifest.get("files", []):
+        for issue in entry["issues"]:
+            if "fingerprint" in issue:
+                fingerprints[issue["issueTitle"]] = issue["fingerprint"]
+    return fingerprints
+
+
+def compare_fingerprints(previous, current):
+    """
+    Parameters:
+    previous (dict): Fingerprints of the earlier run keyed by issueTitle
+    current (dict): Fingerprints of this run keyed by issueTitle
+
+    Returns:
+    dict: Lists of issueTitles under "added", "changed", "removed" and
+    "unchanged", in CSV order (removed issues in the earlier run's order)
+    """
+    changes = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    for issue_key, fingerprint in current.items():
+        if issue_key not in previous:
+            changes["added"].append(issue_key)
+        elif previous[issue_key] != fingerprint:
+            changes["changed"].append(issue_key)
+        else:
+            changes["unchanged"].append(issue_key)
+    changes["removed"] = [issue_key for issue_key in previous
+                          if issue_key not in current]
+    return changes
+
+
+def _file_number(file_name):
+    match = re.search(r"(\d+)\.xml$", file_name)
+    return int(match.group(1)) if match else 0
+
+
+def plan_incremental(manifest, fingerprints, names_only=None):
+    """
+    Parameters:
+    manifest (dict): Manifest written by an earlier run, or None for a
+    first run
+    fingerprints (dict): Fingerprints of this run keyed by issueTitle
+    names_only (dict): Fingerprints of this run counting the PDFs and covers
+    by name only. An issue whose earlier fingerprint matches it is
+    unchanged, as runs that did not look the files up record those
+
+    Returns:
+    dict: "changes" as returned by compare_fingerprints, "convert" the
+    issueTitles to convert, "files" the earlier manifest entries still
+    holding an unchanged issue and "next_file" the number of the first
+    new conversion file, after every file of the earlier run so none of
+    them is overwritten
+    """
+    previous = previous_fingerprints(manifest)
+    if names_only is not None:
+        fingerprints = {
+            issue_key: (names_only[issue_key]
+                        if previous.get(issue_key) == names_only[issue_key]
+                        else fingerprint)
+            for issue_key, fingerprint in fingerprints.items()}
+    changes = compare_fingerprints(previous, fingerprints)
+    unchanged = set(changes["unchanged"])
+    files = []
+    next_file = 1
+    for entry in (manifest or {}).get("files", []):
+        next_file = max(next_file, _file_number(entry["file"]) + 1)
+        if any(issue["issueTitle"] in unchanged
+               and issue.get("fingerprint") == fingerprints[issue["issueTitle"]]
+               for issue in entry["issues"]):
+            files.append(entry)
+    return {"changes": changes,
+            "convert": [issue_key for issue_key in fingerprints
+                        if issue_key not in unchanged],
+            "files": files,
+            "next_file": next_file}
+
+
+def merge_manifest(manifest, incremental):
+    """
+    Parameters:
+    manifest (dict): Manifest of the files written by this run
+    incremental (dict): Plan returned by plan_incremental
+
+    Returns:
+    dict: The manifest listing the reused files before the new ones, the
+    new files under "written" and the change report under "changes"
+    """
+    return {"max_bytes": manifest["max_bytes"],
+            "files": incremental["files"] + manifest["files"],
+            "written": [entry["file"] for entry in manifest["files"]],
+            "changes": incremental["changes"]}
+
+
+def format_changes(changes):
+    """
+    Parameters:
+    changes (dict): Report returned by compare_fingerprints
+
+    Returns:
+    str: Readable summary listing the issues under each heading
+    """
+    lines = []
+    for heading in ("added", "changed", "removed", "unchanged"):
+        lines.append(heading.capitalize() + ": " + str(len(changes[heading])))
+        lines.extend("\t" + issue_key for issue_key in changes[heading])
+    return "\n".join(lines)
@@ -0,0 +1,222 @@
+"""
+ Opt-in timing and memory instrumentation of the conversion
+
+ Instrumentation is off unless enable() is called. While it is off the hooks
+ only check that nothing is recording, so conversions are not slowed down.
+ Once enabled, the pipeline stages, the ojs_builder builders and the cover
+ and S3 transfers record durations, call counts and bytes moved, which can
+ be reported as a summary dict or as a CloudWatch embedded metric format
+ (EMF) log line.
+
+ Functions:
+    enable: Starts recording into a new Metrics object
+    disable: Stops recording
+    active: The Metrics currently recording, or None
+    instrumented: Decorator timing every call of a function
+    stage: Context manager timing a stage of the pipeline
+    count: Adds to a counter such as bytes fetched
+
+ Classes:
+    Metrics: Durations, call counts and counters of one conversion
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+
+_ACTIVE = None
+
+
+class Metrics:
+    """
+    Durations, call counts and counters recorded during one conversion.
+
+    Timings of calls made from several threads at once, such as cover
+    downloads, add up, so a stage's seconds can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_timing(self, name, seconds):
+        """
+        Parameters:
+            name (str): Stage or function name.
+            seconds (float): Duration of one call.
+        """
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [seconds, 1]
+            else:
+                timing[0] += seconds
+                timing[1] += 1
+
+    def add_count(self, name, amount=1):
+        """
+        Parameters:
+            name (str): Counter name.
+            amount (int): Amount added to the counter.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @staticmethod
+    def peak_memory_megabytes():
+        """
+        Returns:
+            float: Peak resident memory of this process in MB, None where
+                   the resource module is not available, e.g. on Windows.
+        """
+        try:
+            import resource  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def summary(self):
+        """
+        Returns:
+            dict: JSON serializable summary with the seconds and calls of
+                  each stage and builder, the counters, the total seconds
+                  and the peak memory.
+        """
+        peak_memory = self.peak_memory_megabytes()
+        with self.lock:
+            return {
+                "seconds": round(time.perf_counter() - self.started, 6),
+                "peak_rss_mb": (round(peak_memory, 1)
+                                if peak_memory is not None else None),
+                "stages": {name: {"seconds": round(seconds, 6),
+                                  "calls": calls}
+                           for name, (seconds, calls) in self.timings.items()},
+                "counters": dict(self.counters)}
+
+    def emf(self, namespace="OJSImport", dimensions=None):
+        """
+        Parameters:
+            namespace (str): CloudWatch namespace of the metrics.
+            dimensions (dict): Dimension names and values, e.g. the
+                               function name.
+
+        Returns:
+            dict: The summary in CloudWatch embedded metric format, to be
+                  logged as a single JSON line.
+        """
+        dimensions = dimensions or {}
+        summary = self.summary()
+        document = dict(dimensions)
+        metrics = []
+
+        def metric(name, value, unit):
+            document[name] = value
+            metrics.append({"Name": name, "Unit": unit})
+
+        metric("Duration", round(summary["seconds"] * 1000, 3), "Milliseconds")
+        if summary["peak_rss_mb"] is not None:
+            metric("PeakMemory", summary["peak_rss_mb"], "Megabytes")
+        for name, timing in summary["stages"].items():
+            metric(name + ".Duration", round(timing["seconds"] * 1000, 3),
+                   "Milliseconds")
+            metric(name + ".Calls", timing["calls"], "Count")
+        for name, value in summary["counters"].items():
+            metric(name, value, "Bytes" if name.startswith("bytes") else "Count")
+        # EMF accepts at most 100 metrics per document.
+        document["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{"Namespace": namespace,
+                                   "Dimensions": [list(dimensions)],
+                                   "Metrics": metrics[:100]}]}
+        return document
+
+    def log(self, namespace="OJSImport", dimensions=None):
+        """
+        Print the EMF document as one JSON line, picked up from the Lambda
+        log by CloudWatch.
+        """
+        print(json.dumps(self.emf(namespace, dimensions)))
+
+
+def enable():
+    """
+    Returns:
+        Metrics: The object recording from now on.
+    """
+    global _ACTIVE
+    _ACTIVE = Metrics()
+    return _ACTIVE
+
+
+def disable():
+    """
+    Returns:
+        Metrics: The object that was recording, or None.
+    """
+    global _ACTIVE
+    metrics, _ACTIVE = _ACTIVE, None
+    return metrics
+
+
+def active():
+    """
+    Returns:
+        Metrics: The object currently recording, or None.
+    """
+    return _ACTIVE
+
+
+def instrumented(name):
+    """
+    Parameters:
+        name (str): Name the calls are recorded under.
+
+    Returns:
+        callable: Decorator recording the duration of each call of the
+                  function while instrumentation is enabled.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _ACTIVE
+            if metrics is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.add_timing(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Parameters:
+        name (str): Name the stage is recorded under.
+    """
+    metrics = _ACTIVE
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_timing(name, time.perf_counter() - start)
+
+
+def count(name, amount=1):
+    """
+    Parameters:
+        name (str): Counter name, counters named bytes... are sizes.
+        amount (int): Amount added to the counter.
+    """
+    metrics = _ACTIVE
+    if metrics is not None:
+        metrics.add_count(name, amount)
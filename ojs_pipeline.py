@@ -0,0 +1,303 @@
+"""
+ Conversion steps shared by the driver scripts
+
+ Functions:
+    publication_status: Works out the published attribute of an issue
+    render_issue: Writes one ISSUE Element through an XMLStreamWriter,
+                  pausing after each article
+    write_issue: Writes one ISSUE Element, its covers and articles, through
+                 an XMLStreamWriter
+    iter_issue_document: Renders an output document holding one issue as
+                         chunks of bytes, as they are taken
+    write_batch: Writes one output document holding a batch of issues
+    write_batches: Writes every batch to its output file, optionally in
+                   parallel worker processes
+    open_output: Opens a local output file, optionally compressed, the
+                 default for write_batches
+"""
+
+import collections
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ojs_builder import (build_identification,
+                         build_date_published,
+                         write_article,
+                         build_sections,
+                         build_cover,
+                         build_issue_galleys,
+                         build_issue_id)
+from ojs_compression import CompressedWriter, get_codec
+from ojs_metrics import instrumented
+from ojs_writer import XMLStreamWriter
+
+# Characters of an issue document rendered before they are handed out by
+# iter_issue_document.
+CHUNK_SIZE = 256 * 1024
+
+
+def publication_status(issue_metadata):
+    """
+    The issue element in the resulting XML can take a published attribute
+    of either a 0 or a 1. This tells OJS whether the issue should show as
+    published or not in OJS.
+
+    Parameters:
+    issue_metadata (dict): Issue key,value pairs, see ojs_reader.index_issues
+
+    Returns:
+    int: 1 when issueDatepublished is in the past, otherwise 0
+    """
+    date_published = datetime.datetime.strptime(
+        issue_metadata['issueDatepublished'], "%Y-%m-%d")
+    if date_published < datetime.datetime.today():
+        return 1
+    return 0
+
+
+def render_issue(writer, issue_identifier, issue_metadata, sections, articles,
+                 cover_base64=None):
+    """
+    Write an OJS Issue Element, pausing once the elements before the
+    articles are written and after each article so the caller can pass on
+    what was written so far. Each element is written as soon as it is
+    built, so only the article currently being converted is held in memory.
+
+    Parameters:
+    writer (XMLStreamWriter): Writer positioned inside the <issues> element
+    issue_identifier (int): Unique id of the issue within the output
+    issue_metadata (dict): Issue key,value pairs
+    sections (dict): Section key,value pairs of the issue keyed by
+    sectionAbbrev
+    articles (iterable): Article dictionaries ready for write_article
+    cover_base64 (str): Encoded cover image, the cover is left out when None
+
+    Returns:
+    generator: Yields None at each pause, the issue is complete once it is
+    exhausted
+    """
+    writer.start("issue", {"current": "0",
+                           "published": str(publication_status(issue_metadata))})
+    writer.element(build_issue_id(issue_identifier))
+
+    writer.element(build_identification(issue_metadata))
+    writer.element(build_date_published(issue_metadata))
+    writer.element(build_sections(sections))
+    if cover_base64 is not None:
+        writer.element(build_cover(issue_metadata, cover_base64))
+    writer.element(build_issue_galleys())
+    writer.start("articles", {})
+    yield
+    for article in articles:
+        write_article(writer, article)
+        yield
+    writer.end("articles")
+    writer.end("issue")
+
+
+def write_issue(writer, issue_identifier, issue_metadata, sections, articles,
+                cover_base64=None):
+    """
+    Write an OJS Issue Element without pausing, see render_issue.
+    """
+    for _ in render_issue(writer, issue_identifier, issue_metadata, sections,
+                          articles, cover_base64):
+        pass
+
+
+class _ChunkBuffer:
+    """
+    Text file-like object collecting what is written to it until it is
+    taken as UTF-8 bytes.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def take(self):
+        data = "".join(self.parts).encode('utf-8')
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def iter_issue_document(issue_identifier, issue_metadata, sections, articles,
+                        cover_base64=None, chunk_size=CHUNK_SIZE):
+    """
+    Render a complete OJS import document holding one issue, the same bytes
+    write_batch writes for a batch of that whole issue, a chunk at a time.
+
+    The document is only rendered as far as the chunks taken so far, so a
+    slow consumer holds up the rendering rather than the document piling
+    up in memory.
+
+    Parameters:
+    issue_identifier (int): Unique id of the issue within the output
+    issue_metadata (dict): Issue key,value pairs
+    sections (dict): Section key,value pairs of the issue keyed by
+    sectionAbbrev
+    articles (iterable): Article dictionaries ready for write_article
+    cover_base64 (str): Encoded cover image, the cover is left out when None
+    chunk_size (int): Characters rendered before a chunk is handed out.
+    Chunks are cut between articles, so an article embedding a large PDF
+    makes a larger chunk.
+
+    Returns:
+    generator: The UTF-8 bytes of the document, in chunks
+    """
+    buffer = _ChunkBuffer()
+    writer = XMLStreamWriter(buffer)
+    writer.start_document()
+    for _ in render_issue(writer, issue_identifier, issue_metadata, sections,
+                          articles, cover_base64):
+        if buffer.size >= chunk_size:
+            yield buffer.take()
+    writer.end_document()
+    yield buffer.take()
+
+
+@instrumented("write_batch")
+def write_batch(output, batch, issues, sections, articles, issue_identifiers,
+                covers):
+    """
+    Write a complete OJS import document for a batch of issues.
+
+    Parameters:
+    output (file): Text file handle the document is written to
+    batch (Batch): Issues and article ranges to write, see ojs_batching
+    issues (dict): Issue metadata keyed by issueTitle
+    sections (dict): Sections of each issue keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    issue_identifiers (dict): Issue identifiers keyed by issueTitle
+    covers (CoverFetcher): Source of the encoded cover images
+    """
+    writer = XMLStreamWriter(output)
+    writer.start_document()
+    for issue_key, first, last in batch.entries:
+        issue_metadata = issues[issue_key]
+        cover_base64 = None
+        # When an issue is split over several files only the first part
+        # carries the cover, OJS leaves the existing issue untouched when
+        # the later parts add their articles to it.
+        if first == 0 and issue_metadata['issueCover'] != '':
+            cover_base64 = covers.get(issue_metadata['issueCover'])
+        write_issue(writer, issue_identifiers[issue_key], issue_metadata,
+                    sections[issue_key], articles[issue_key][first:last],
+                    cover_base64)
+    writer.end_document()
+
+
+def open_output(output_file, compression=None):
+    """
+    Parameters:
+    output_file (str): Path of a local output file
+    compression (str): gzip or zstd to compress the file while it is
+    written, see ojs_compression
+
+    Returns:
+    file: The file opened for writing UTF-8 text
+    """
+    codec = get_codec(compression)
+    if codec is None:
+        return open(output_file, 'w', encoding='utf-8')
+    return CompressedWriter(open(output_file, 'wb'), codec)
+
+
+def _write_batch_file(output_file, batch, issues, sections, articles,
+                      issue_identifiers, covers, opener=open_output):
+    with opener(output_file) as output:
+        write_batch(output, batch, issues, sections, articles,
+                    issue_identifiers, covers)
+    return output_file
+
+
+def _batch_arguments(batch, issues, sections, articles, issue_identifiers,
+                     covers):
+    """
+    Collect just the data a batch needs so it can be sent to a worker
+    process, with its covers already retrieved.
+    """
+    keys = [issue_key for issue_key, _, _ in batch.entries]
+    cover_payloads = {}
+    for issue_key, first, _ in batch.entries:
+        cover = issues[issue_key]['issueCover']
+        if first == 0 and cover != '':
+            cover_payloads[cover] = covers.get(cover)
+    return ({key: issues[key] for key in keys},
+            {key: sections[key] for key in keys},
+            {key: articles[key] for key in keys},
+            {key: issue_identifiers[key] for key in keys},
+            cover_payloads)
+
+
+def write_batches(batches, output_files, issues, sections, articles,
+                  issue_identifiers, covers, workers=1, opener=open_output,
+                  executor=None):
+    """
+    Write each batch to its output file.
+
+    Issues and articles are numbered before this is called, so batches are
+    independent of each other and can be rendered in any order: with more
+    than one worker they are rendered by a process pool and the files are
+    byte-identical to a serial run.
+
+    Parameters:
+    batches (list): Batch objects as returned by ojs_batching.plan_batches
+    output_files (list): Path to write each batch to
+    issues (dict): Issue metadata keyed by issueTitle
+    sections (dict): Sections of each issue keyed by issueTitle
+    articles (dict): Article lists keyed by issueTitle
+    issue_identifiers (dict): Issue identifiers keyed by issueTitle
+    covers (CoverFetcher): Source of the encoded cover images
+    workers (int): Number of worker processes, 1 renders in this process
+    opener (callable): Opens each output file for writing given its name,
+    e.g. to stream it to S3. It must be picklable when workers is above 1.
+    executor (ProcessPoolExecutor): Pool shared with other conversions to
+    render the batches in, instead of starting one for this call. workers
+    then bounds the number of batches queued on it.
+
+    Returns:
+    generator: The output file paths, in order, as each file is completed
+    """
+    if executor is None and (workers is None or workers <= 1):
+        for output_file, batch in zip(output_files, batches):
+            yield _write_batch_file(output_file, batch, issues, sections,
+                                    articles, issue_identifiers, covers,
+                                    opener)
+        return
+
+    if executor is not None:
+        yield from _write_in_pool(executor, workers or 1, batches,
+                                  output_files, issues, sections, articles,
+                                  issue_identifiers, covers, opener)
+        return
+
+    # Workers are spawned rather than forked, the cover download threads
+    # running in this process must not be copied into them.
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")) as executor:
+        yield from _write_in_pool(executor, workers, batches, output_files,
+                                  issues, sections, articles,
+                                  issue_identifiers, covers, opener)
+
+
+def _write_in_pool(executor, workers, batches, output_files, issues,
+                   sections, articles, issue_identifiers, covers, opener):
+    # Only a couple of batches per worker are queued at a time so the
+    # rows and covers sent to the workers do not pile up in memory.
+    pending = collections.deque()
+    for output_file, batch in zip(output_files, batches):
+        pending.append(executor.submit(
+            _write_batch_file, output_file, batch,
+            *_batch_arguments(batch, issues, sections, articles,
+                              issue_identifiers, covers), opener))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,318 @@
+"""
+ Pre-flight check of the PDFs and covers an import CSV references
+
+ Every distinct file1 and issueCover of the CSV is looked up before any XML
+ is written, so a typo in a file name is reported up front with the rows
+ using it instead of surfacing when OJS fails partway through an import.
+ Lookups run concurrently: S3 objects with pooled HEAD requests, or by
+ listing the bucket when there are many of them, covers with HEAD requests
+ through the ojs_builder urllib3 pool, and embedded PDFs on the local disk.
+ The size and ETag, or modification time, found for each file are kept, so
+ ojs_incremental fingerprints reuse them.
+
+ Functions:
+    collect_references: Distinct file names of a column and the rows using
+                        them
+    check_references: Looks up every PDF and cover and returns the problems
+    pdf_objects: Where the PDFs of a conversion are looked up
+
+ Classes:
+    S3Objects: Sizes and ETags of objects under a prefix of an S3 bucket
+    HTTPObjects: Sizes and ETags of files under a base URL
+    LocalFiles: Sizes and modification times of files in a local folder
+"""
+
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+import ojs_builder
+from ojs_metrics import count
+from ojs_validation import ERROR, Problem
+
+"""
+Number of keys from which S3Objects lists the bucket instead of sending a
+HEAD request per key. A listing returns up to 1000 keys per request.
+"""
+LIST_THRESHOLD = 1000
+
+
+def collect_references(records, column):
+    """
+    Parameters:
+    records (list): ArticleRecord rows of one CSV
+    column (str): file1 or issueCover
+
+    Returns:
+    dict: Row numbers keyed by each distinct non-empty value of the column
+    """
+    references = collections.defaultdict(list)
+    for record in records:
+        value = record.get(column)
+        if value:
+            references[value].append(record.row)
+    return references
+
+
+class _Files:
+    """
+    Lookups shared by the stores, which implement describe and _lookup.
+    """
+
+    def __init__(self):
+        # name -> (size, validator), or None when it does not exist
+        self.found = {}
+
+    def describe(self, name):
+        """
+        Returns:
+            str: Where the file of a name is looked for.
+        """
+        raise NotImplementedError
+
+    def _lookup(self, names):
+        """
+        Returns:
+            dict: (size in bytes, ETag or modification time) of each of the
+                  names, None when it does not exist.
+        """
+        raise NotImplementedError
+
+    def lookup(self, names):
+        """
+        Parameters:
+            names (iterable): File names in the store.
+
+        Returns:
+            dict: (size in bytes, ETag or modification time) of each name,
+                  None when it does not exist. Each name is looked up once,
+                  later calls reuse what was found.
+        """
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self.found]
+        if missing:
+            self.found.update(self._lookup(missing))
+        return {name: self.found[name] for name in names}
+
+    def sizes(self, names):
+        """
+        Parameters:
+            names (iterable): File names in the store.
+
+        Returns:
+            dict: Size in bytes of each name, None when it does not exist
+                  and -1 when the store does not say.
+        """
+        return {name: found[0] if found is not None else None
+                for name, found in self.lookup(names).items()}
+
+
+class S3Objects(_Files):
+    """
+    Looks up objects under a prefix of an S3 bucket.
+    """
+
+    def __init__(self, client, bucket, prefix='', max_workers=10):
+        """
+        Parameters:
+            client (S3.Client): boto3 S3 client, see ojs_s3.s3_client.
+            bucket (str): Bucket holding the objects.
+            prefix (str): Prepended to each name to make its key, e.g. pdf/.
+            max_workers (int): Concurrent HEAD requests, botocore keeps 10
+                               connections per client by default.
+        """
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_workers = max_workers
+
+    def describe(self, name):
+        """
+        Returns:
+            str: Where the object of a name is looked for.
+        """
+        return "s3://" + self.bucket + "/" + self.prefix + name
+
+    def _head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as error:  # pylint: disable=broad-except
+            # botocore raises ClientError with the HTTP status as the code.
+            code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response['ContentLength'], response.get('ETag')
+
+    def _list(self, keys):
+        """
+        List the part of the bucket between the first and last key, which
+        takes a request per 1000 objects rather than one per key.
+        """
+        first, last = min(keys), max(keys)
+        found = {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        # StartAfter skips every key up to and including its value, a
+        # prefix of the first key sorts just before it.
+        pages = paginator.paginate(Bucket=self.bucket,
+                                   Prefix=os.path.commonprefix(list(keys)),
+                                   StartAfter=first[:-1])
+        for page in pages:
+            count("preflight_list_requests")
+            for item in page.get('Contents', []):
+                if item['Key'] in keys:
+                    found[item['Key']] = (item['Size'], item.get('ETag'))
+            if page.get('Contents') and page['Contents'][-1]['Key'] >= last:
+                break
+        return found
+
+    def _lookup(self, names):
+        keys = {self.prefix + name: name for name in names}
+        if len(keys) >= LIST_THRESHOLD:
+            listed = self._list(keys)
+            return {name: listed.get(key) for key, name in keys.items()}
+        count("preflight_head_requests", len(keys))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(keys.values(), executor.map(self._head, keys)))
+
+
+class HTTPObjects(_Files):
+    """
+    Looks up files under a base URL with HEAD requests, such as the covers
+    at the cover_base_url.
+    """
+
+    def __init__(self, base_url, pool=None, max_workers=16, timeout=30.0):
+        """
+        Parameters:
+            base_url (str): URL the file names are appended to.
+            pool (PoolManager): urllib3 pool, the one of ojs_builder by
+                                default.
+            max_workers (int): Concurrent requests.
+            timeout (float): Connect and read timeout in seconds.
+        """
+        super().__init__()
+        self.base_url = base_url
+        self.pool = pool if pool is not None else ojs_builder.http
+        self.max_workers = max_workers
+        self.timeout = urllib3.Timeout(connect=timeout, read=timeout)
+        self.retries = urllib3.Retry(total=3, backoff_factor=0.5,
+                                     status_forcelist=(500, 502, 503, 504))
+
+    def describe(self, name):
+        """
+        Returns:
+            str: Where the file of a name is looked for.
+        """
+        return self.base_url + name
+
+    def _head(self, name):
+        response = self.pool.request('HEAD', self.base_url + name,
+                                     retries=self.retries,
+                                     timeout=self.timeout)
+        # S3 answers 403 rather than 404 for missing objects of buckets
+        # that cannot be listed anonymously.
+        if response.status in (403, 404):
+            return None
+        if response.status != 200:
+            raise urllib3.exceptions.HTTPError(
+                "HEAD " + self.base_url + name + ": HTTP "
+                + str(response.status))
+        length = response.headers.get('Content-Length')
+        return (int(length) if length is not None else -1,
+                response.headers.get('ETag'))
+
+    def _lookup(self, names):
+        count("preflight_head_requests", len(names))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(names, executor.map(self._head, names)))
+
+
+class LocalFiles(_Files):
+    """
+    Looks up files in a local folder, such as the PDFs embedded by
+    generate_xml_embedded.py.
+    """
+
+    def __init__(self, folder):
+        """
+        Parameters:
+            folder (str): Folder holding the files.
+        """
+        super().__init__()
+        self.folder = folder
+
+    def describe(self, name):
+        """
+        Returns:
+            str: Path the file of a name is looked for at.
+        """
+        return os.path.join(self.folder, name)
+
+    def _lookup(self, names):
+        found = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                found[name] = None
+                continue
+            found[name] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+
+def check_references(records, pdfs, covers=None):
+    """
+    Look up every PDF and cover referenced by the CSV.
+
+    Parameters:
+    records (list): ArticleRecord rows of one CSV
+    pdfs: S3Objects, HTTPObjects or LocalFiles the file1 PDFs are in
+    covers: S3Objects, HTTPObjects or LocalFiles the issueCover images are
+    in, covers are not checked when None
+
+    Returns:
+    list: A Problem for each missing or empty file, with the rows using it,
+    in the order of their first row
+    """
+    problems = []
+    lookups = [('file1', pdfs)]
+    if covers is not None:
+        lookups.append(('issueCover', covers))
+    for column, store in lookups:
+        references = collect_references(records, column)
+        sizes = store.sizes(references)
+        for name, rows in references.items():
+            size = sizes.get(name)
+            if size is None:
+                message = "'%s' does not exist at %s" % (
+                    name, store.describe(name))
+            elif size == 0:
+                message = "'%s' is empty at %s" % (name, store.describe(name))
+            else:
+                continue
+            problems.append(Problem(tuple(rows), column, message, ERROR))
+    problems.sort(key=lambda problem: problem.rows[0])
+    return problems
+
+
+def pdf_objects(defaults, client=None, bucket=None, bucket_prefix=''):
+    """
+    Parameters:
+    defaults (dict): Article defaults of the conversion, pdf_folder when the
+    PDFs are embedded or bucket_location when they are linked to
+    client (S3.Client): boto3 S3 client, see ojs_s3.s3_client. When given
+    linked PDFs are looked up in the bucket itself, as preflight does,
+    rather than at bucket_location
+    bucket (str): Bucket the linked PDFs are in
+    bucket_prefix (str): Path of the PDFs in the bucket, e.g. /pdf/
+
+    Returns:
+    LocalFiles, S3Objects or HTTPObjects: Where the PDFs are looked up
+    """
+    if defaults.get('pdf_folder'):
+        return LocalFiles(defaults['pdf_folder'])
+    if client is not None:
+        return S3Objects(client, bucket, bucket_prefix.lstrip('/'))
+    return HTTPObjects(defaults['bucket_location'])
@@ -0,0 +1,271 @@
+"""
+ OJS Import CSV reader functions
+
+ Functions:
+    read_records: Parses CSV text into compact ArticleRecord rows
+    read_rows: Turns rows from any source into ArticleRecord rows
+    index_issues: Groups CSV rows into issues, sections and articles in a
+                  single pass, keeping issues in the order they first appear
+    number_articles: Numbers the issues and articles for the output
+
+ Classes:
+    Columns: Column layout and defaults shared by every row of a CSV
+    ArticleRecord: Read-only mapping over the cells of one CSV row
+"""
+
+import collections.abc
+import csv
+import re
+
+"""
+Values used for columns the CSV does not have.
+"""
+ARTICLE_DEFAULTS = {
+    'submission_stage': 'submission',
+    'revision_number': "1",
+}
+
+"""
+Values used when a column is missing or left empty.
+"""
+BLANK_DEFAULTS = {
+    'fileGenre1': 'Article Text',
+    'authorFamilyname1': "Unknown",
+    'authorGivenname1': "Unknown",
+}
+
+"""
+Columns whose values repeat on every row of an issue or section, so one
+string is kept per distinct value instead of one per row.
+"""
+SHARED_COLUMNS = re.compile(r"^(issue|section|uploader|language|fileGenre"
+                            r"|fileLocale)")
+
+
+class Columns:
+    """
+    The layout of a CSV, worked out once from its header: where each column
+    is in a row and the defaults of the columns that are missing or empty.
+    """
+
+    __slots__ = ('index', 'width', 'defaults', 'blanks', 'shared')
+
+    def __init__(self, header, defaults=None):
+        """
+        Parameters:
+            header (list): Column names, in CSV order.
+            defaults (dict): Values of extra keys every row should have,
+                             e.g. bucket_location or pdf_folder.
+        """
+        # A repeated column name reads as its last column, as with
+        # csv.DictReader.
+        self.index = {name: position for position, name in enumerate(header)}
+        self.width = len(header)
+        self.defaults = dict(ARTICLE_DEFAULTS)
+        # Every author has an email, empty when the CSV has no column for it.
+        for name in header:
+            if name.startswith('authorGivenname'):
+                self.defaults['authorEmail' + name[len('authorGivenname'):]] = ''
+        self.defaults.update(BLANK_DEFAULTS)
+        self.defaults.update(defaults or {})
+        for name in self.index:
+            self.defaults.pop(name, None)
+        self.blanks = {self.index[name]: value
+                       for name, value in BLANK_DEFAULTS.items()
+                       if name in self.index}
+        self.shared = [(position, {}) for name, position in self.index.items()
+                       if SHARED_COLUMNS.match(name)]
+
+    def record(self, cells, row=None):
+        """
+        Parameters:
+            cells (list): Cells of one row, as returned by csv.reader.
+            row (int): Row number in the CSV, the header being row 1.
+
+        Returns:
+            ArticleRecord: The row backed by a tuple of its cells.
+        """
+        if len(cells) > self.width:
+            # Cells beyond the header have no column name to be read by.
+            del cells[self.width:]
+        for position, seen in self.shared:
+            if position < len(cells):
+                cells[position] = seen.setdefault(cells[position],
+                                                  cells[position])
+        return ArticleRecord(self, tuple(cells), row)
+
+
+class ArticleRecord(collections.abc.Mapping):
+    """
+    One CSV row, read like the dictionary csv.DictReader returns plus the
+    defaults of its Columns and its file_number once numbered. The row
+    number is kept for reporting problems with the row.
+
+    The cells are kept in a tuple and the column names and defaults are
+    shared by every row, so a record takes a fraction of the memory of a
+    dictionary per row.
+    """
+
+    __slots__ = ('columns', 'cells', 'row', 'file_number')
+
+    def __init__(self, columns, cells, row=None):
+        """
+        Parameters:
+            columns (Columns): Layout shared by the rows of the CSV.
+            cells (tuple): Cells of the row.
+            row (int): Row number in the CSV, the header being row 1.
+        """
+        self.columns = columns
+        self.cells = cells
+        self.row = row
+        self.file_number = None
+
+    def __getitem__(self, key):
+        position = self.columns.index.get(key)
+        if position is None:
+            if key == 'file_number' and self.file_number is not None:
+                return self.file_number
+            return self.columns.defaults[key]
+        # Cells missing from short rows read as None, like csv.DictReader's
+        # restval.
+        value = self.cells[position] if position < len(self.cells) else None
+        if not value and position in self.columns.blanks:
+            return self.columns.blanks[position]
+        return value
+
+    def __contains__(self, key):
+        return (key in self.columns.index or key in self.columns.defaults
+                or (key == 'file_number' and self.file_number is not None))
+
+    def __iter__(self):
+        yield from self.columns.index
+        yield from self.columns.defaults
+        if self.file_number is not None:
+            yield 'file_number'
+
+    def __len__(self):
+        return (len(self.columns.index) + len(self.columns.defaults)
+                + (self.file_number is not None))
+
+    def __repr__(self):
+        return "ArticleRecord(%r)" % dict(self)
+
+
+def read_records(lines, defaults=None):
+    """
+    Parameters:
+    lines (iterable): Lines of CSV text starting with the header, e.g. an
+                      open file or ojs_s3.iter_lines
+    defaults (dict): Values of extra keys every row should have, such as
+                     bucket_location or pdf_folder
+
+    Returns:
+    generator: An ArticleRecord for each row, with the defaults applied and
+    the row number it has in a spreadsheet, blank rows included
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = Columns(header, defaults)
+    for row, cells in enumerate(reader, 2):
+        if cells:
+            yield columns.record(cells, row)
+
+
+def read_rows(rows, defaults=None):
+    """
+    Parameters:
+    rows (iterable): Rows of an import CSV from any source: ArticleRecords,
+                     which are passed on as they are, or dictionaries keyed
+                     by column name such as csv.DictReader rows or database
+                     rows. Values that are not strings are converted.
+    defaults (dict): Values of extra keys every dictionary row should have,
+                     such as bucket_location or pdf_folder
+
+    Returns:
+    generator: An ArticleRecord for each row, numbered as the rows of a
+    spreadsheet with a header row would be
+    """
+    # Rows with the same columns share a layout, as the rows of a CSV do.
+    layouts = {}
+    for row_number, row in enumerate(rows, 2):
+        if isinstance(row, ArticleRecord):
+            yield row
+            continue
+        # csv.DictReader keeps the cells beyond the header under None.
+        header = tuple(name for name in row if name is not None)
+        columns = layouts.get(header)
+        if columns is None:
+            columns = layouts[header] = Columns(list(header), defaults)
+        cells = [row[name] for name in header]
+        yield columns.record(
+            [cell if cell is None or isinstance(cell, str) else str(cell)
+             for cell in cells], row_number)
+
+
+def index_issues(rows):
+    """
+    Group CSV rows by issueTitle in one pass over the rows.
+
+    Parameters:
+    rows (iterable): Dictionaries for each CSV row, e.g. a csv.DictReader.
+                     The rows are consumed once and are not copied.
+
+    Returns:
+    tuple: (issues, sections, articles) dictionaries keyed by issueTitle.
+           issues holds the issue metadata taken from the first row of each
+           issue, sections holds the sections of each issue keyed by their
+           sectionAbbrev, in the order they first appear, and articles
+           holds the rows themselves. A section takes the sectionTitle of
+           its first row, ojs_validation reports abbreviations used with
+           several titles.
+    """
+    issues = {}
+    sections = {}
+    articles = {}
+    for row in rows:
+        issue_title = row['issueTitle']
+        if issue_title not in issues:
+            issues[issue_title] = {
+                "issueYear": row['issueYear'],
+                "issueVolume": row['issueVolume'],
+                "issueNumber": row['issueNumber'],
+                "issueDatepublished": row['issueDatepublished'],
+                "issueTitle": row['issueTitle'],
+                "issueCover": row['issueCover']}
+            sections[issue_title] = {}
+            articles[issue_title] = []
+        # Articles refer to their section by its abbreviation, so each
+        # section is listed once however many articles it has.
+        section_abbrev = row['sectionAbbrev']
+        if section_abbrev not in sections[issue_title]:
+            sections[issue_title][section_abbrev] = {
+                "sectionTitle": row['sectionTitle'],
+                "sectionAbbrev": section_abbrev}
+        articles[issue_title].append(row)
+    return issues, sections, articles
+
+
+def number_articles(issues, articles):
+    """
+    Number the issues and articles up front so the output can be split into
+    files independently of the order they are written in.
+
+    Parameters:
+    issues (dict): Issue metadata keyed by issueTitle
+    articles (dict): ArticleRecord lists keyed by issueTitle, each gets its
+    file_number
+
+    Returns:
+    dict: Issue identifiers keyed by issueTitle. Each issue has a unique ID,
+    as of version 3.2.1-4 OJS requires these elements.
+    """
+    file_number = 0
+    issue_identifiers = {}
+    for issue_identifier, issue_key in enumerate(issues, 1):
+        issue_identifiers[issue_key] = issue_identifier
+        for article in articles[issue_key]:
+            file_number += 1
+            article.file_number = str(file_number)
+    return issue_identifiers
@@ -0,0 +1,331 @@
+"""
+ Streaming S3 input and output for the Lambda conversion
+
+ The CSV is read straight from the get_object body and each conversion file
+ is uploaded while it is being written, so nothing is staged in /tmp and
+ local disk use does not depend on the size of the journal. Uploads can
+ instead be held until they are complete and skipped when the bucket
+ already holds identical bytes, e.g. when a CSV is converted again.
+
+ Functions:
+    s3_client: Creates the S3 client used by the Lambda handlers
+    upload_options: Upload settings of the Lambda environment
+    iter_lines: Decodes a binary stream incrementally into text lines for
+                csv.reader/csv.DictReader
+
+ Classes:
+    S3UploadStream: Text file-like object uploading what is written to it
+                    as an S3 multipart upload
+"""
+
+import codecs
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from ojs_metrics import count, instrumented
+
+# S3 requires every part but the last to be at least 5 MB.
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# Parts of one file uploaded at once.
+DEFAULT_CONCURRENCY = 4
+# Output held in memory before spilling to /tmp when skipping unchanged
+# uploads.
+DEFAULT_SPOOL_SIZE = 64 * 1024 * 1024
+
+
+def s3_client():
+    """
+    Returns:
+        S3.Client: boto3 S3 client. Setting S3_ENDPOINT_URL points it at
+                   another S3 implementation, e.g. a local stand-in.
+    """
+    return boto3.client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
+
+
+def upload_options():
+    """
+    Returns:
+        dict: S3UploadStream keyword arguments set by the environment of
+              the Lambda: SKIP_UNCHANGED=0 always uploads, UPLOAD_PART_SIZE
+              is the part size in MB and UPLOAD_CONCURRENCY the number of
+              parts uploaded at once.
+    """
+    options = {'skip_unchanged':
+               os.environ.get('SKIP_UNCHANGED', '1') not in ('', '0')}
+    if os.environ.get('UPLOAD_PART_SIZE'):
+        options['part_size'] = int(os.environ['UPLOAD_PART_SIZE']) * 1024 * 1024
+    if os.environ.get('UPLOAD_CONCURRENCY'):
+        options['max_concurrency'] = int(os.environ['UPLOAD_CONCURRENCY'])
+    return options
+
+
+def iter_lines(body, encoding='utf-8-sig', chunk_size=64 * 1024):
+    """
+    Parameters:
+        body (file): Binary stream with a read method, such as the Body of
+                     an S3 get_object response.
+        encoding (str): Text encoding, utf-8-sig drops a byte order mark.
+        chunk_size (int): Bytes read from the stream at a time.
+
+    Returns:
+        generator: Lines of text including their line endings. Only "\\n"
+                   ends a line, so quoted CSV fields keep any other line
+                   break characters they contain.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = body.read(chunk_size)
+        count("bytes_downloaded", len(chunk))
+        pending += decoder.decode(chunk, final=not chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+class S3UploadStream:
+    """
+    Upload text, or bytes, written to this object to S3.
+
+    Written text is encoded and buffered until a part is full, then sent
+    with upload_part. Up to max_concurrency parts are uploaded at once by
+    a thread pool, so at most that many parts and the one being filled are
+    held in memory. Output smaller than one part is sent with a single
+    put_object when the stream is closed. If closing fails, or the stream
+    is closed after an exception in a with block, the multipart upload is
+    aborted so no parts are left behind.
+
+    With skip_unchanged the output is held until the stream is closed, in
+    memory up to spool_size bytes and in a temporary file beyond that, and
+    only uploaded when it differs from the object already at the key. The
+    SHA-256 of the output is stored in the object's metadata and compared
+    with the one of the existing object, or its MD5 with the existing
+    ETag when the object has no SHA-256, as for objects uploaded before.
+    """
+
+    def __init__(self, client, bucket, key, part_size=DEFAULT_PART_SIZE,
+                 content_type='application/xml', encoding='utf-8',
+                 content_encoding=None, skip_unchanged=False,
+                 max_concurrency=DEFAULT_CONCURRENCY,
+                 spool_size=DEFAULT_SPOOL_SIZE):
+        """
+        Parameters:
+            client (S3.Client): boto3 S3 client.
+            bucket (str): Destination bucket.
+            key (str): Destination object key.
+            part_size (int): Bytes per uploaded part, at least 5 MB. Output
+                             larger than one part is a multipart upload.
+            content_type (str): Content-Type of the object.
+            encoding (str): Encoding of the uploaded text.
+            content_encoding (str): Content-Encoding of the object, e.g. gzip
+                                    when compressed data is written through
+                                    an ojs_compression.CompressedWriter.
+            skip_unchanged (bool): Leave the existing object alone when the
+                                   output is identical to it.
+            max_concurrency (int): Parts uploaded at once.
+            spool_size (int): Bytes of held output kept in memory with
+                              skip_unchanged before spilling to /tmp.
+        """
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.metadata = {'ContentType': content_type}
+        if content_encoding:
+            self.metadata['ContentEncoding'] = content_encoding
+        self.encoding = encoding
+        self.skip_unchanged = skip_unchanged
+        self.max_concurrency = max(max_concurrency, 1)
+        self.spool = None
+        if skip_unchanged:
+            self.spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.buffer = bytearray()
+        self.sha256 = hashlib.sha256()
+        self.part_digests = []
+        self.upload_id = None
+        self.executor = None
+        self.pending = []
+        self.parts = []
+        self.bytes_written = 0
+        self.uploaded = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, text):
+        """
+        Parameters:
+            text (str): Text to upload, or bytes already encoded.
+        """
+        data = text.encode(self.encoding) if isinstance(text, str) else text
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._end_part()
+        return len(text)
+
+    def _end_part(self):
+        # Parts are cut at exactly part_size, whatever the size of the
+        # writes, so held output is read back from the spool part by part
+        # and its ETag is the one S3 computes.
+        part = bytes(self.buffer[:self.part_size])
+        del self.buffer[:self.part_size]
+        self.sha256.update(part)
+        self.part_digests.append(hashlib.md5(part).digest())
+        if self.spool is not None:
+            self.spool.write(part)
+        else:
+            self._submit_part(part)
+
+    def _submit_part(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+                **self.metadata)['UploadId']
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency)
+        # Waiting for the oldest part bounds the parts held in memory.
+        if len(self.pending) >= self.max_concurrency:
+            self.parts.append(self.pending.pop(0).result())
+        self.pending.append(self.executor.submit(
+            self._upload_part, len(self.parts) + len(self.pending) + 1,
+            part))
+
+    @instrumented("upload_part")
+    def _upload_part(self, part_number, part):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=part)
+        count("bytes_uploaded", len(part))
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def _etag(self):
+        """
+        Returns:
+            str: The ETag S3 gives the output when uploaded in parts of
+                 part_size: the MD5 of a single part, or the MD5 of the
+                 MD5s of several followed by their number.
+        """
+        if len(self.part_digests) == 1:
+            return self.part_digests[0].hex()
+        return (hashlib.md5(b''.join(self.part_digests)).hexdigest()
+                + '-' + str(len(self.part_digests)))
+
+    def _unchanged(self):
+        """
+        Returns:
+            bool: Whether the object at the key already holds the output,
+                  with the same Content-Type and Content-Encoding.
+        """
+        try:
+            existing = self.client.head_object(Bucket=self.bucket,
+                                               Key=self.key)
+        except Exception as error:  # pylint: disable=broad-except
+            code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        if (existing.get('ContentLength') != self.bytes_written
+                or existing.get('ContentType') != self.metadata['ContentType']
+                or existing.get('ContentEncoding')
+                != self.metadata.get('ContentEncoding')):
+            return False
+        sha256 = existing.get('Metadata', {}).get('sha256')
+        if sha256:
+            return sha256 == self.sha256.hexdigest()
+        return existing.get('ETag', '').strip('"') == self._etag()
+
+    def _put(self, data):
+        self.metadata['Metadata'] = {
+            'sha256': hashlib.sha256(data).hexdigest()}
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=data,
+                               **self.metadata)
+        count("bytes_uploaded", len(data))
+
+    def _upload_held(self):
+        """
+        Upload the output held with skip_unchanged, recording its SHA-256.
+        """
+        self.spool.seek(0)
+        if len(self.part_digests) == 1:
+            self._put(self.spool.read())
+            return
+        self.metadata['Metadata'] = {'sha256': self.sha256.hexdigest()}
+        for _ in self.part_digests:
+            self._submit_part(self.spool.read(self.part_size))
+
+    def close(self):
+        """
+        Send the remaining buffered text and complete the upload, or with
+        skip_unchanged leave the existing object when it holds the output.
+        """
+        if self.closed:
+            return
+        try:
+            if self.spool is not None:
+                if self.buffer or not self.part_digests:
+                    self._end_part()
+                if self._unchanged():
+                    count("bytes_skipped", self.bytes_written)
+                    self.uploaded = False
+                else:
+                    self._upload_held()
+            elif self.upload_id is None:
+                self._put(bytes(self.buffer))
+            elif self.buffer:
+                self._end_part()
+            if self.upload_id is not None:
+                self.parts.extend(future.result() for future in self.pending)
+                self.pending = []
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts})
+        except Exception:
+            self.abort()
+            raise
+        if self.uploaded is None:
+            self.uploaded = True
+        self._release()
+        self.closed = True
+
+    def _release(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        self.pending = []
+        self.buffer = bytearray()
+
+    def abort(self):
+        """
+        Discard the upload, removing any parts already sent.
+        """
+        # Parts still uploading would be left behind by the abort.
+        for future in self.pending:
+            future.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self._release()
+        self.closed = True
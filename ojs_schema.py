@@ -0,0 +1,276 @@
+"""
+ Declarative element schemas compiled into fast XML writers
+
+ An element schema describes the XML written for one record, e.g. an
+ article row of the CSV, with its attribute and text values taken from the
+ record. A schema is compiled once into a list of steps: the markup that does
+ not depend on the record, indentation included, is joined into constant
+ strings ahead of time, so writing a record only looks up and escapes its
+ values. The output is the same as passing the element built by build() to
+ ojs_writer.XMLStreamWriter.element.
+
+ Values in a schema are either constant strings or callables taking the
+ record (a dict) and returning the value; a value of None is left out.
+
+ Functions:
+    field: Value taken from a key of the record
+
+ Classes:
+    Element: Schema of an element, its attributes, text and child elements
+    Repeat: Writes an element once for each item derived from the record
+"""
+
+import operator
+import xml.etree.ElementTree as ElementTree
+from ojs_writer import EmbeddedFile, escape
+
+
+def field(name):
+    """
+    Parameters:
+        name (str): Key of the record holding the value.
+
+    Returns:
+        callable: Returns the value stored under name in a record.
+    """
+    return operator.itemgetter(name)
+
+
+def _text(value):
+    # Character data is normalized as XMLStreamWriter.data does.
+    return escape(value.replace("\r\n", "\n").replace("\r", "\n"))
+
+
+def _emitter(steps):
+    """
+    Join the constant steps and return a function appending the output of
+    all the steps for a record to a list of parts.
+    """
+    merged = []
+    for step in steps:
+        if isinstance(step, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += step
+        else:
+            merged.append(step)
+    if len(merged) == 1 and isinstance(merged[0], str):
+        constant = merged[0]
+
+        def emit_constant(record, parts):
+            parts.append(constant)
+        return emit_constant
+
+    def emit(record, parts):
+        for step in merged:
+            if step.__class__ is str:
+                parts.append(step)
+            else:
+                step(record, parts)
+    return emit
+
+
+class Element:
+    """
+    Schema of an XML element.
+
+    An element has either text or child elements. An element whose text is
+    empty, or whose children all end up left out, is self-closed.
+    """
+
+    def __init__(self, tag, attrib=None, text=None, children=(), when=None):
+        """
+        Parameters:
+            tag (str): Element name.
+            attrib (dict): Attribute values, constant or callable, written in
+                           insertion order.
+            text: Constant or callable text, a callable may return an
+                  EmbeddedFile to stream a file as base64.
+            children (list): Element and Repeat schemas of the children.
+            when (callable): Predicate on the record, the element is left out
+                             when it returns False.
+        """
+        self.tag = tag
+        self.attrib = attrib or {}
+        self.text = text
+        self.children = list(children)
+        self.when = when
+        self._emitters = {}
+
+    def _compile(self, prefix, indent, newline):
+        """
+        Returns:
+            list: Steps writing the element indented by prefix, strings or
+                  callables taking (record, parts).
+        """
+        steps = [prefix + "<" + self.tag]
+        for name, value in self.attrib.items():
+            if callable(value):
+                steps.append(self._attribute_step(name, value))
+            elif value is not None:
+                steps.append(" " + name + "=\"" + escape(value) + "\"")
+
+        if self.children:
+            child_steps = []
+            for child in self.children:
+                child_steps.extend(child._compile(prefix + indent, indent,
+                                                  newline))
+            steps.append(self._children_step(
+                child_steps, prefix + "</" + self.tag + ">" + newline,
+                newline))
+        elif callable(self.text):
+            steps.append(self._text_step(self.text, newline))
+        elif self.text:
+            steps.append(">" + _text(self.text) + "</" + self.tag + ">"
+                         + newline)
+        else:
+            steps.append("/>" + newline)
+
+        if self.when is None:
+            return steps
+        emit = _emitter(steps)
+        when = self.when
+
+        def emit_when(record, parts):
+            if when(record):
+                emit(record, parts)
+        return [emit_when]
+
+    @staticmethod
+    def _attribute_step(name, value):
+        start = " " + name + "=\""
+
+        def emit_attribute(record, parts):
+            attribute = value(record)
+            if attribute is not None:
+                parts.append(start + escape(attribute) + "\"")
+        return emit_attribute
+
+    def _text_step(self, text, newline):
+        end = "</" + self.tag + ">" + newline
+        empty = "/>" + newline
+
+        def emit_text(record, parts):
+            value = text(record)
+            if isinstance(value, EmbeddedFile):
+                parts.append(">")
+                parts.append(value)
+                parts.append(end)
+            elif value:
+                parts.append(">" + _text(value) + end)
+            else:
+                parts.append(empty)
+        return emit_text
+
+    @staticmethod
+    def _children_step(child_steps, end, newline):
+        if all(isinstance(step, str) for step in child_steps):
+            return ">" + newline + "".join(child_steps) + end
+        emit_children = _emitter(child_steps)
+
+        def emit_optional_children(record, parts):
+            children = []
+            emit_children(record, children)
+            if children:
+                parts.append(">" + newline)
+                parts.extend(children)
+                parts.append(end)
+            else:
+                parts.append("/>" + newline)
+        return emit_optional_children
+
+    def emitter(self, depth, indent="\t", newline="\n"):
+        """
+        Parameters:
+            depth (int): Nesting level the element is written at.
+            indent (str): Indentation added for each level of nesting.
+            newline (str): Line terminator written after each element.
+
+        Returns:
+            callable: Takes (record, parts) and appends the element's markup
+                      to the parts list. Compiled once per depth.
+        """
+        key = (depth, indent, newline)
+        if key not in self._emitters:
+            self._emitters[key] = _emitter(
+                self._compile(indent * depth, indent, newline))
+        return self._emitters[key]
+
+    def write(self, writer, record):
+        """
+        Write the element for a record at the writer's current nesting level.
+
+        Parameters:
+            writer (XMLStreamWriter): Writer the element is written through.
+            record (dict): Values of the element.
+        """
+        parts = []
+        self.emitter(writer.depth, writer.indent, writer.newline)(record, parts)
+        writer.raw(parts)
+
+    def build(self, record):
+        """
+        Parameters:
+            record (dict): Values of the element.
+
+        Returns:
+            Element: ElementTree Element for the record, or None when the
+                     element is left out.
+        """
+        if self.when is not None and not self.when(record):
+            return None
+        attrib = {}
+        for name, value in self.attrib.items():
+            if callable(value):
+                value = value(record)
+            if value is not None:
+                attrib[name] = value
+        element = ElementTree.Element(self.tag, attrib)
+        text = self.text(record) if callable(self.text) else self.text
+        if text:
+            element.text = text
+        for child in self.children:
+            element.extend(child.build_all(record))
+        return element
+
+    def build_all(self, record):
+        """
+        Returns:
+            list: The Elements built for a record, for use as a child.
+        """
+        element = self.build(record)
+        return [] if element is None else [element]
+
+
+class Repeat:
+    """
+    Schema writing an element once for each item of a record, e.g. one
+    author element for each author of an article.
+    """
+
+    def __init__(self, items, element):
+        """
+        Parameters:
+            items (callable): Takes the record and returns the records the
+                              element is written for.
+            element (Element): Schema written for each item.
+        """
+        self.items = items
+        self.element = element
+
+    def _compile(self, prefix, indent, newline):
+        items = self.items
+        emit = _emitter(self.element._compile(prefix, indent, newline))
+
+        def emit_items(record, parts):
+            for item in items(record):
+                emit(item, parts)
+        return [emit_items]
+
+    def build_all(self, record):
+        """
+        Returns:
+            list: The Elements built for each item of a record.
+        """
+        elements = []
+        for item in self.items(record):
+            elements.extend(self.element.build_all(item))
+        return elements
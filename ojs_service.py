@@ -0,0 +1,532 @@
+"""
+ Long-running conversion service
+
+ Keeps everything a conversion starts from warm between conversions: the
+ worker processes rendering the output files, the cover download threads
+ and cover cache, the urllib3 pool of ojs_builder, the S3 client and the
+ parsed XML schema. CSVs are submitted as jobs, by a watched directory or
+ over a local HTTP endpoint, queued, and converted a few at a time like
+ convert_journals.py converts a journal. The queue depth and the latency of
+ each job are reported as jobs finish and by the status of the service.
+
+ HTTP endpoint:
+    POST /jobs?name=atos    Body is an import CSV, converted into
+                            OUTPUT/atos/. Answers 202 with the job, or 503
+                            when the queue is full.
+    GET /jobs/<id>          The job, with its conversion summary once done
+    GET /jobs               Every job still remembered
+    GET /status             Queue depth, job counts and latencies
+
+ Classes:
+    QueueFull: Raised when a job is submitted to a full queue
+    ConversionService: Queues CSVs and converts them with warm pools
+    DirectoryWatcher: Submits the CSVs written to a directory
+    ServiceServer: HTTP server submitting uploaded CSVs to a service
+    ServiceHandler: Request handler of ServiceServer
+"""
+
+import collections
+import datetime
+import http.server
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from convert_journals import JOURNAL_DEFAULTS, convert_journal, find_csvs
+from ojs_covers import CoverCache
+from ojs_s3 import s3_client
+from ojs_xsd import load_schema
+
+# Finished jobs remembered for GET /jobs and the latency percentiles.
+HISTORY = 1000
+# Names of uploaded CSVs become directory names.
+NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while max_queued jobs are waiting.
+    """
+
+
+def _warm_up():
+    # Importing ojs_service imports the whole pipeline in the worker.
+    return os.getpid()
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class ConversionService:
+    """
+    Converts submitted CSVs, jobs at a time, sharing one set of warm pools.
+
+    Jobs converting into the same output directory run one after the other,
+    so an incremental job always sees the manifest of the one before it.
+    """
+
+    def __init__(self, settings=None, output_root="converted", jobs=2,
+                 workers=os.cpu_count(), cover_downloads=8, max_queued=None,
+                 status_file=None, history=HISTORY,
+                 cover_cache_max_age=None):
+        """
+        Parameters:
+            settings (dict): Journal settings of every job, see
+                             convert_journals.JOURNAL_DEFAULTS.
+            output_root (str): Directory each job gets an output directory
+                               in, named after its CSV.
+            jobs (int): Jobs converted at the same time.
+            workers (int): Processes rendering output files, started now
+                           and shared by the jobs.
+            cover_downloads (int): Covers downloaded at the same time.
+            max_queued (int): Jobs waiting at most, None for no limit.
+            status_file (str): File the status is written to as each job
+                               finishes.
+            history (int): Finished jobs remembered.
+            cover_cache_max_age (int): Seconds a cached cover is used before
+                                       checking it has not changed, forever
+                                       when None.
+
+        Raises:
+            ValueError: When a setting is unknown, or validate_xml is set
+                        without lxml installed.
+        """
+        unknown = set(settings or {}) - set(JOURNAL_DEFAULTS)
+        if unknown:
+            raise ValueError("Unknown journal settings: "
+                             + ", ".join(sorted(unknown)))
+        self.settings = dict(JOURNAL_DEFAULTS)
+        self.settings.update(settings or {})
+        self.output_root = output_root
+        self.concurrency = jobs
+        self.workers = workers
+        self.max_queued = max_queued
+        self.status_file = status_file
+        self.history = history
+        # Reentrant, a job finished before submit returns calls _done there.
+        self.lock = threading.RLock()
+        self.jobs = collections.OrderedDict()
+        self.futures = {}
+        self.output_locks = {}
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=history)
+        self.job_ids = itertools.count(1)
+        self.started = time.perf_counter()
+
+        if self.settings["validate_xml"]:
+            # Fails now rather than on every job when lxml is missing.
+            load_schema()
+        self.client = None
+        self.client_lock = threading.Lock()
+        if self.settings["preflight"] and not self.settings["pdf_folder"]:
+            self._s3_client()
+        self.cover_cache = CoverCache(max_age=cover_cache_max_age)
+        self.cover_executor = ThreadPoolExecutor(max_workers=cover_downloads)
+        self.job_executor = ThreadPoolExecutor(max_workers=jobs)
+        self.executor = None
+        if workers and workers > 1:
+            # Spawned rather than forked, like write_batches does, and
+            # started now so the first job does not wait for them.
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"))
+            for future in [self.executor.submit(_warm_up)
+                           for _ in range(workers)]:
+                future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _s3_client(self):
+        # Clients are thread-safe once made, making them is not.
+        with self.client_lock:
+            if self.client is None:
+                self.client = s3_client()
+            return self.client
+
+    def _output_lock(self, output_dir):
+        with self.lock:
+            return self.output_locks.setdefault(os.path.abspath(output_dir),
+                                                threading.Lock())
+
+    def submit(self, input_csv, name=None, remove_input=False):
+        """
+        Queue a CSV to be converted.
+
+        Parameters:
+            input_csv (str): Path of the CSV.
+            name (str): Name of the job's output directory in output_root,
+                        the name of the CSV without its extension when None.
+            remove_input (bool): Remove the CSV once it is converted.
+
+        Returns:
+            dict: The job as queued, see job.
+
+        Raises:
+            QueueFull: When max_queued jobs are already waiting.
+        """
+        if name is None:
+            name = os.path.splitext(os.path.basename(input_csv))[0]
+        journal = dict(self.settings)
+        journal["input_csv"] = input_csv
+        journal["output_dir"] = os.path.join(self.output_root, name)
+        with self.lock:
+            if (self.max_queued is not None
+                    and self.counts["queued"] >= self.max_queued):
+                raise QueueFull("%d jobs are already queued"
+                                % self.counts["queued"])
+            job = {"id": str(next(self.job_ids)),
+                   "name": name,
+                   "input_csv": input_csv,
+                   "output_dir": journal["output_dir"],
+                   "status": "queued",
+                   "submitted": datetime.datetime.now().isoformat(
+                       timespec="seconds")}
+            self.jobs[job["id"]] = job
+            self.counts["queued"] += 1
+            self.counts["submitted"] += 1
+            future = self.job_executor.submit(
+                self._run, job, journal, time.perf_counter(), remove_input)
+            self.futures[future] = (job, remove_input)
+            future.add_done_callback(self._done)
+            return dict(job)
+
+    def _done(self, future):
+        with self.lock:
+            self.futures.pop(future, None)
+
+    def _run(self, job, journal, submitted, remove_input):
+        with self._output_lock(journal["output_dir"]):
+            started = time.perf_counter()
+            with self.lock:
+                self.counts["queued"] -= 1
+                self.counts["running"] += 1
+                job["status"] = "running"
+                job["queue_seconds"] = round(started - submitted, 3)
+            try:
+                client = None
+                if journal["preflight"] and not journal["pdf_folder"]:
+                    client = self._s3_client()
+                summary = convert_journal(journal, self.cover_cache,
+                                          self.cover_executor, self.executor,
+                                          self.workers, client)
+            except Exception as error:  # pylint: disable=broad-except
+                summary = {"status": "failed",
+                           "error": type(error).__name__ + ": " + str(error),
+                           "seconds": round(time.perf_counter() - started, 3)}
+        if remove_input:
+            os.remove(journal["input_csv"])
+        latency = time.perf_counter() - submitted
+        with self.lock:
+            job.update(summary)
+            job["latency_seconds"] = round(latency, 3)
+            self.counts["running"] -= 1
+            self.counts[job["status"]] += 1
+            self.latencies.append(latency)
+            self._forget()
+            queued, running = self.counts["queued"], self.counts["running"]
+        print("%s: %s in %.3fs, %.3fs queued (%d queued, %d running)" % (
+            job["name"], job["status"], job["seconds"], job["queue_seconds"],
+            queued, running), flush=True)
+        if "error" in job:
+            print(job["error"], flush=True)
+        if self.status_file:
+            self.write_status(self.status_file)
+
+    def _forget(self):
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job["status"] not in ("queued", "running")]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def job(self, job_id):
+        """
+        Parameters:
+            job_id (str): Id of a job, as returned by submit.
+
+        Returns:
+            dict: The job's id, name, input_csv, output_dir, status
+                  ("queued", "running", then the status of
+                  convert_journal), queue_seconds once it started and, once
+                  finished, latency_seconds from submission and the
+                  convert_journal summary. None when the job is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        """
+        Returns:
+            list: Every job remembered, oldest first, see job.
+        """
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def status(self):
+        """
+        Returns:
+            dict: Jobs queued (the queue depth), running and finished by
+                  status, the latency of the recent jobs from submission to
+                  completion, and the cover cache counters.
+        """
+        with self.lock:
+            counts = dict(self.counts)
+            latencies = sorted(self.latencies)
+        status = {"uptime_seconds": round(time.perf_counter() - self.started,
+                                          3),
+                  "queue_depth": counts.get("queued", 0),
+                  "running": counts.get("running", 0),
+                  "jobs": self.concurrency,
+                  "workers": self.workers,
+                  "max_queued": self.max_queued,
+                  "counts": {name: number for name, number in counts.items()
+                             if name not in ("queued", "running")},
+                  "latency_seconds": None,
+                  "cover_cache": self.cover_cache.stats()}
+        if latencies:
+            status["latency_seconds"] = {
+                "jobs": len(latencies),
+                "mean": round(sum(latencies) / len(latencies), 3),
+                "p50": round(_percentile(latencies, 0.5), 3),
+                "p95": round(_percentile(latencies, 0.95), 3),
+                "max": round(latencies[-1], 3)}
+        return status
+
+    def write_status(self, status_file):
+        """
+        Write the status as JSON, replacing the file in one step.
+
+        Parameters:
+            status_file (str): File written.
+        """
+        temporary = "%s.%d.tmp" % (status_file, threading.get_ident())
+        with open(temporary, 'w', encoding='utf-8') as output:
+            json.dump(self.status(), output, indent=2)
+        os.replace(temporary, status_file)
+
+    def join(self):
+        """
+        Wait until every job submitted so far is finished.
+        """
+        while True:
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                return
+            for future in futures:
+                if not future.cancelled():
+                    future.result()
+
+    def close(self, cancel=False):
+        """
+        Finish the jobs and stop the pools.
+
+        Parameters:
+            cancel (bool): Drop the jobs still queued instead of converting
+                           them, the running ones are finished either way.
+        """
+        if cancel:
+            with self.lock:
+                futures = list(self.futures.items())
+            for future, (job, remove_input) in futures:
+                # Jobs already started are not cancelled.
+                if not future.cancel():
+                    continue
+                with self.lock:
+                    job["status"] = "cancelled"
+                    self.counts["queued"] -= 1
+                    self.counts["cancelled"] += 1
+                if remove_input:
+                    os.remove(job["input_csv"])
+        self.job_executor.shutdown()
+        self.cover_executor.shutdown()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+class DirectoryWatcher:
+    """
+    Polls a directory and submits each CSV in it, and each CSV changed since
+    it was submitted. A CSV is only submitted once its size and modification
+    time are the same on two polls in a row, so one still being copied in is
+    left until it is complete.
+    """
+
+    def __init__(self, service, directory, interval=2.0):
+        """
+        Parameters:
+            service (ConversionService): Service the CSVs are submitted to.
+            directory (str): Directory watched for *.csv files.
+            interval (float): Seconds between polls.
+        """
+        self.service = service
+        self.directory = directory
+        self.interval = interval
+        self.submitted = {}
+        self.previous = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def poll(self):
+        """
+        Submit the CSVs complete since the last poll.
+
+        Returns:
+            list: The jobs submitted.
+        """
+        current = {}
+        for path in find_csvs([self.directory]):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            current[path] = (info.st_size, info.st_mtime_ns)
+        jobs = []
+        for path, signature in current.items():
+            if (self.submitted.get(path) == signature
+                    or self.previous.get(path) != signature):
+                continue
+            try:
+                jobs.append(self.service.submit(path))
+            except QueueFull:
+                # Left for the next poll.
+                continue
+            self.submitted[path] = signature
+        self.previous = current
+        return jobs
+
+    def run(self):
+        """
+        Poll until stop is called.
+        """
+        while True:
+            self.poll()
+            if self.stopped.wait(self.interval):
+                return
+
+    def start(self):
+        """
+        Poll in a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop polling.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class ServiceServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server submitting the CSVs uploaded to it to a ConversionService,
+    see the module docstring for its endpoints.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, service, upload_dir):
+        """
+        Parameters:
+            address (tuple): Host and port listened on, port 0 picks a free
+                             one.
+            service (ConversionService): Service the CSVs are submitted to.
+            upload_dir (str): Directory the uploaded CSVs are kept in until
+                              they are converted.
+        """
+        os.makedirs(upload_dir, exist_ok=True)
+        self.service = service
+        self.upload_dir = upload_dir
+        super().__init__(address, ServiceHandler)
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests of a ServiceServer, answering in JSON.
+    """
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = urlsplit(self.path).path.rstrip("/")
+        service = self.server.service
+        if path == "/status":
+            self.send_json(200, service.status())
+        elif path == "/jobs":
+            self.send_json(200, service.list_jobs())
+        elif path.startswith("/jobs/"):
+            job = service.job(path[len("/jobs/"):])
+            if job is None:
+                self.send_json(404, {"error": "No such job"})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_json(411, {"error": "Content-Length is required"})
+            return
+        name = parse_qs(url.query).get("name", [None])[0]
+        if name is not None and not NAME.fullmatch(name):
+            self.send_json(400, {"error": "Invalid name: " + name})
+            return
+        upload_id = uuid.uuid4().hex
+        input_csv = os.path.join(self.server.upload_dir, upload_id + ".csv")
+        with open(input_csv, 'wb') as upload:
+            shutil.copyfileobj(_Body(self.rfile, int(length)), upload)
+        try:
+            job = self.server.service.submit(input_csv, name or upload_id,
+                                             remove_input=True)
+        except QueueFull as error:
+            os.remove(input_csv)
+            self.send_json(503, {"error": str(error)},
+                           {"Retry-After": "5"})
+            return
+        job["queue_depth"] = self.server.service.status()["queue_depth"]
+        self.send_json(202, job, {"Location": "/jobs/" + job["id"]})
+
+
+class _Body:
+    """
+    Readable file-like object over the first length bytes of a stream.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
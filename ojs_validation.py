@@ -0,0 +1,371 @@
+"""
+ Validation of the import CSV before it is converted
+
+ The whole CSV is checked up front, before any cover is downloaded or any
+ XML is written, and every problem is reported at once with the rows it was
+ found on. Checks work column by column over the parsed rows: repeated
+ values such as the publication date of an issue are checked once per
+ distinct value, and rows are only walked one by one to list the row
+ numbers of a problem that was found.
+
+ Functions:
+    validate_records: Checks the rows of a CSV and returns every problem
+    validate: Raises ValidationError when the rows have errors
+    format_rows: Compact list of row numbers, e.g. "2-5, 9"
+    format_problems: Readable report of the problems, one per line
+
+ Classes:
+    Problem: One problem, the rows it is on and whether it is an error
+    ValidationError: Raised when the CSV cannot be converted
+"""
+
+import collections
+import datetime
+import operator
+
+"""
+Columns every row is read by when it is converted.
+"""
+REQUIRED_COLUMNS = ('uploader', 'title', 'abstract', 'issueCover',
+                    'issueDatepublished', 'issueVolume', 'issueNumber',
+                    'issueYear', 'issueTitle', 'sectionTitle', 'sectionAbbrev',
+                    'pages', 'seq', 'file1')
+
+"""
+Columns that must not be left empty.
+"""
+REQUIRED_VALUES = ('issueDatepublished', 'sectionTitle', 'sectionAbbrev')
+
+"""
+Columns whose empty values are converted, with the warning given for them.
+"""
+EXPECTED_VALUES = {
+    'title': "value is empty, the article is imported without a title",
+    'file1': "value is empty, the article is imported without its PDF",
+}
+
+"""
+Issue metadata taken from the first row of each issue by
+ojs_reader.index_issues, every row of the issue has to agree with it.
+"""
+ISSUE_COLUMNS = ('issueVolume', 'issueNumber', 'issueYear',
+                 'issueDatepublished', 'issueCover')
+
+"""
+Format of issueDatepublished, as parsed by ojs_pipeline.publication_status.
+"""
+DATE_FORMAT = "%Y-%m-%d"
+
+ERROR = "error"
+WARNING = "warning"
+
+
+class Problem(collections.namedtuple("Problem",
+                                     ("rows", "column", "message",
+                                      "severity"))):
+    """
+    A problem found in the CSV.
+
+    Attributes:
+        rows (tuple): Row numbers the problem is on, the header being row 1.
+        column (str): Column the problem is in.
+        message (str): Description of the problem.
+        severity (str): ERROR when the CSV cannot be converted as it is,
+                        WARNING when it can but likely not as intended.
+    """
+
+    __slots__ = ()
+
+
+class ValidationError(Exception):
+    """
+    Raised when the CSV has errors, with every problem found in it.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(format_problems(problems))
+
+
+def _column(rows, position):
+    """
+    Returns:
+        list: The cells of one column, empty for rows too short to have it.
+    """
+    try:
+        return list(map(operator.itemgetter(position), rows))
+    except IndexError:
+        return [cells[position] if position < len(cells) else ''
+                for cells in rows]
+
+
+def _rows_where(row_numbers, values, matches):
+    if not any(match in values for match in matches):
+        # Searching the list runs in C, rows are only walked when they match.
+        return ()
+    return tuple(row for row, value in zip(row_numbers, values)
+                 if value in matches)
+
+
+def _check_dates(row_numbers, dates):
+    problems = []
+    invalid = set()
+    for value in set(dates):
+        if not value:
+            # Reported as an empty required value, None for a short row.
+            continue
+        try:
+            datetime.datetime.strptime(value, DATE_FORMAT)
+        except ValueError:
+            invalid.add(value)
+    if not invalid:
+        return problems
+    rows = collections.defaultdict(list)
+    for row, value in zip(row_numbers, dates):
+        if value in invalid:
+            rows[value].append(row)
+    for value, invalid_rows in rows.items():
+        problems.append(Problem(
+            tuple(invalid_rows), 'issueDatepublished',
+            "'%s' is not a date in ISO 8601 YYYY-MM-DD format" % value, ERROR))
+    return problems
+
+
+def _check_issues(row_numbers, titles, columns):
+    """
+    Every row of an issue must have the metadata of the issue's first row.
+    """
+    problems = []
+    if len(set(zip(titles, *columns.values()))) == len(set(titles)):
+        return problems
+    metadata = list(zip(*columns.values()))
+    first = {}
+    differing = collections.defaultdict(list)
+    for row, title, values in zip(row_numbers, titles, metadata):
+        if title not in first:
+            first[title] = (row, values)
+        elif values != first[title][1]:
+            differing[title].append((row, values))
+    for title, rows in differing.items():
+        first_row, first_values = first[title]
+        for position, name in enumerate(columns):
+            by_value = collections.defaultdict(list)
+            for row, values in rows:
+                if values[position] != first_values[position]:
+                    by_value[values[position]].append(row)
+            for value, value_rows in by_value.items():
+                message = "'%s' differs from '%s' on row %d, the first row " \
+                          "of issue '%s'" % (value, first_values[position],
+                                             first_row, title)
+                if title == '':
+                    message += "; rows with an empty issueTitle are " \
+                               "converted as one issue"
+                problems.append(Problem(tuple(value_rows), name, message,
+                                        ERROR))
+    return problems
+
+
+def _check_sequences(row_numbers, titles, abbrevs, sequences):
+    """
+    Articles of a section of an issue each need their own seq.
+    """
+    problems = []
+    counts = collections.Counter(zip(titles, abbrevs, sequences))
+    duplicates = {key for key, number in counts.items()
+                  if number > 1 and key[2]}
+    if not duplicates:
+        return problems
+    rows = collections.defaultdict(list)
+    for row, key in zip(row_numbers, zip(titles, abbrevs, sequences)):
+        if key in duplicates:
+            rows[key].append(row)
+    for (title, abbrev, sequence), duplicate_rows in rows.items():
+        problems.append(Problem(
+            tuple(duplicate_rows), 'seq',
+            "seq '%s' is used more than once in section '%s' of issue '%s'"
+            % (sequence, abbrev, title), ERROR))
+    return problems
+
+
+def _check_sections(row_numbers, abbrevs, section_titles):
+    """
+    A section has one title throughout the CSV, OJS matches the articles to
+    their section by its abbreviation. A title with several abbreviations is
+    a warning.
+    """
+    problems = []
+    # Empty cells are reported as empty values, not as another section.
+    pairs = {(abbrev, title) for abbrev, title in set(zip(abbrevs,
+                                                          section_titles))
+             if abbrev and title}
+    titles_of = collections.defaultdict(list)
+    abbrevs_of = collections.defaultdict(list)
+    for abbrev, title in sorted(pairs):
+        titles_of[abbrev].append(title)
+        abbrevs_of[title].append(abbrev)
+    # Sections with the same title and different abbreviations are imported
+    # as separate sections, which is allowed but likely a typo.
+    conflicts = {(abbrev, title) for abbrev, titles in titles_of.items()
+                 if len(titles) > 1 for title in titles}
+    conflicts.update((abbrev, title) for title, abbrevs in abbrevs_of.items()
+                     if len(abbrevs) > 1 for abbrev in abbrevs)
+    if not conflicts:
+        return problems
+    rows = collections.defaultdict(list)
+    for row, pair in zip(row_numbers, zip(abbrevs, section_titles)):
+        if pair in conflicts:
+            rows[pair].append(row)
+    for abbrev, titles in titles_of.items():
+        if len(titles) > 1:
+            problems.append(Problem(
+                tuple(sorted(row for title in titles
+                             for row in rows[(abbrev, title)])),
+                'sectionAbbrev',
+                "'%s' is the abbreviation of sections titled %s" % (
+                    abbrev, ", ".join("'%s'" % title for title in titles)),
+                ERROR))
+    for title, abbrevs in abbrevs_of.items():
+        if len(abbrevs) > 1:
+            problems.append(Problem(
+                tuple(sorted(row for abbrev in abbrevs
+                             for row in rows[(abbrev, title)])),
+                'sectionAbbrev',
+                "section '%s' is abbreviated %s, they are imported as "
+                "separate sections" % (
+                    title, ", ".join("'%s'" % abbrev for abbrev in abbrevs)),
+                WARNING))
+    return problems
+
+
+def _cell(record, name):
+    position = record.columns.index[name]
+    return record.cells[position] if position < len(record.cells) else ''
+
+
+def validate_records(records):
+    """
+    Check every row of a CSV.
+
+    Parameters:
+    records (list): ArticleRecord rows of one CSV, see
+                    ojs_reader.read_records
+
+    Returns:
+    list: Every Problem found, in the order of the first row they are on
+    """
+    if not records:
+        return [Problem((1,), 'header', "there are no rows to convert, the "
+                        "CSV is empty or only has a header", ERROR)]
+    row_numbers = [record.row for record in records]
+    # Rows of a CSV share their Columns, rows from other sources can each
+    # have their own.
+    layouts = collections.OrderedDict()
+    for record in records:
+        layouts.setdefault(id(record.columns), (record.columns, []))[1].append(
+            record.row)
+    problems = []
+    for layout, layout_rows in layouts.values():
+        rows = (1,) if len(layouts) == 1 else tuple(layout_rows)
+        problems += [Problem(rows, name, "required column is missing", ERROR)
+                     for name in REQUIRED_COLUMNS
+                     if name not in layout.index]
+    # Only the columns that are checked are taken out of the rows, the ones
+    # missing from some rows are reported as missing and not checked.
+    checked = set(REQUIRED_VALUES + tuple(EXPECTED_VALUES) + ISSUE_COLUMNS
+                  + ('issueTitle', 'seq'))
+    names = [name for name in REQUIRED_COLUMNS if name in checked
+             and all(name in layout.index for layout, _ in layouts.values())]
+    if len(layouts) == 1:
+        index = records[0].columns.index
+        rows = [record.cells for record in records]
+        columns = {name: _column(rows, index[name]) for name in names}
+    else:
+        columns = {name: [_cell(record, name) for record in records]
+                   for name in names}
+
+    for name in REQUIRED_VALUES:
+        if name in columns:
+            empty = _rows_where(row_numbers, columns[name], {'', None})
+            if empty:
+                problems.append(Problem(empty, name, "value is empty", ERROR))
+    for name, message in EXPECTED_VALUES.items():
+        if name in columns:
+            empty = _rows_where(row_numbers, columns[name], {'', None})
+            if empty:
+                problems.append(Problem(empty, name, message, WARNING))
+    if 'issueTitle' in columns:
+        untitled = _rows_where(row_numbers, columns['issueTitle'],
+                               {'', None})
+        if untitled:
+            problems.append(Problem(
+                untitled, 'issueTitle',
+                "value is empty, these rows are converted as one issue",
+                WARNING))
+
+    if 'issueDatepublished' in columns:
+        problems += _check_dates(row_numbers, columns['issueDatepublished'])
+    if 'issueTitle' in columns:
+        problems += _check_issues(
+            row_numbers, columns['issueTitle'],
+            {name: columns[name] for name in ISSUE_COLUMNS if name in columns})
+    if all(name in columns for name in ('issueTitle', 'sectionAbbrev', 'seq')):
+        problems += _check_sequences(row_numbers, columns['issueTitle'],
+                                     columns['sectionAbbrev'], columns['seq'])
+    if 'sectionAbbrev' in columns and 'sectionTitle' in columns:
+        problems += _check_sections(row_numbers, columns['sectionAbbrev'],
+                                    columns['sectionTitle'])
+    problems.sort(key=lambda problem: problem.rows[0])
+    return problems
+
+
+def validate(records):
+    """
+    Parameters:
+    records (list): ArticleRecord rows of one CSV
+
+    Returns:
+    list: The warnings found, when there are no errors
+
+    Raises:
+    ValidationError: When any row has an error, listing every problem
+    """
+    problems = validate_records(records)
+    if any(problem.severity == ERROR for problem in problems):
+        raise ValidationError(problems)
+    return problems
+
+
+def format_rows(rows):
+    """
+    Parameters:
+    rows (iterable): Row numbers in ascending order
+
+    Returns:
+    str: The rows with runs of consecutive rows shortened, e.g. "2-5, 9"
+    """
+    ranges = []
+    for row in rows:
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return ", ".join(str(first) if first == last else "%d-%d" % (first, last)
+                     for first, last in ranges)
+
+
+def format_problems(problems):
+    """
+    Parameters:
+    problems (list): Problem tuples, see validate_records
+
+    Returns:
+    str: One line per problem, with its severity, column and rows
+    """
+    errors = sum(problem.severity == ERROR for problem in problems)
+    lines = ["%d error(s), %d warning(s) in the CSV:"
+             % (errors, len(problems) - errors)]
+    for problem in problems:
+        lines.append("%s: %s: %s (row%s %s)" % (
+            problem.severity, problem.column, problem.message,
+            "s" if len(problem.rows) > 1 else "", format_rows(problem.rows)))
+    return "\n".join(lines)
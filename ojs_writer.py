@@ -0,0 +1,258 @@
+"""
+ Streaming OJS Import XML writer
+
+ Writes the OJS native import document straight to a file handle instead of
+ building the whole tree in memory, serializing it with ElementTree and
+ re-parsing it with minidom to pretty-print it. The output is byte-compatible
+ with xml.dom.minidom's toprettyxml() so existing conversions do not change.
+
+ Classes:
+    XMLStreamWriter: TreeBuilder-like writer that emits indented XML as it
+                     goes, only buffering the text of the element currently
+                     open
+    EmbeddedFile: Element text standing for a file on disk, written as
+                  base64 in chunks when the element is written
+"""
+
+import base64
+import mmap
+import os
+
+PKP_NAMESPACE = "http://pkp.sfu.ca"
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+SCHEMA_LOCATION = PKP_NAMESPACE + " native.xsd"
+XML_DECLARATION = "<?xml version=\"1.0\" ?>"
+
+
+def escape(text):
+    """
+    Parameters:
+        text (str): Text or attribute value to escape.
+
+    Returns:
+        str: Text escaped the same way minidom escapes character data.
+    """
+    return (text.replace("&", "&amp;").replace("<", "&lt;")
+            .replace("\"", "&quot;").replace(">", "&gt;"))
+
+
+class EmbeddedFile:
+    """
+    Placeholder for the base64 encoding of a file, used as the text of an
+    ElementTree Element (e.g. the <embed> element of an article revision).
+
+    The file is memory-mapped and encoded in chunks straight into the output
+    when the element is written, so neither the file nor its encoding is
+    ever held in memory as a whole.
+    """
+
+    # Multiple of 3 so each chunk encodes without padding, and of the page
+    # size so pages already written can be released from the mapping.
+    CHUNK_SIZE = 3 * 256 * 1024
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): Path of the file to embed.
+        """
+        self.path = path
+
+    def __repr__(self):
+        return "EmbeddedFile(%r)" % self.path
+
+    @property
+    def size(self):
+        """
+        int: Size of the file in bytes.
+        """
+        return os.path.getsize(self.path)
+
+    @property
+    def encoded_size(self):
+        """
+        int: Number of characters the base64 encoding of the file takes.
+        """
+        return -(-self.size // 3) * 4
+
+    def write_to(self, output):
+        """
+        Parameters:
+            output (file): Text file handle to write the base64 encoding to.
+        """
+        with open(self.path, "rb") as source:
+            if os.fstat(source.fileno()).st_size == 0:
+                return
+            with mmap.mmap(source.fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapped:
+                release = hasattr(mmap, "MADV_DONTNEED")
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for offset in range(0, len(mapped), self.CHUNK_SIZE):
+                    chunk = mapped[offset:offset + self.CHUNK_SIZE]
+                    output.write(str(base64.b64encode(chunk), "ascii"))
+                    # Drop the pages just encoded so resident memory stays
+                    # flat however large the file is.
+                    if release:
+                        mapped.madvise(mmap.MADV_DONTNEED, offset, len(chunk))
+
+
+class XMLStreamWriter:
+    """
+    Write an XML document to a file handle one element at a time.
+
+    The writer mirrors the ElementTree.TreeBuilder start/data/end interface so
+    builder code reads the same, but nothing is kept once an element is closed.
+    Layout follows minidom's toprettyxml(): an element holding only text is
+    written on one line, an element holding children gets one child per line
+    indented by a tab, and an empty element is self-closed.
+    """
+
+    def __init__(self, output, indent="\t", newline="\n"):
+        """
+        Parameters:
+            output (file): Text file handle (anything with a write method).
+            indent (str): Indentation added for each level of nesting.
+            newline (str): Line terminator written after each element.
+        """
+        self.output = output
+        self.indent = indent
+        self.newline = newline
+        # One entry per open element: [tag, has_children, pending_text]
+        self._stack = []
+
+    @property
+    def depth(self):
+        """
+        int: Number of elements currently open.
+        """
+        return len(self._stack)
+
+    def _prefix(self):
+        return self.indent * len(self._stack)
+
+    def _write_text(self, parts, indent="", newline=""):
+        """
+        Write collected character data, streaming any EmbeddedFile parts.
+        """
+        self.output.write(escape(indent))
+        for part in parts:
+            if isinstance(part, EmbeddedFile):
+                part.write_to(self.output)
+            else:
+                self.output.write(escape(part))
+        self.output.write(newline)
+
+    def _open_parent(self):
+        """
+        Finish the start tag of the enclosing element before a child element
+        is written. Text already collected for the parent is written on its
+        own line, as minidom does for mixed content.
+        """
+        if not self._stack:
+            return
+        parent = self._stack[-1]
+        if not parent[1]:
+            self.output.write(">" + self.newline)
+            parent[1] = True
+        if parent[2]:
+            self._write_text(parent[2], self._prefix(), self.newline)
+            parent[2] = []
+
+    def start_document(self):
+        """
+        Write the XML declaration and the opening <issues> element carrying
+        the PKP namespace and schema location.
+        """
+        self.output.write(XML_DECLARATION + self.newline)
+        self.start("issues", {
+            "xmlns": PKP_NAMESPACE,
+            "xmlns:xsi": XSI_NAMESPACE,
+            "xsi:schemaLocation": SCHEMA_LOCATION
+        })
+
+    def end_document(self):
+        """
+        Close the <issues> element opened by start_document.
+        """
+        self.end("issues")
+
+    def start(self, tag, attrib):
+        """
+        Parameters:
+            tag (str): Element name.
+            attrib (dict): Element attributes, written in insertion order.
+        """
+        self._open_parent()
+        self.output.write(self._prefix() + "<" + tag)
+        for name, value in attrib.items():
+            self.output.write(" " + name + "=\"" + escape(value) + "\"")
+        self._stack.append([tag, False, []])
+
+    def data(self, text):
+        """
+        Parameters:
+            text (str): Character data for the element currently open, or an
+                        EmbeddedFile to stream as base64.
+        """
+        if isinstance(text, EmbeddedFile):
+            self._stack[-1][2].append(text)
+        elif text:
+            # The expat round-trip done by minidom normalizes line endings
+            # in character data, so do the same here.
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            self._stack[-1][2].append(text)
+
+    def end(self, tag):
+        """
+        Parameters:
+            tag (str): Element name, must match the element currently open.
+        """
+        open_tag, has_children, pending_text = self._stack.pop()
+        if open_tag != tag:
+            raise ValueError("end tag mismatch (expected %s, got %s)"
+                             % (open_tag, tag))
+        if has_children:
+            if pending_text:
+                self._write_text(pending_text, self._prefix() + self.indent,
+                                 self.newline)
+            self.output.write(self._prefix() + "</" + tag + ">" + self.newline)
+        elif pending_text:
+            self.output.write(">")
+            self._write_text(pending_text)
+            self.output.write("</" + tag + ">" + self.newline)
+        else:
+            self.output.write("/>" + self.newline)
+
+    def raw(self, parts):
+        """
+        Write markup of complete elements, already indented for the current
+        nesting level, such as the output of a compiled ojs_schema.Element.
+
+        Parameters:
+            parts (list): Markup strings, and EmbeddedFiles streamed as base64.
+        """
+        self._open_parent()
+        pending = []
+        for part in parts:
+            if isinstance(part, EmbeddedFile):
+                self.output.write("".join(pending))
+                pending = []
+                part.write_to(self.output)
+            else:
+                pending.append(part)
+        self.output.write("".join(pending))
+
+    def element(self, elem):
+        """
+        Write a complete ElementTree Element, such as the ones returned by
+        the ojs_builder functions, at the current nesting level.
+
+        Parameters:
+            elem (Element): XML Element Object to write.
+        """
+        self.start(elem.tag, elem.attrib)
+        self.data(elem.text)
+        for child in elem:
+            self.element(child)
+            self.data(child.tail)
+        self.end(elem.tag)
@@ -0,0 +1,438 @@
+"""
+ Schema validation of the conversion files
+
+ Each conversion file is checked against the PKP native.xsd named in its
+ xsi:schemaLocation, so an invalid file is found when it is written rather
+ than when OJS rejects it partway through an import. The schema is the one
+ of the OJS native import/export plugin and the pkp-native.xsd it includes,
+ used unchanged. They are not shipped with the converter: download them
+ into schemas/ from SCHEMA_SOURCES. Files are parsed incrementally and
+ checked one article at a time, each article being dropped once the next
+ one starts and each issue once the next issue starts. Memory use is
+ bounded by the largest article, embedded PDF included, plus the metadata
+ and cover of its issue, rather than by the file. Local files are checked
+ in parallel, one process per file.
+
+ Checking needs the lxml package and the schemas.
+
+ Functions:
+    load_schema: Parses an XSD file, once per process
+    validate_file: Checks one conversion file
+    validate_files: Checks conversion files in parallel
+    format_violation: One line describing a violation
+    format_violations: Readable report of the violations found
+
+ Classes:
+    Violation: One schema violation, where it is and what is wrong
+    StreamValidator: Checks a conversion file fed to it in chunks
+    ValidatingWriter: Text file-like object checking what is written
+                      through it to another
+    SchemaViolations: Raised when conversion files do not match the schema
+"""
+
+import collections
+import functools
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from ojs_compression import open_compressed
+from ojs_writer import PKP_NAMESPACE
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "schemas")
+SCHEMA_FILE = os.path.join(SCHEMA_DIR, "native.xsd")
+
+"""
+Where the schemas are downloaded from into SCHEMA_DIR, for OJS 3.1 and 3.2
+whose submission files carry revisions. native.xsd includes pkp-native.xsd by its path in an
+OJS installation, it is read from beside native.xsd instead.
+"""
+SCHEMA_SOURCES = {
+    "native.xsd": "https://github.com/pkp/ojs/raw/stable-3_2_1/"
+                  "plugins/importexport/native/native.xsd",
+    "pkp-native.xsd": "https://github.com/pkp/pkp-lib/raw/stable-3_2_1/"
+                      "plugins/importexport/native/pkp-native.xsd",
+}
+
+# Bytes read from a file at a time.
+CHUNK_SIZE = 1024 * 1024
+
+"""
+Paths of the elements checked on their own, an issue once its articles
+have been checked and the document once its issues have.
+"""
+ISSUES_PATH = ("issues",)
+ISSUE_PATH = ("issues", "issue")
+ARTICLE_PATH = ("issues", "issue", "articles", "article")
+
+
+class Violation(collections.namedtuple(
+        "Violation", ("file", "path", "file_number", "line", "message"))):
+    """
+    A schema violation.
+
+    Attributes:
+        file (str): Name of the conversion file.
+        path (str): Path of the offending element, e.g.
+                    /issues/issue[2]/articles/article[5]/publication/pages
+        file_number (str): file_number of the article the element is in,
+                           None outside articles.
+        line (int): Line of the element in the file.
+        message (str): What is wrong, as reported by libxml2.
+    """
+
+    __slots__ = ()
+
+
+class SchemaViolations(Exception):
+    """
+    Conversion files do not match the schema.
+    """
+
+    def __init__(self, violations):
+        """
+        Parameters:
+            violations (list): Every Violation found.
+        """
+        super().__init__(format_violations(violations))
+        self.violations = violations
+
+
+class _BesideSchema(etree.Resolver if etree is not None else object):
+    """
+    Reads the files an XSD includes from its own directory when they are not
+    where it says, as pkp-native.xsd is not for native.xsd.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def resolve(self, url, pubid, context):
+        path = os.path.join(self.directory, os.path.basename(url))
+        if not os.path.exists(url) and os.path.exists(path):
+            return self.resolve_filename(path, context)
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema(schema_file=SCHEMA_FILE):
+    """
+    Parameters:
+    schema_file (str): Path of the XSD file
+
+    Returns:
+    XMLSchema: The parsed schema
+
+    Raises:
+    ValueError: When lxml is not installed, or the schema is missing
+    """
+    if etree is None:
+        raise ValueError("Checking the conversion files against the schema "
+                         "needs the lxml package")
+    directory = os.path.dirname(schema_file)
+    if schema_file == SCHEMA_FILE:
+        missing = [name for name in SCHEMA_SOURCES
+                   if not os.path.exists(os.path.join(directory, name))]
+        if missing:
+            raise ValueError("Checking the conversion files needs the PKP "
+                             "schemas in " + directory + ", download "
+                             + ", ".join(SCHEMA_SOURCES[name]
+                                         for name in missing))
+    parser = etree.XMLParser()
+    parser.resolvers.add(_BesideSchema(directory))
+    return etree.XMLSchema(etree.parse(schema_file, parser))
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+class StreamValidator:
+    """
+    Check a conversion file fed to it in chunks.
+
+    Each article is checked as soon as it has been parsed, in place: the
+    document parsed so far, its issue and the issue's elements before the
+    article included, is checked against the whole schema and only the
+    violations within the article are reported, so the issue's metadata and
+    cover are checked again with each article. The article is removed from
+    the tree once the next one starts, and the issue once the next issue
+    does. Each issue is checked the same way
+    once its articles are, still holding its last one, and the <issues>
+    document element at the end, still holding the last issue, so a schema
+    requiring an issue to have articles is met.
+    """
+
+    def __init__(self, name, schema_file=SCHEMA_FILE):
+        """
+        Parameters:
+            name (str): File name the violations are reported under.
+            schema_file (str): Path of the XSD file.
+        """
+        self.name = name
+        self.schema = load_schema(schema_file)
+        # Embedded PDFs are text nodes larger than libxml2 allows by default.
+        self.parser = etree.XMLPullParser(events=("start", "end"),
+                                          huge_tree=True)
+        # Local names of the open elements, the path shown for each with
+        # the position of issues and articles, and the number of children
+        # of each open element seen so far by name.
+        self.tags = []
+        self.path = []
+        self.children = [collections.Counter()]
+        # Position of each issue and article in the tree, e.g. article[5],
+        # and the one checked last in each element, removed once the next
+        # one starts.
+        self.labels = {}
+        self.checked = {}
+        self.violations = []
+        self.failed = False
+
+    def feed(self, data):
+        """
+        Parameters:
+            data (str): The next chunk of the file, text or bytes.
+        """
+        if self.failed:
+            return
+        try:
+            self.parser.feed(data)
+        except etree.XMLSyntaxError as error:
+            self._syntax_error(error)
+            return
+        self._read_events()
+
+    def close(self):
+        """
+        Returns:
+            list: Every Violation found in the file.
+        """
+        if not self.failed:
+            try:
+                self.parser.close()
+            except etree.XMLSyntaxError as error:
+                self._syntax_error(error)
+            else:
+                self._read_events()
+        return self.violations
+
+    def _syntax_error(self, error):
+        # The file cannot be parsed past a syntax error.
+        self.failed = True
+        self.violations.append(Violation(
+            self.name, "/" + "/".join(self.path), None, error.lineno,
+            error.msg))
+
+    def _read_events(self):
+        for event, element in self.parser.read_events():
+            tag = _local_name(element.tag)
+            if event == "start":
+                self.children[-1][tag] += 1
+                self.tags.append(tag)
+                if tuple(self.tags) in (ARTICLE_PATH, ISSUE_PATH):
+                    self._remove(self.checked.pop(element.getparent(), None))
+                    tag += "[%d]" % self.children[-1][tag]
+                    self.labels[element] = tag
+                self.path.append(tag)
+                self.children.append(collections.Counter())
+                continue
+            if tuple(self.tags) in (ARTICLE_PATH, ISSUE_PATH, ISSUES_PATH):
+                self._check(element)
+                parent = element.getparent()
+                if parent is not None:
+                    self.checked[parent] = element
+            self.tags.pop()
+            self.path.pop()
+            self.children.pop()
+
+    def _remove(self, element):
+        if element is None:
+            return
+        for node in element.iter():
+            self.labels.pop(node, None)
+            self.checked.pop(node, None)
+        element.getparent().remove(element)
+
+    def _check(self, element):
+        if self.schema.validate(element.getroottree()):
+            return
+        file_number = None
+        if tuple(self.tags) == ARTICLE_PATH:
+            file_number = element.findtext("{%s}id" % PKP_NAMESPACE)
+        root = element.getroottree().getroot()
+        for error in self.schema.error_log:
+            node, path = self._locate(root, error.path)
+            # Violations in the elements checked before, or in the ones
+            # holding this one, are reported when those are checked.
+            if node is not None and self._checked_with(node) is not element:
+                continue
+            self.violations.append(Violation(
+                self.name, path, file_number, error.line,
+                error.message.replace("{%s}" % PKP_NAMESPACE, "")))
+
+    def _checked_with(self, node):
+        """
+        Returns:
+            Element: The issue, article or document element whose check
+                     reports the violations of a node.
+        """
+        while node is not None:
+            if node in self.labels or node.getparent() is None:
+                return node
+            node = node.getparent()
+        return None
+
+    def _locate(self, root, error_path):
+        """
+        Find the element of the positional path libxml2 reports, e.g.
+        /*/*[3]/*, and turn the path into element names.
+
+        Returns:
+            tuple: The element, None when the path does not lead to one, and
+                   its path.
+        """
+        names = [_local_name(root.tag)]
+        node = root
+        for step in (error_path or "").split("/")[2:]:
+            match = re.match(r"\*(?:\[(\d+)\])?$", step)
+            children = [child for child in node
+                        if isinstance(child.tag, str)]
+            if match is None or len(children) < int(match.group(1) or 1):
+                names.append(step)
+                node = None
+                break
+            node = children[int(match.group(1) or 1) - 1]
+            name = self.labels.get(node, _local_name(node.tag))
+            siblings = [child for child in children if child.tag == node.tag]
+            if node not in self.labels and len(siblings) > 1:
+                name += "[%d]" % (siblings.index(node) + 1)
+            names.append(name)
+        if error_path is None:
+            node = None
+        return node, "/" + "/".join(names)
+
+
+class ValidatingWriter:
+    """
+    Pass text written to it on to an output, checking it with a
+    StreamValidator on the way, e.g. around an ojs_s3.S3UploadStream.
+    """
+
+    def __init__(self, output, validator):
+        """
+        Parameters:
+            output: Text file-like object the conversion file is written to.
+            validator (StreamValidator): Checks the text written.
+        """
+        self.output = output
+        self.validator = validator
+
+    def __enter__(self):
+        self.output.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.output.__exit__(*exc_info)
+
+    def write(self, text):
+        """
+        Parameters:
+            text (str): Text of the conversion file.
+        """
+        self.validator.feed(text)
+        return self.output.write(text)
+
+    def close(self):
+        """
+        Close the output.
+        """
+        self.output.close()
+
+
+def validate_file(path, schema_file=SCHEMA_FILE):
+    """
+    Parameters:
+    path (str): Path of a conversion file, compressed when it ends in .gz or
+    .zst
+    schema_file (str): Path of the XSD file
+
+    Returns:
+    list: Every Violation found in the file
+    """
+    validator = StreamValidator(os.path.basename(path), schema_file)
+    with open_compressed(path) as conversion:
+        while True:
+            chunk = conversion.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            validator.feed(chunk)
+    return validator.close()
+
+
+def validate_files(paths, workers=None, executor=None,
+                   schema_file=SCHEMA_FILE):
+    """
+    Check conversion files against the schema, in parallel.
+
+    Parameters:
+    paths (list): Paths of the conversion files
+    workers (int): Worker processes, one per CPU when None, 1 checks the
+    files in this process
+    executor (ProcessPoolExecutor): Worker processes shared with other
+    work, e.g. the rendering workers, used instead of making new ones
+    schema_file (str): Path of the XSD file
+
+    Returns:
+    list: Every Violation found, file by file in the order given
+    """
+    load_schema(schema_file)
+    if executor is None and (workers == 1 or len(paths) < 2):
+        results = [validate_file(path, schema_file) for path in paths]
+    elif executor is not None:
+        results = executor.map(validate_file, paths,
+                               [schema_file] * len(paths))
+    else:
+        # Spawned rather than forked, like write_batches does.
+        with ProcessPoolExecutor(
+                max_workers=min(workers or os.cpu_count(), len(paths)),
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(validate_file, paths,
+                                    [schema_file] * len(paths)))
+    return [violation for violations in results for violation in violations]
+
+
+def format_violation(violation):
+    """
+    Parameters:
+    violation (Violation): A schema violation
+
+    Returns:
+    str: File, line, element path and article of the violation, and what
+    is wrong
+    """
+    where = "%s line %s: %s" % (violation.file, violation.line,
+                                violation.path)
+    if violation.file_number is not None:
+        where += " (file_number %s)" % violation.file_number
+    return where + ": " + violation.message
+
+
+def format_violations(violations):
+    """
+    Parameters:
+    violations (list): Violation tuples
+
+    Returns:
+    str: A heading with the number of violations followed by one line each
+    """
+    return "\n".join(["%d schema violation(s) in the conversion files:"
+                      % len(violations)]
+                     + [format_violation(violation)
+                        for violation in violations])
@@ -0,0 +1,133 @@
+"""
+ Converts import CSVs as they arrive, as a long-running service
+
+ CSVs written to the watched directories, or uploaded to the local HTTP
+ endpoint, are queued and converted like convert_journals.py converts a
+ journal, each into OUTPUT/<csv name>/. The worker processes, cover
+ downloads and cache, connection pools and S3 client are started once and
+ kept warm, so a conversion does not pay for them. See ojs_service for the
+ HTTP endpoint.
+
+ Usage:
+    python serve_journals.py [--watch incoming/] [--port 8080]
+                             [--host 127.0.0.1] [--output converted]
+                             [--config journals.json] [--jobs 2]
+                             [--workers N] [--max-queued N] [--interval 2]
+                             [--bucket mybucket] [--incremental] [...]
+
+    curl --data-binary @atos.csv 'http://127.0.0.1:8080/jobs?name=atos'
+    curl http://127.0.0.1:8080/status
+
+ Every journal setting of convert_journals.py can be given on the command
+ line, or under "defaults" in the JSON config file. A watched CSV changed
+ after it was converted is converted again, only its changed issues with
+ --incremental. The status, with the queue depth and job latencies, is
+ written to OUTPUT/service_status.json as each job finishes. Stop the
+ service with Ctrl-C or SIGTERM: the running jobs are finished and the
+ queued ones dropped.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from convert_journals import add_journal_options, journal_overrides
+from ojs_service import ConversionService, DirectoryWatcher, ServiceServer
+
+
+def _interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    """
+    Parameters:
+    argv (list): Command-line arguments, sys.argv when None
+
+    Returns:
+    int: Exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert OJS import CSVs as they arrive.")
+    parser.add_argument("--watch", action="append", default=[],
+                        help="directory whose CSVs are converted, may be "
+                             "given more than once")
+    parser.add_argument("--port", type=int,
+                        help="port of the HTTP endpoint CSVs are uploaded to")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address the HTTP endpoint listens on")
+    parser.add_argument("--config",
+                        help="JSON file whose \"defaults\" are the journal "
+                             "settings")
+    parser.add_argument("--output", default="converted",
+                        help="directory the jobs' output directories are "
+                             "made in")
+    parser.add_argument("--jobs", type=int, default=2,
+                        help="CSVs converted at the same time")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes rendering output files, shared by "
+                             "the jobs")
+    parser.add_argument("--cover-downloads", type=int, default=8,
+                        help="covers downloaded at the same time, shared by "
+                             "the jobs")
+    parser.add_argument("--cover-cache-max-age", type=int,
+                        help="seconds a cached cover is used before checking "
+                             "it has not changed, forever by default")
+    parser.add_argument("--max-queued", type=int,
+                        help="jobs waiting at most, further uploads are "
+                             "answered 503")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between looks at the watched "
+                             "directories")
+    add_journal_options(parser)
+    args = parser.parse_args(argv)
+    if not args.watch and args.port is None:
+        parser.error("give --watch or --port")
+
+    settings = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as config_file:
+            settings.update(json.load(config_file).get("defaults", {}))
+    settings.update(journal_overrides(args))
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        service = ConversionService(
+            settings, args.output, args.jobs, args.workers,
+            args.cover_downloads, args.max_queued,
+            os.path.join(args.output, "service_status.json"),
+            cover_cache_max_age=args.cover_cache_max_age)
+    except ValueError as error:
+        parser.error(str(error))
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    watchers = [DirectoryWatcher(service, directory, args.interval)
+                for directory in args.watch]
+    server = None
+    try:
+        for watcher in watchers:
+            watcher.start()
+            print("Watching " + watcher.directory, flush=True)
+        if args.port is not None:
+            server = ServiceServer((args.host, args.port), service,
+                                   os.path.join(args.output, ".uploads"))
+            print("Listening on http://%s:%d" % server.server_address[:2],
+                  flush=True)
+            server.serve_forever()
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+        if server is not None:
+            server.server_close()
+        service.close(cancel=True)
+    print(json.dumps(service.status()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
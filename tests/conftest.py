@@ -0,0 +1,213 @@
+"""
+ Shared fixtures of the tests
+
+ The tests run against local stand-ins for S3 and the cover bucket: FakeS3
+ keeps objects in a dictionary behind the boto3 client calls the converter
+ makes, and FakePool answers urllib3 requests from a dictionary of files.
+"""
+
+import hashlib
+import io
+import os
+import sys
+import threading
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ojs_validation import REQUIRED_COLUMNS
+
+
+def _not_found(operation):
+    return ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}},
+                       operation)
+
+
+class FakeS3:
+    """
+    Buckets of a boto3 S3 client kept in memory, with S3's ETags.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def count(self, name):
+        return self.calls.count(name)
+
+    def put_object(self, Bucket, Key, Body, **metadata):
+        self._record('put_object')
+        self.objects[(Bucket, Key)] = {
+            'Body': bytes(Body), 'ETag': '"%s"' % hashlib.md5(Body).hexdigest(),
+            **metadata}
+
+    def create_multipart_upload(self, Bucket, Key, **metadata):
+        self._record('create_multipart_upload')
+        upload_id = str(len(self.uploads) + 1)
+        self.uploads[upload_id] = {'parts': {}, 'metadata': metadata}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record('upload_part')
+        etag = '"%s"' % hashlib.md5(Body).hexdigest()
+        with self.lock:
+            self.uploads[UploadId]['parts'][PartNumber] = (bytes(Body), etag)
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        self._record('complete_multipart_upload')
+        upload = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(upload['parts'])
+        parts = [upload['parts'][number][0] for number in numbers]
+        etag = hashlib.md5(b''.join(hashlib.md5(part).digest()
+                                    for part in parts)).hexdigest()
+        self.objects[(Bucket, Key)] = {
+            'Body': b''.join(parts), 'ETag': '"%s-%d"' % (etag, len(parts)),
+            **upload['metadata']}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record('abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+
+    def head_object(self, Bucket, Key):
+        self._record('head_object')
+        stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise _not_found('HeadObject')
+        head = {name: value for name, value in stored.items()
+                if name != 'Body'}
+        head['ContentLength'] = len(stored['Body'])
+        return head
+
+    def get_object(self, Bucket, Key):
+        self._record('get_object')
+        stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise _not_found('GetObject')
+        return {'Body': io.BytesIO(stored['Body']), 'ETag': stored['ETag']}
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        self._record('put_object_tagging')
+        self.objects[(Bucket, Key)]['Tagging'] = Tagging
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return _Paginator(self)
+
+
+class _Paginator:
+    def __init__(self, client, page_size=1000):
+        self.client = client
+        self.page_size = page_size
+
+    def paginate(self, Bucket, Prefix='', StartAfter=''):
+        keys = sorted(key for bucket, key in self.client.objects
+                      if bucket == Bucket and key.startswith(Prefix)
+                      and key > StartAfter)
+        for start in range(0, len(keys), self.page_size):
+            self.client._record('list_objects_v2')
+            page = keys[start:start + self.page_size]
+            yield {'KeyCount': len(page), 'Contents': [
+                {'Key': key,
+                 'Size': len(self.client.objects[(Bucket, key)]['Body']),
+                 'ETag': self.client.objects[(Bucket, key)]['ETag']}
+                for key in page]}
+
+
+class FakeResponse:
+    def __init__(self, status, data=b'', headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+
+class FakePool:
+    """
+    urllib3.PoolManager answering GET and HEAD requests from files keyed by
+    URL, with an ETag for each.
+    """
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers=None, **_):
+        with self.lock:
+            self.requests.append((method, url))
+        data = self.files.get(url)
+        if data is None:
+            return FakeResponse(404)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        response_headers = {'Content-Length': str(len(data)), 'ETag': etag}
+        if method == 'HEAD':
+            return FakeResponse(200, headers=response_headers)
+        return FakeResponse(200, data, response_headers)
+
+    def count(self, method):
+        return sum(1 for request in self.requests if request[0] == method)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def pool():
+    return FakePool()
+
+
+def article_cells(**values):
+    """
+    Cells of an article with four authors, the third and fifth left out
+    for their empty given names.
+    """
+    children = {'file_number': '7', 'submission_stage': 'submission',
+                'revision_number': '1', 'fileGenre1': 'Article Text',
+                'file1': 'vol17_no10.pdf', 'uploader': 'admin',
+                'bucket_location': 'https://bucket.example/pdf/',
+                'issueDatepublished': '1975-10-01', 'seq': '3',
+                'sectionAbbrev': 'ART', 'title': 'Organ & Console',
+                'abstract': '', 'pages': '12-14'}
+    authors = [('Ada', 'Lovelace', 'ATOS', 'ada@example.org'),
+               ('Bob', 'Organist', '', ''),
+               ('', 'Nobody', '', ''),
+               ('Cy', 'Pipes', 'Wurlitzer', ''),
+               ('', '', '', '')]
+    for number, author in enumerate(authors, 1):
+        for name, value in zip(('authorGivenname', 'authorFamilyname',
+                                'authorAffiliation', 'authorEmail'), author):
+            children[name + str(number)] = value
+    children.update(values)
+    return children
+
+
+def csv_lines(*issues):
+    """
+    Lines of an import CSV with an issue of one article for each
+    (file1, issueCover) given.
+    """
+    lines = [",".join(REQUIRED_COLUMNS) + "\n"]
+    for number, (file1, cover) in enumerate(issues, 1):
+        cells = {'uploader': 'admin', 'title': 'Article %d' % number,
+                 'abstract': '', 'issueCover': cover,
+                 'issueDatepublished': '1975-10-01', 'issueVolume': '17',
+                 'issueNumber': str(number), 'issueYear': '1975',
+                 'issueTitle': 'Issue %d' % number, 'sectionTitle': 'Articles',
+                 'sectionAbbrev': 'ART', 'pages': '1', 'seq': '1',
+                 'file1': file1}
+        lines.append(",".join(cells[name] for name in REQUIRED_COLUMNS) + "\n")
+    return lines
@@ -0,0 +1,59 @@
+import os
+from xml.etree import ElementTree
+from conftest import article_cells
+from ojs_batching import estimate_article_size, plan_batches
+from ojs_conversion import convert_files
+from ojs_reader import read_records
+from ojs_validation import REQUIRED_COLUMNS
+
+PKP = "{http://pkp.sfu.ca}"
+
+
+def issue_rows(issue, count, abstract_size):
+    cells = {'uploader': 'admin', 'abstract': 'x' * abstract_size,
+             'issueCover': '', 'issueDatepublished': '1975-10-01',
+             'issueVolume': '17', 'issueNumber': str(issue),
+             'issueYear': '1975', 'issueTitle': 'Issue %d' % issue,
+             'sectionTitle': 'Articles', 'sectionAbbrev': 'ART', 'pages': '1',
+             'file1': ''}
+    return [",".join(dict(cells, title='Article %d.%d' % (issue, number),
+                          seq=str(number))[name]
+                     for name in REQUIRED_COLUMNS) + "\n"
+            for number in range(1, count + 1)]
+
+
+def test_large_issue_is_split_and_small_ones_are_packed():
+    articles = {'small 1': [article_cells()], 'small 2': [article_cells()],
+                'large': [article_cells(abstract='x' * 3000)
+                          for _ in range(5)]}
+    issues = {key: {'issueTitle': key, 'issueCover': ''} for key in articles}
+    sections = {key: {} for key in articles}
+    size = estimate_article_size(articles['large'][0])
+    batches = plan_batches(issues, sections, articles,
+                           max_bytes=2 * size + 1000)
+    assert [batch.entries for batch in batches] == [
+        [('small 1', 0, 1), ('small 2', 0, 1)],
+        [('large', 0, 2)], [('large', 2, 4)], [('large', 4, 5)]]
+    assert [batch.entries for batch in plan_batches(issues, sections,
+                                                    articles)] \
+        == [[('small 1', 0, 1)], [('small 2', 0, 1)], [('large', 0, 5)]]
+
+
+def test_files_stay_under_max_file_size(tmp_path):
+    lines = ([",".join(REQUIRED_COLUMNS) + "\n"] + issue_rows(1, 3, 100)
+             + issue_rows(2, 40, 2000) + issue_rows(3, 2, 100))
+    files = convert_files(read_records(lines, {'bucket_location': ''}),
+                          output_dir=str(tmp_path), max_file_size=20000,
+                          warn=lambda _: None)
+    assert len(files.output_files) > 4
+    titles = []
+    for output_file in files.output_files:
+        assert os.path.getsize(output_file) <= 20000
+        titles += [title.text for title in ElementTree.parse(
+            output_file).iterfind(".//%spublication/%stitle" % (PKP, PKP))]
+    assert titles == ['Article %d.%d' % (issue, number)
+                      for issue, count in ((1, 3), (2, 40), (3, 2))
+                      for number in range(1, count + 1)]
+    assert [entry['bytes'] for entry in files.manifest['files']] \
+        == [os.path.getsize(output_file)
+            for output_file in files.output_files]
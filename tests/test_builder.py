@@ -0,0 +1,34 @@
+import io
+import os
+import pytest
+from conftest import article_cells
+from ojs_builder import build_article, write_article
+from ojs_writer import XMLStreamWriter
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def expected(name):
+    with open(os.path.join(DATA, name), encoding="utf-8") as xml_file:
+        return xml_file.read()
+
+
+def built(children):
+    output = io.StringIO()
+    XMLStreamWriter(output).element(build_article(children))
+    return output.getvalue()
+
+
+def written(children):
+    output = io.StringIO()
+    write_article(XMLStreamWriter(output), children)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('render', [built, written])
+@pytest.mark.parametrize('values, name', [
+    ({}, "article.xml"),
+    ({'file1': ''}, "article_without_file.xml"),
+])
+def test_article_matches_known_good_xml(render, values, name):
+    assert render(article_cells(**values)) == expected(name)
@@ -0,0 +1,58 @@
+import gzip
+import io
+import os
+import pytest
+import ojs_compression
+from conftest import csv_lines
+from ojs_compression import CompressedWriter, get_codec, open_compressed
+from ojs_conversion import convert_files
+from ojs_reader import read_records
+
+
+class Closing(io.BytesIO):
+    """
+    BytesIO keeping its value once closed.
+    """
+
+    def close(self):
+        self.closed_value = self.getvalue()
+        super().close()
+
+
+def test_writes_are_compressed_in_chunks():
+    text = ["<title>Orgel über alles</title>\n" * 1000] * 20
+    raw = Closing()
+    with CompressedWriter(raw, get_codec("gzip")) as output:
+        for part in text:
+            output.write(part)
+    assert gzip.decompress(raw.closed_value) == "".join(text).encode("utf-8")
+    assert output.uncompressed_bytes == len("".join(text).encode("utf-8"))
+
+
+def test_compressed_files_hold_the_same_bytes(tmp_path):
+    lines = csv_lines(("a.pdf", ""), ("b.pdf", ""))
+    runs = {}
+    for compression in (None, "gzip"):
+        runs[compression] = convert_files(
+            read_records(lines, {'bucket_location': ''}),
+            output_dir=str(tmp_path / str(compression)),
+            compression=compression, warn=lambda _: None)
+    files = runs["gzip"].output_files
+    assert [os.path.basename(name) for name in files] \
+        == ['conversion1.xml.gz', 'conversion2.xml.gz']
+    for plain, compressed in zip(runs[None].output_files, files):
+        with open(plain, 'rb') as plain_file, \
+                open_compressed(compressed) as compressed_file:
+            assert compressed_file.read() == plain_file.read()
+    assert [(entry['compression'], entry['bytes'])
+            for entry in runs["gzip"].manifest['files']] \
+        == [("gzip", os.path.getsize(name)) for name in files]
+
+
+def test_unknown_or_missing_codec_is_an_error(monkeypatch):
+    with pytest.raises(ValueError, match="Unknown compression"):
+        get_codec("brotli")
+    monkeypatch.setattr(ojs_compression, 'zstandard', None)
+    with pytest.raises(ValueError, match="zstandard"):
+        get_codec("zstd")
+    assert get_codec("") is None
@@ -0,0 +1,111 @@
+import base64
+import json
+import os
+from xml.etree import ElementTree
+import pytest
+import ojs_builder
+from conftest import FakePool, csv_lines
+from ojs_conversion import convert_files, read_manifest
+from ojs_preflight import HTTPObjects, LocalFiles, S3Objects, pdf_objects
+from ojs_reader import read_records
+from ojs_validation import ValidationError
+
+PDF_URL = "https://pdfs.example/pdf/"
+COVER_URL = "https://covers.example/pdf/"
+PKP = "{http://pkp.sfu.ca}"
+DEFAULTS = {'bucket_location': PDF_URL}
+
+
+@pytest.fixture
+def stores(monkeypatch):
+    pool = FakePool({PDF_URL + "a.pdf": b"pdf a", PDF_URL + "b.pdf": b"pdf b",
+                     COVER_URL + "a.jpg": b"cover a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    return pool
+
+
+def convert(stores, output_dir, lines, **options):
+    return convert_files(read_records(lines, DEFAULTS),
+                         output_dir=str(output_dir), cover_base_url=COVER_URL,
+                         pdfs=HTTPObjects(PDF_URL, stores), **options)
+
+
+def test_files_and_manifest_are_written(stores, tmp_path):
+    warnings = []
+    files = convert(stores, tmp_path / "out", csv_lines(("a.pdf", "a.jpg"),
+                                                      ("", "a.jpg")),
+                    warn=warnings.append)
+    assert files.output_files == [str(tmp_path / "out" / "conversion1.xml"),
+                                  str(tmp_path / "out" / "conversion2.xml")]
+    assert files.bytes == sum(os.path.getsize(output_file)
+                              for output_file in files.output_files)
+    assert files.covers is None and files.violations == []
+    assert files.conversion.plan is None
+    with open(tmp_path / "out" / "conversion_manifest.json") as manifest:
+        assert json.load(manifest) == files.manifest
+    # The row without a PDF is converted with a warning.
+    assert len(warnings) == 1 and "file1" in warnings[0]
+
+
+def test_incremental_conversion_reads_the_manifest(stores, tmp_path):
+    lines = csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "a.jpg"))
+    convert(stores, tmp_path, lines, incremental=True)
+    files = convert(stores, tmp_path, lines, incremental=True)
+    assert files.output_files == []
+    assert {change: len(issue_keys) for change, issue_keys
+            in files.conversion.plan['changes'].items()}['unchanged'] == 2
+    assert read_manifest(str(tmp_path / "conversion_manifest.json")) \
+        == files.manifest
+    assert read_manifest(str(tmp_path / "missing.json")) is None
+
+
+def test_invalid_rows_write_nothing(stores, tmp_path):
+    with pytest.raises(ValidationError):
+        convert(stores, tmp_path / "out", csv_lines(("a.pdf", "a.jpg"))[:1])
+    assert not (tmp_path / "out").exists()
+
+
+def test_preflight_reports_missing_pdfs_before_writing(stores, tmp_path):
+    with pytest.raises(ValidationError, match="missing.pdf"):
+        convert(stores, tmp_path / "out", csv_lines(("missing.pdf", "a.jpg")),
+                preflight=True)
+    assert not (tmp_path / "out").exists()
+
+
+def test_pdf_objects(s3, tmp_path):
+    assert isinstance(pdf_objects({'pdf_folder': str(tmp_path)}, s3),
+                      LocalFiles)
+    assert isinstance(pdf_objects(DEFAULTS), HTTPObjects)
+    objects = pdf_objects(DEFAULTS, s3, 'bkt', '/pdf/')
+    assert isinstance(objects, S3Objects) and objects.prefix == 'pdf/'
+
+
+def test_embedded_pdfs_are_written_as_base64(stores, tmp_path):
+    folder = tmp_path / "pdfs"
+    folder.mkdir()
+    data = os.urandom(100000)
+    (folder / "a.pdf").write_bytes(data)
+    files = convert_files(
+        read_records(csv_lines(("a.pdf", "a.jpg")),
+                     {'pdf_folder': str(folder)}),
+        output_dir=str(tmp_path / "out"), cover_base_url=COVER_URL,
+        pdfs=LocalFiles(str(folder)))
+    revision = ElementTree.parse(files.output_files[0]).find(
+        ".//" + PKP + "revision")
+    assert revision.find(PKP + "href") is None
+    assert base64.b64decode(revision.find(PKP + "embed").text) == data
+    # Only the cover was downloaded.
+    assert [url for _, url in stores.requests] == [COVER_URL + "a.jpg"]
+
+
+def test_workers_write_the_same_files(stores, tmp_path):
+    lines = csv_lines(("a.pdf", "a.jpg"), ("b.pdf", ""), ("", "a.jpg"),
+                      ("a.pdf", ""))
+    contents = []
+    for workers in (1, 2):
+        files = convert(stores, tmp_path / str(workers), lines,
+                        workers=workers, warn=lambda _: None)
+        contents.append([open(output_file, 'rb').read()
+                         for output_file in files.output_files])
+    assert len(contents[0]) == 4
+    assert contents[0] == contents[1]
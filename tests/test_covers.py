@@ -0,0 +1,197 @@
+import base64
+import pytest
+from conftest import FakePool, FakeResponse
+from ojs_covers import CoverCache, CoverFetchError, CoverFetcher
+
+BASE_URL = "https://covers.example/pdf/"
+
+
+def fetch(pool, cache, cover, **options):
+    with CoverFetcher(BASE_URL, pool=pool, cache=cache, **options) as fetcher:
+        return fetcher.fetch(cover)
+
+
+def test_cached_cover_is_used_without_a_request(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path))
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"cover a").decode()
+    requests = len(pool.requests)
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"cover a").decode()
+    assert len(pool.requests) == requests
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_stale_cover_is_revalidated_without_download(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path), max_age=0)
+    fetch(pool, cache, "a.jpg")
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"cover a").decode()
+    assert pool.count('GET') == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_fresh_cover_is_not_revalidated(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path), max_age=3600)
+    fetch(pool, cache, "a.jpg")
+    pool.files[BASE_URL + "a.jpg"] = b"new cover"
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"cover a").decode()
+    assert pool.count('GET') == 1
+
+
+def test_replaced_cover_is_downloaded_again(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path), max_age=0)
+    fetch(pool, cache, "a.jpg")
+    pool.files[BASE_URL + "a.jpg"] = b"new cover"
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"new cover").decode()
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"new cover").decode()
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_entry_without_time_is_revalidated(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path), max_age=3600)
+    fetch(pool, cache, "a.jpg")
+    path = cache._path(BASE_URL + "a.jpg")
+    with open(path, encoding="ascii") as entry:
+        stamped = entry.read()
+    with open(path, "w", encoding="ascii") as entry:
+        entry.write(stamped.split(" ", 1)[1])
+    pool.files[BASE_URL + "a.jpg"] = b"new cover"
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"new cover").decode()
+
+
+class NoETagPool(FakePool):
+    def request(self, method, url, headers=None, **options):
+        response = super().request(method, url, **options)
+        response.headers.pop('ETag', None)
+        return response
+
+
+def test_cover_without_etag_is_checked_by_length(tmp_path):
+    pool = NoETagPool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path), max_age=0)
+    fetch(pool, cache, "a.jpg")
+    fetch(pool, cache, "a.jpg")
+    assert (pool.count('GET'), pool.count('HEAD')) == (1, 1)
+    pool.files[BASE_URL + "a.jpg"] = b"longer cover"
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(
+        b"longer cover").decode()
+    assert (pool.count('GET'), pool.count('HEAD')) == (2, 2)
+
+
+def test_missing_cover_raises(tmp_path):
+    with pytest.raises(CoverFetchError):
+        fetch(FakePool(), CoverCache(str(tmp_path)), "missing.jpg")
+
+
+def test_put_replacing_an_entry_keeps_the_size(tmp_path):
+    cache = CoverCache(str(tmp_path))
+    cache.put(BASE_URL + "a.jpg", "x" * 100, '"1"')
+    cache.put(BASE_URL + "a.jpg", "y" * 40, '"2"')
+    assert cache.size == CoverCache(str(tmp_path)).size
+    assert cache.get(BASE_URL + "a.jpg") == ('"2"', "y" * 40, False)
+
+
+def test_cache_is_trimmed_to_max_bytes(tmp_path):
+    cache = CoverCache(str(tmp_path), max_bytes=250)
+    for name in "abc":
+        cache.put(BASE_URL + name, name * 100, '"%s"' % name)
+    assert cache.size <= 250
+    assert cache.size == CoverCache(str(tmp_path)).size
+
+
+def test_entry_without_validator_is_downloaded_again(tmp_path):
+    pool = FakePool({BASE_URL + "a.jpg": b"cover a"})
+    cache = CoverCache(str(tmp_path))
+    path = cache._path(BASE_URL + "a.jpg")
+    fetch(pool, cache, "a.jpg")
+    with open(path, "w", encoding="ascii") as entry:
+        entry.write("c3RhbGU=")
+    assert fetch(pool, cache, "a.jpg") == base64.b64encode(b"cover a").decode()
+    assert pool.count('GET') == 2
+
+
+def test_server_error_is_reported(tmp_path):
+    class BrokenPool(FakePool):
+        def request(self, method, url, headers=None, **_):
+            return FakeResponse(500)
+
+    with pytest.raises(CoverFetchError, match="HTTP 500"):
+        fetch(BrokenPool(), CoverCache(str(tmp_path)), "a.jpg")
+
+
+def covers_pool(number):
+    return FakePool({BASE_URL + "%d.jpg" % cover: b"cover %d" % cover
+                     for cover in range(number)})
+
+
+def encoded(cover):
+    return base64.b64encode(b"cover %d" % cover).decode()
+
+
+def settle(fetcher):
+    for future in list(fetcher.futures.values()):
+        future.result()
+
+
+def test_prefetch_downloads_a_window_ahead():
+    pool = covers_pool(50)
+    names = ["%d.jpg" % cover for cover in range(50)]
+    with CoverFetcher(BASE_URL, max_workers=2, pool=pool) as fetcher:
+        fetcher.prefetch(names)
+        settle(fetcher)
+        assert pool.count('GET') == 4
+        for cover, name in enumerate(names):
+            assert fetcher.get(name) == encoded(cover)
+            assert len(fetcher.futures) <= 4
+        assert pool.count('GET') == 50
+        assert not fetcher.futures and not fetcher.waiting
+
+
+def test_cover_of_several_issues_is_downloaded_once():
+    pool = covers_pool(2)
+    with CoverFetcher(BASE_URL, pool=pool) as fetcher:
+        fetcher.prefetch(["0.jpg", "1.jpg", "0.jpg"])
+        assert [fetcher.get(name) for name in ("0.jpg", "1.jpg", "0.jpg")] \
+            == [encoded(0), encoded(1), encoded(0)]
+        assert pool.count('GET') == 2
+        assert not fetcher.references
+
+
+def test_encoded_size_keeps_a_window_of_payloads(tmp_path):
+    pool = covers_pool(10)
+    names = ["%d.jpg" % cover for cover in range(10)]
+    cache = CoverCache(str(tmp_path))
+    with CoverFetcher(BASE_URL, pool=pool, cache=cache,
+                      lookahead=2) as fetcher:
+        fetcher.prefetch(names)
+        sizes = [fetcher.encoded_size(name) for name in names]
+        assert sizes == [len(encoded(cover)) for cover in range(10)]
+        assert len(fetcher.sized) == 2 and len(fetcher.futures) <= 2
+        assert [fetcher.get(name) for name in names] \
+            == [encoded(cover) for cover in range(10)]
+    # Covers released after sizing are read from the cache again rather
+    # than downloaded.
+    assert cache.stats()['hits'] == 8
+    assert pool.count('GET') == 10
+
+
+def test_cover_that_was_not_prefetched_is_fetched_on_get():
+    pool = covers_pool(1)
+    with CoverFetcher(BASE_URL, pool=pool) as fetcher:
+        assert fetcher.get("0.jpg") == encoded(0)
+        assert fetcher.encoded_size("0.jpg") == len(encoded(0))
+        assert fetcher.get("0.jpg") == encoded(0)
+        assert pool.count('GET') == 2
+
+
+def test_missing_prefetched_cover_raises_on_get():
+    with CoverFetcher(BASE_URL, pool=covers_pool(1)) as fetcher:
+        fetcher.prefetch(["0.jpg", "missing.jpg"])
+        assert fetcher.get("0.jpg") == encoded(0)
+        with pytest.raises(CoverFetchError, match="missing.jpg: HTTP 404"):
+            fetcher.get("missing.jpg")
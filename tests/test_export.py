@@ -0,0 +1,107 @@
+import collections
+import csv
+import io
+from ojs_compression import open_compressed
+from ojs_conversion import convert_files
+from ojs_export import read_exports, write_csv
+from ojs_preflight import LocalFiles
+from ojs_reader import read_records
+from ojs_validation import REQUIRED_COLUMNS
+
+AUTHOR_COLUMNS = ('authorGivenname', 'authorFamilyname', 'authorAffiliation',
+                  'authorEmail')
+COLUMNS = REQUIRED_COLUMNS + ('keywords',) + tuple(
+    name + str(number) for number in (1, 2) for name in AUTHOR_COLUMNS)
+
+
+def source_rows():
+    """
+    Two issues of five articles in two sections, the first article of each
+    with a second author.
+    """
+    rows = []
+    for issue in (1, 2):
+        for number in range(1, 6):
+            row = dict.fromkeys(COLUMNS, '')
+            row.update({
+                'uploader': 'admin',
+                'title': 'Article %d.%d' % (issue, number),
+                'abstract': 'Pipes & "reeds" ' * 50,
+                'issueDatepublished': '1975-10-01', 'issueVolume': '17',
+                'issueNumber': str(issue), 'issueYear': '1975',
+                'issueTitle': 'Issue %d' % issue,
+                'sectionTitle': 'Reviews' if number % 2 else 'Articles',
+                'sectionAbbrev': 'REV' if number % 2 else 'ART',
+                'pages': str(number), 'seq': str(number),
+                'file1': 'a%d_%d.pdf' % (issue, number),
+                'keywords': 'organ;console', 'authorGivenname1': 'Ada',
+                'authorFamilyname1': 'Lovelace', 'authorAffiliation1': 'ATOS',
+                'authorEmail1': 'ada@example.org'})
+            if number == 1:
+                row.update(authorGivenname2='Bob',
+                           authorFamilyname2='Organist')
+            rows.append(row)
+    return rows
+
+
+def convert(tmp_path, output_dir, lines, **options):
+    folder = tmp_path / "pdfs"
+    return convert_files(read_records(lines, {'pdf_folder': str(folder)}),
+                         output_dir=str(tmp_path / output_dir),
+                         pdfs=LocalFiles(str(folder)), **options)
+
+
+def converted_rows(tmp_path, rows, **options):
+    folder = tmp_path / "pdfs"
+    folder.mkdir()
+    for row in rows:
+        (folder / row['file1']).write_bytes(row['title'].encode() * 1000)
+    output = io.StringIO(newline='')
+    writer = csv.DictWriter(output, COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    output.seek(0)
+    return convert(tmp_path, "out", output, **options)
+
+
+def test_conversion_files_read_back_as_their_rows(tmp_path):
+    rows = source_rows()
+    files = converted_rows(tmp_path, rows, max_file_size=60000,
+                           compression='gzip')
+    # The issues are split over several compressed files.
+    assert len(files.output_files) > 2
+    stats = collections.Counter()
+    exported = list(read_exports(files.output_files,
+                                 extract_to=str(tmp_path / "extracted"),
+                                 stats=stats))
+    assert (stats['issues'], stats['articles'], stats['files']) \
+        == (2, len(rows), len(rows))
+
+    for row in rows:
+        # Authors without a given name are not converted.
+        if not row['authorGivenname2']:
+            for name in AUTHOR_COLUMNS:
+                del row[name + '2']
+        row.update(prefix='', subtitle='', fileLabel1='PDF',
+                   fileGenre1='Article Text', fileLocale1='en_US')
+    assert exported == rows
+    # The embedded PDFs are decoded under their file names.
+    for row in rows:
+        assert (tmp_path / "extracted" / row['file1']).read_bytes() \
+            == (tmp_path / "pdfs" / row['file1']).read_bytes()
+
+
+def test_exported_csv_converts_to_the_same_files(tmp_path):
+    files = converted_rows(tmp_path, source_rows(), max_file_size=60000)
+    output = io.StringIO(newline='')
+    assert write_csv(read_exports(files.output_files), output) == 10
+    output.seek(0)
+    assert next(csv.reader(output))[-6:] == [
+        'authorAffiliation2', 'authorEmail2', 'file1', 'fileLabel1',
+        'fileGenre1', 'fileLocale1']
+    output.seek(0)
+    again = convert(tmp_path, "again", output, max_file_size=60000)
+    assert len(again.output_files) == len(files.output_files)
+    for first, second in zip(files.output_files, again.output_files):
+        with open_compressed(first) as one, open_compressed(second) as other:
+            assert one.read() == other.read()
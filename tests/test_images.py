@@ -0,0 +1,53 @@
+import base64
+import pickle
+import pytest
+from ojs_builder import build_cover
+from ojs_images import NormalizedCover, cover_file_name, name_mime_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(32)
+JPEG = b"\xff\xd8\xff\xe0" + bytes(32)
+UNKNOWN = b"<svg xmlns=" + bytes(32)
+
+
+def cover(name, payload):
+    element = build_cover({'issueCover': name}, payload)
+    return (element.find('cover/cover_image').text,
+            element.find('cover/embed').get('mime_type'))
+
+
+def encoded(data, normalized=False):
+    payload = base64.b64encode(data).decode('utf-8')
+    return NormalizedCover(payload) if normalized else payload
+
+
+@pytest.mark.parametrize("name,data,expected", [
+    ("cover.png", PNG, ("cover.png", "image/png")),
+    ("cover.png", UNKNOWN, ("cover.png", "image/png")),
+    ("cover.png", JPEG, ("cover.png", "image/png")),
+    ("cover.tif", JPEG, ("cover.tif", "image/tiff")),
+    ("cover", UNKNOWN, ("cover", "image/jpeg")),
+])
+def test_covers_not_normalized_keep_their_name(name, data, expected):
+    assert cover(name, encoded(data)) == expected
+
+
+@pytest.mark.parametrize("name,data,expected", [
+    ("cover.tif", JPEG, ("cover.jpg", "image/jpeg")),
+    ("cover.gif", PNG, ("cover.png", "image/png")),
+    ("cover.JPEG", JPEG, ("cover.JPEG", "image/jpeg")),
+    ("cover.png", UNKNOWN, ("cover.png", "image/png")),
+])
+def test_normalized_covers_are_renamed_to_their_type(name, data, expected):
+    assert cover(name, encoded(data, normalized=True)) == expected
+
+
+def test_normalized_cover_survives_pickling():
+    # Covers are sent to the rendering workers pickled.
+    payload = pickle.loads(pickle.dumps(encoded(JPEG, normalized=True)))
+    assert isinstance(payload, NormalizedCover)
+
+
+def test_names():
+    assert name_mime_type("a.JPG") == "image/jpeg"
+    assert name_mime_type("a.svg") is None
+    assert cover_file_name("a.tiff", "image/jpeg") == "a.jpg"
@@ -0,0 +1,114 @@
+import pytest
+import urllib3
+import ojs_builder
+from conftest import FakePool, csv_lines
+from ojs_conversion import Conversion, convert_files
+from ojs_preflight import HTTPObjects, LocalFiles
+from ojs_reader import read_records
+
+PDF_URL = "https://pdfs.example/pdf/"
+COVER_URL = "https://covers.example/pdf/"
+
+
+def changes(previous, pdfs, lines):
+    conversion = Conversion(read_records(lines, {'bucket_location': PDF_URL}),
+                            cover_base_url=COVER_URL, pdfs=pdfs)
+    manifest = {"files": [{"file": "conversion1.xml", "issues": [
+        {"issueTitle": key, "fingerprint": fingerprint}
+        for key, fingerprint in (previous or {}).items()]}]}
+    plan = conversion.plan_incremental(manifest if previous else None)
+    return conversion.fingerprints, plan['changes']
+
+
+def test_replaced_pdfs_and_covers_change_the_fingerprint(monkeypatch):
+    pool = FakePool({PDF_URL + "a.pdf": b"pdf a", PDF_URL + "b.pdf": b"pdf b",
+                     COVER_URL + "a.jpg": b"cover a",
+                     COVER_URL + "b.jpg": b"cover b"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    lines = csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "b.jpg"))
+    fingerprints, _ = changes(None, HTTPObjects(PDF_URL, pool), lines)
+
+    _, report = changes(fingerprints, HTTPObjects(PDF_URL, pool), lines)
+    assert report['unchanged'] == ["Issue 1", "Issue 2"]
+
+    pool.files[PDF_URL + "b.pdf"] = b"new pdf b"
+    _, report = changes(fingerprints, HTTPObjects(PDF_URL, pool), lines)
+    assert (report['unchanged'], report['changed']) \
+        == (["Issue 1"], ["Issue 2"])
+
+    pool.files[PDF_URL + "b.pdf"] = b"pdf b"
+    pool.files[COVER_URL + "a.jpg"] = b"new cover a"
+    _, report = changes(fingerprints, HTTPObjects(PDF_URL, pool), lines)
+    assert (report['unchanged'], report['changed']) \
+        == (["Issue 2"], ["Issue 1"])
+
+
+def test_preflight_lookups_are_reused_by_the_fingerprints(monkeypatch):
+    pool = FakePool({PDF_URL + "a.pdf": b"pdf a", COVER_URL + "a.jpg": b"a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    conversion = Conversion(
+        read_records(csv_lines(("a.pdf", "a.jpg")),
+                     {'bucket_location': PDF_URL}),
+        cover_base_url=COVER_URL, pdfs=HTTPObjects(PDF_URL, pool))
+    conversion.preflight()
+    assert conversion.fingerprints
+    assert pool.count('HEAD') == 2
+
+
+def test_embedded_pdfs_count_by_size_and_modification_time(tmp_path):
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"pdf")
+    before = LocalFiles(str(tmp_path)).lookup(["a.pdf"])["a.pdf"]
+    path.write_bytes(b"pdf 2")
+    after = LocalFiles(str(tmp_path)).lookup(["a.pdf"])["a.pdf"]
+    assert before[0] == 3 and after[0] == 5
+    assert LocalFiles(str(tmp_path)).lookup(["b.pdf"]) == {"b.pdf": None}
+
+
+class UnreachablePool(FakePool):
+    def request(self, method, url, headers=None, **options):
+        if url.startswith(PDF_URL):
+            raise urllib3.exceptions.MaxRetryError(None, url)
+        return super().request(method, url, headers, **options)
+
+
+def test_plain_conversion_does_not_look_up_the_files(monkeypatch, tmp_path):
+    pool = UnreachablePool({COVER_URL + "a.jpg": b"a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    files = convert_files(
+        read_records(csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "a.jpg")),
+                     {'bucket_location': PDF_URL}),
+        output_dir=str(tmp_path), cover_base_url=COVER_URL,
+        pdfs=HTTPObjects(PDF_URL, pool))
+    assert pool.count('HEAD') == 0
+    assert len(files.manifest["files"]) == 2
+    assert (tmp_path / "conversion_manifest.json").exists()
+
+
+def test_failed_lookup_falls_back_to_names(monkeypatch):
+    pool = UnreachablePool({COVER_URL + "a.jpg": b"a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    lines = csv_lines(("a.pdf", "a.jpg"))
+    conversion = Conversion(read_records(lines, {'bucket_location': PDF_URL}),
+                            cover_base_url=COVER_URL,
+                            pdfs=HTTPObjects(PDF_URL, pool))
+    conversion.looked_up = True
+    names_only = Conversion(read_records(lines, {'bucket_location': PDF_URL}),
+                            cover_base_url=COVER_URL).fingerprints
+    assert conversion.fingerprints == names_only
+    with pytest.raises(urllib3.exceptions.MaxRetryError):
+        conversion.plan_incremental(None)
+
+
+def test_files_looked_up_after_a_plain_run_are_unchanged(monkeypatch):
+    pool = FakePool({PDF_URL + "a.pdf": b"pdf a", COVER_URL + "a.jpg": b"a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    lines = csv_lines(("a.pdf", "a.jpg"))
+    plain = Conversion(read_records(lines, {'bucket_location': PDF_URL}),
+                       cover_base_url=COVER_URL,
+                       pdfs=HTTPObjects(PDF_URL, pool)).fingerprints
+    assert pool.count('HEAD') == 0
+    looked_up, report = changes(plain, HTTPObjects(PDF_URL, pool), lines)
+    assert report['unchanged'] == ["Issue 1"] and looked_up != plain
+    _, report = changes(looked_up, HTTPObjects(PDF_URL, pool), lines)
+    assert report['unchanged'] == ["Issue 1"]
@@ -0,0 +1,68 @@
+import gzip
+import json
+import os
+import pytest
+import convert_journals
+from conftest import csv_lines
+from ojs_conversion import convert_files
+from ojs_reader import read_records
+
+
+def write_csv(path, lines):
+    path.write_text("".join(lines), encoding="utf-8")
+    return str(path)
+
+
+def contents(directory):
+    return {name: (directory / name).read_bytes()
+            for name in sorted(os.listdir(directory))
+            if name.startswith("conversion") and ".xml" in name}
+
+
+def test_each_journal_is_converted_into_its_own_directory(tmp_path):
+    csvs = tmp_path / "csvs"
+    csvs.mkdir()
+    lines = csv_lines(("a.pdf", ""), ("b.pdf", ""))
+    write_csv(csvs / "atos.csv", lines)
+    write_csv(csvs / "broken.csv", lines[:1])
+    config = tmp_path / "journals.json"
+    config.write_text(json.dumps({"journals": [{
+        "input_csv": write_csv(tmp_path / "other.csv", lines),
+        "bucket": "other-bucket", "compression": "gzip"}]}))
+
+    status = convert_journals.main([
+        str(csvs), "--config", str(config), "--output", str(tmp_path / "out"),
+        "--jobs", "3", "--workers", "1"])
+    assert status == 1
+    with open(tmp_path / "out" / "run_summary.json") as summary_file:
+        summary = json.load(summary_file)
+    assert (summary["journals"], summary["converted"], summary["issues"]) \
+        == (3, 2, 4)
+    assert [(result["input_csv"], result["status"])
+            for result in summary["results"]] \
+        == [(str(tmp_path / "other.csv"), "converted"),
+            (str(csvs / "atos.csv"), "converted"),
+            (str(csvs / "broken.csv"), "invalid")]
+    assert "no rows to convert" in summary["results"][2]["error"]
+
+    # A journal converts as generate_xml.py would convert its CSV alone.
+    convert_files(read_records(lines, {
+        'bucket_location': "http://mybucket.s3.amazonaws.com/pdf/"}),
+        output_dir=str(tmp_path / "alone"), warn=lambda _: None)
+    assert contents(tmp_path / "out" / "atos") == contents(tmp_path / "alone")
+    other = contents(tmp_path / "out" / "other")
+    assert sorted(other) == ["conversion1.xml.gz", "conversion2.xml.gz"]
+    assert b"http://other-bucket.s3.amazonaws.com/pdf/a.pdf" \
+        in gzip.decompress(other["conversion1.xml.gz"])
+    assert not (tmp_path / "out" / "broken").exists()
+
+
+def test_journal_settings_are_checked(tmp_path):
+    with pytest.raises(ValueError, match="Unknown journal settings: buckt"):
+        convert_journals.journal_settings(
+            [], {}, str(tmp_path), {"journals": [{"input_csv": "a.csv",
+                                                  "buckt": "x"}]})
+    with pytest.raises(ValueError, match="different output directories"):
+        convert_journals.journal_settings(
+            [str(tmp_path / "a.csv"), str(tmp_path / "x" / "a.csv")], {},
+            str(tmp_path))
@@ -0,0 +1,197 @@
+import gzip
+import json
+import os
+import types
+import pytest
+import lambda_function
+import ojs_builder
+import ojs_fanout
+import ojs_metrics
+from conftest import FakePool, csv_lines
+from ojs_conversion import convert_files
+from ojs_covers import CoverCache
+from ojs_reader import read_records
+
+BUCKET = 'bkt'
+COVER_URL = "https://covers.example/pdf/"
+EVENT = {'Records': [{'s3': {'bucket': {'name': BUCKET}}}]}
+
+
+@pytest.fixture
+def bucket(s3, monkeypatch, tmp_path):
+    """
+    The bucket the Lambda converts csv/import.csv of, with the covers at
+    COVER_URL cached in tmp_path.
+    """
+    monkeypatch.setenv('COVER_BASE_URL', COVER_URL)
+    monkeypatch.setattr(ojs_builder, 'http',
+                        FakePool({COVER_URL + "a.jpg": b"cover a"}))
+    for module in (lambda_function, ojs_fanout):
+        monkeypatch.setattr(module, 's3_client', lambda: s3)
+        monkeypatch.setattr(module, 'environment_cache',
+                            lambda: CoverCache(str(tmp_path / "covers")))
+    return s3
+
+
+def upload_csv(s3, lines):
+    s3.put_object(Bucket=BUCKET, Key='csv/import.csv',
+                  Body="".join(lines).encode('utf-8'))
+
+
+def converted(s3):
+    return {key: stored['Body'] for (_, key), stored in s3.objects.items()
+            if key.startswith('conversion') and key.endswith('.xml')}
+
+
+def local_conversion(lines, directory):
+    """
+    The files generate_xml.py writes for the lines, by file name.
+    """
+    files = convert_files(
+        read_records(lines, {'bucket_location':
+                             "http://bkt.s3.amazonaws.com/pdf/"}),
+        output_dir=str(directory), cover_base_url=COVER_URL,
+        warn=lambda _: None)
+    contents = {}
+    for output_file in files.output_files:
+        with open(output_file, 'rb') as output:
+            contents[output_file.rsplit('/', 1)[1]] = output.read()
+    return contents
+
+
+def test_csv_is_streamed_in_and_files_are_uploaded(bucket, monkeypatch,
+                                                   tmp_path):
+    monkeypatch.setenv('SKIP_UNCHANGED', '0')
+    monkeypatch.setenv('UPLOAD_PART_SIZE', '5')
+    # Enough articles for the first file to take two 5 MB parts.
+    lines = csv_lines(("a.pdf", "a.jpg"), ("b.pdf", ""))
+    cells = lines[1].split(",")
+    lines[1:2] = [",".join(cells[:2] + ["x" * 100000] + cells[3:-2]
+                           + [str(seq), cells[-1]]) for seq in range(1, 61)]
+    upload_csv(bucket, lines)
+    response = lambda_function.lambda_handler(EVENT, None)
+    assert response['statusCode'] == 200
+    assert converted(bucket) == local_conversion(lines, tmp_path)
+    assert bucket.count('upload_part') == 2
+    assert bucket.count('put_object') == 3
+    manifest = json.loads(bucket.objects[
+        (BUCKET, 'conversion_manifest.json')]['Body'])
+    assert [entry['file'] for entry in manifest['files']] \
+        == ['conversion1.xml', 'conversion2.xml']
+
+
+def test_unchanged_files_are_not_uploaded_again(bucket):
+    upload_csv(bucket, csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "")))
+    lambda_function.lambda_handler(EVENT, None)
+    puts = bucket.count('put_object')
+    response = lambda_function.lambda_handler(EVENT, None)
+    assert "Bytes uploaded: 0" in json.loads(response['body'])
+    # Only the manifest is written again.
+    assert bucket.count('put_object') == puts + 1
+
+
+class FakeLambda:
+    """
+    Lambda client keeping the asynchronous invocations until they are run.
+    """
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        assert InvocationType == 'Event'
+        self.invocations.append((FunctionName, json.loads(Payload)))
+
+
+def fanout_csv(s3, monkeypatch):
+    """
+    Upload a CSV of four issues and return the files and manifest a
+    conversion without fan-out gives for it.
+    """
+    monkeypatch.setenv('MAX_FILE_SIZE', '6000')
+    upload_csv(s3, csv_lines(("a.pdf", "a.jpg"), ("b.pdf", ""), ("c.pdf", ""),
+                             ("d.pdf", "a.jpg")))
+    lambda_function.lambda_handler(EVENT, None)
+    expected = converted(s3), s3.objects[(BUCKET, 'conversion_manifest.json')]
+    for key in list(s3.objects):
+        if key[1] != 'csv/import.csv':
+            del s3.objects[key]
+    return expected
+
+
+def manifest_files(stored):
+    return [(entry['file'], entry['bytes'], entry['issues'])
+            for entry in json.loads(stored['Body'])['files']]
+
+
+def test_local_fanout_writes_the_same_files(bucket, monkeypatch):
+    files, manifest = fanout_csv(bucket, monkeypatch)
+    assert len(files) > 1
+    monkeypatch.setenv('FANOUT', 'local')
+    response = lambda_function.lambda_handler(EVENT, None)
+    assert response['statusCode'] == 200
+    assert converted(bucket) == files
+    assert manifest_files(bucket.objects[(BUCKET, 'conversion_manifest.json')]) \
+        == manifest_files(manifest)
+
+
+def test_lambda_fanout_is_aggregated_by_the_last_worker(bucket, monkeypatch):
+    files, manifest = fanout_csv(bucket, monkeypatch)
+    monkeypatch.setenv('FANOUT', 'lambda')
+    invoker = FakeLambda()
+    monkeypatch.setattr(lambda_function, 'LambdaDispatcher',
+                        lambda name: ojs_fanout.LambdaDispatcher(name, invoker))
+    context = types.SimpleNamespace(function_name='ojs', aws_request_id='run')
+    response = lambda_function.lambda_handler(EVENT, context)
+    assert response['statusCode'] == 202
+    assert len(invoker.invocations) == len(files)
+    assert converted(bucket) == {}
+    for name, payload in invoker.invocations:
+        assert name == 'ojs'
+        assert (BUCKET, 'conversion_manifest.json') not in bucket.objects
+        lambda_function.lambda_handler(payload, context)
+    assert converted(bucket) == files
+    assert manifest_files(bucket.objects[(BUCKET, 'conversion_manifest.json')]) \
+        == manifest_files(manifest)
+
+
+def job_process(event, context):
+    return event['ojs_fanout_job'], context, os.getpid()
+
+
+def test_process_pool_runs_the_jobs_in_worker_processes():
+    results = ojs_fanout.ProcessPoolDispatcher(2).dispatch(
+        job_process, [{'ojs_fanout_job': number} for number in range(1, 5)])
+    assert [result[:2] for result in results] \
+        == [(1, None), (2, None), (3, None), (4, None)]
+    assert os.getpid() not in {result[2] for result in results}
+
+
+def test_compressed_files_are_stored_with_their_encoding(bucket, monkeypatch):
+    upload_csv(bucket, csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "")))
+    lambda_function.lambda_handler(EVENT, None)
+    files = converted(bucket)
+    monkeypatch.setenv('COMPRESSION', 'gzip')
+    lambda_function.lambda_handler(EVENT, None)
+    assert {key: gzip.decompress(body)
+            for key, body in converted(bucket).items()} == files
+    assert {bucket.objects[(BUCKET, key)]['ContentEncoding']
+            for key in files} == {'gzip'}
+
+
+def test_metrics_are_logged_and_returned(bucket, monkeypatch, capsys):
+    monkeypatch.setenv('METRICS', '1')
+    upload_csv(bucket, csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "")))
+    response = lambda_function.lambda_handler(
+        EVENT, types.SimpleNamespace(function_name='ojs'))
+    body = json.loads(response['body'])
+    assert "Bytes uploaded" in body['message']
+    assert body['metrics']['counters']['bytes_written'] \
+        == sum(len(data) for data in converted(bucket).values())
+    assert {'read_csv', 'write', 'write_article'} \
+        <= set(body['metrics']['stages'])
+    emf = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert emf['FunctionName'] == 'ojs'
+    assert emf['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'OJSImport'
+    # Recording stops with the invocation.
+    assert ojs_metrics.active() is None
@@ -0,0 +1,59 @@
+import pytest
+import ojs_builder
+import ojs_metrics
+from conftest import FakePool, csv_lines
+from ojs_conversion import convert_files
+from ojs_covers import CoverCache
+from ojs_reader import read_records
+
+COVER_URL = "https://covers.example/pdf/"
+LINES = csv_lines(("a.pdf", "a.jpg"), ("b.pdf", "a.jpg"), ("c.pdf", ""))
+
+
+@pytest.fixture
+def metrics():
+    yield ojs_metrics.enable()
+    ojs_metrics.disable()
+
+
+def convert(tmp_path, output_dir, cache):
+    return convert_files(
+        read_records(LINES, {'bucket_location': "https://pdfs.example/pdf/"}),
+        output_dir=str(tmp_path / output_dir), cover_base_url=COVER_URL,
+        cover_cache=cache, warn=lambda _: None)
+
+
+def test_conversion_records_stages_builders_and_bytes(metrics, tmp_path,
+                                                     monkeypatch):
+    pool = FakePool({COVER_URL + "a.jpg": b"cover a"})
+    monkeypatch.setattr(ojs_builder, 'http', pool)
+    cache = CoverCache(str(tmp_path / "covers"))
+    files = convert(tmp_path, "first", cache)
+    summary = metrics.summary()
+    assert {"read_csv", "validate", "prepare", "plan", "write"} \
+        <= set(summary["stages"])
+    assert summary["stages"]["write_article"]["calls"] == 3
+    assert summary["stages"]["fetch_cover"]["calls"] == 1
+    assert summary["counters"]["bytes_written"] == files.bytes
+    assert summary["counters"]["bytes_fetched"] == len(b"cover a")
+    assert "cover_cache_hits" not in summary["counters"]
+
+    convert(tmp_path, "second", cache)
+    assert metrics.summary()["counters"]["cover_cache_hits"] == 1
+    assert metrics.summary()["stages"]["write_article"]["calls"] == 6
+    assert pool.count('GET') == 1
+
+    document = metrics.emf(dimensions={"FunctionName": "ojs"})
+    names = [metric["Name"] for metric in
+             document["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+    assert "write.Duration" in names and "bytes_written" in names
+    assert document["FunctionName"] == "ojs"
+    assert document["bytes_written"] == 2 * files.bytes
+
+
+def test_nothing_is_recorded_unless_enabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(ojs_builder, 'http',
+                        FakePool({COVER_URL + "a.jpg": b"cover a"}))
+    assert ojs_metrics.active() is None
+    convert(tmp_path, "out", None)
+    assert ojs_metrics.disable() is None
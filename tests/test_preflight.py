@@ -0,0 +1,81 @@
+import ojs_preflight
+from conftest import FakePool
+from ojs_preflight import (HTTPObjects, LocalFiles, S3Objects,
+                           check_references, collect_references)
+from ojs_reader import read_records
+
+BASE_URL = "https://covers.example/pdf/"
+
+
+def records(*rows):
+    lines = ["file1,issueCover\n"] + ["%s,%s\n" % row for row in rows]
+    return list(read_records(lines))
+
+
+def put(s3, key, body):
+    s3.put_object(Bucket='bkt', Key=key, Body=body)
+
+
+def test_collect_references_lists_the_rows_of_each_file():
+    assert collect_references(records(("a.pdf", ""), ("b.pdf", ""),
+                                      ("a.pdf", "")), 'file1') \
+        == {"a.pdf": [2, 4], "b.pdf": [3]}
+
+
+def test_s3_objects_are_looked_up_with_head_requests(s3):
+    put(s3, "pdf/a.pdf", b"pdf")
+    put(s3, "pdf/empty.pdf", b"")
+    sizes = S3Objects(s3, 'bkt', 'pdf/').sizes(
+        ["a.pdf", "empty.pdf", "missing.pdf"])
+    assert sizes == {"a.pdf": 3, "empty.pdf": 0, "missing.pdf": None}
+    assert s3.count('head_object') == 3
+
+
+def test_many_s3_objects_are_listed(s3, monkeypatch):
+    monkeypatch.setattr(ojs_preflight, 'LIST_THRESHOLD', 10)
+    for number in range(2500):
+        put(s3, "pdf/%04d.pdf" % number, b"x" * (number % 3))
+    put(s3, "other/0001.pdf", b"elsewhere")
+    names = ["%04d.pdf" % number for number in range(5, 2000)]
+    names.append("0005a.pdf")
+    sizes = S3Objects(s3, 'bkt', 'pdf/').sizes(names)
+    assert s3.count('head_object') == 0
+    assert s3.count('list_objects_v2') == 2
+    assert sizes["0005a.pdf"] is None
+    assert all(sizes[name] == int(name[:4]) % 3 for name in names[:-1])
+
+
+def test_http_objects_are_looked_up_with_head_requests():
+    pool = FakePool({BASE_URL + "a.jpg": b"cover", BASE_URL + "empty.jpg": b""})
+    sizes = HTTPObjects(BASE_URL, pool).sizes(["a.jpg", "empty.jpg", "b.jpg"])
+    assert sizes == {"a.jpg": 5, "empty.jpg": 0, "b.jpg": None}
+    assert pool.count('HEAD') == 3 and pool.count('GET') == 0
+
+
+def test_local_files(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"pdf")
+    assert LocalFiles(str(tmp_path)).sizes(["a.pdf", "b.pdf"]) \
+        == {"a.pdf": 3, "b.pdf": None}
+
+
+def test_check_references_reports_missing_and_empty_files(s3):
+    put(s3, "pdf/a.pdf", b"pdf")
+    put(s3, "pdf/empty.pdf", b"")
+    pool = FakePool({BASE_URL + "a.jpg": b"cover"})
+    problems = check_references(
+        records(("a.pdf", "a.jpg"), ("missing.pdf", "a.jpg"),
+                ("empty.pdf", "b.jpg"), ("missing.pdf", "b.jpg")),
+        S3Objects(s3, 'bkt', 'pdf/'), HTTPObjects(BASE_URL, pool))
+    assert [(problem.rows, problem.column) for problem in problems] \
+        == [((3, 5), 'file1'), ((4,), 'file1'), ((4, 5), 'issueCover')]
+    assert problems[0].message \
+        == "'missing.pdf' does not exist at s3://bkt/pdf/missing.pdf"
+    assert problems[1].message \
+        == "'empty.pdf' is empty at s3://bkt/pdf/empty.pdf"
+    assert all(problem.severity == 'error' for problem in problems)
+
+
+def test_covers_are_not_checked_without_a_store(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"pdf")
+    assert check_references(records(("a.pdf", "missing.jpg")),
+                            LocalFiles(str(tmp_path))) == []
@@ -0,0 +1,107 @@
+import csv
+import pickle
+from ojs_builder import build_sections
+from ojs_reader import index_issues, number_articles, read_records
+
+
+def section_row(issue, title, abbrev):
+    return {'issueTitle': issue, 'issueYear': '1975', 'issueVolume': '17',
+            'issueNumber': '1', 'issueDatepublished': '1975-10-01',
+            'issueCover': '', 'sectionTitle': title, 'sectionAbbrev': abbrev}
+
+
+def test_each_section_is_listed_once_in_order_of_appearance():
+    rows = [section_row('Vol 1', 'Reviews', 'REV'),
+            section_row('Vol 1', 'Articles', 'ART'),
+            section_row('Vol 1', 'Reviews', 'REV'),
+            section_row('Vol 2', 'Articles', 'ART'),
+            section_row('Vol 1', 'Articles', 'ART'),
+            section_row('Vol 2', 'Articles', 'ART')]
+    _, sections, articles = index_issues(rows)
+    assert list(sections['Vol 1']) == ['REV', 'ART']
+    assert list(sections['Vol 2']) == ['ART']
+    assert [len(articles[issue]) for issue in articles] == [4, 2]
+
+    built = build_sections(sections['Vol 1'])
+    assert [(section.get('ref'), section.findtext('id'),
+             section.findtext('title')) for section in built] \
+        == [('REV', '1', 'Reviews'), ('ART', '2', 'Articles')]
+
+
+def test_title_with_another_abbreviation_is_another_section():
+    rows = [section_row('Vol 1', 'Articles', 'ART'),
+            section_row('Vol 1', 'Articles', 'ART2'),
+            section_row('Vol 1', 'Articles', 'ART')]
+    _, sections, _ = index_issues(rows)
+    assert list(sections['Vol 1']) == ['ART', 'ART2']
+    assert [section.findtext('abbrev')
+            for section in build_sections(sections['Vol 1'])] \
+        == ['ART', 'ART2']
+
+
+def test_rows_are_grouped_by_issue_in_one_pass():
+    rows = [section_row('Vol 2', 'Articles', 'ART'),
+            section_row('Vol 1', 'Articles', 'ART'),
+            section_row('Vol 2', 'Reviews', 'REV'),
+            section_row('Vol 3', 'Articles', 'ART'),
+            section_row('Vol 1', 'Articles', 'ART')]
+    rows[4]['issueCover'] = 'other.jpg'
+    issues, sections, articles = index_issues(iter(rows))
+    assert list(issues) == list(sections) == list(articles) \
+        == ['Vol 2', 'Vol 1', 'Vol 3']
+    # The rows are kept as they are, in their order within each issue.
+    assert articles['Vol 1'][0] is rows[1] and articles['Vol 1'][1] is rows[4]
+    assert [len(articles[issue]) for issue in articles] == [2, 2, 1]
+    # The issue takes the metadata of its first row.
+    assert issues['Vol 1']['issueCover'] == ''
+    assert issues['Vol 2'] == {
+        'issueYear': '1975', 'issueVolume': '17', 'issueNumber': '1',
+        'issueDatepublished': '1975-10-01', 'issueTitle': 'Vol 2',
+        'issueCover': ''}
+
+
+def prepared_dict(row, file_number, bucket_location):
+    """
+    The dictionary the drivers used to fill in for each csv.DictReader row,
+    with the emails of the authors the CSV has columns for.
+    """
+    row = dict(row)
+    for name in list(row):
+        if name and name.startswith('authorGivenname'):
+            row.setdefault('authorEmail' + name[len('authorGivenname'):], '')
+    row.setdefault('submission_stage', 'submission')
+    row.setdefault('revision_number', '1')
+    if row['fileGenre1'] == '':
+        row['fileGenre1'] = 'Article Text'
+    for name in ('authorFamilyname1', 'authorGivenname1'):
+        if not row.get(name):
+            row[name] = 'Unknown'
+    row['bucket_location'] = bucket_location
+    row['file_number'] = str(file_number)
+    return row
+
+
+def test_records_read_like_the_prepared_rows():
+    header = ("title,issueTitle,issueCover,fileGenre1,authorGivenname1,"
+              "authorFamilyname1,authorGivenname2,authorFamilyname2,"
+              "authorEmail2\n")
+    lines = [header, "One,Vol 1,,,,,Bob,Organist,bob@example.org\n", "\n",
+             "Two,Vol 1,,Review,Ada,Lovelace,,,,extra cell\n",
+             "Three,Vol 2,,,Cy\n"]
+    location = {'bucket_location': 'https://bucket.example/pdf/'}
+    records = list(read_records(lines, location))
+    number_articles({'all': None}, {'all': records})
+
+    expected = [prepared_dict(row, number, location['bucket_location'])
+                for number, row in enumerate(csv.DictReader(lines), 1)]
+    # csv.DictReader keeps the extra cell under None and the missing cells
+    # of a short row as None.
+    del expected[1][None]
+    assert [dict(record) for record in records] == expected
+    assert [record.row for record in records] == [2, 4, 5]
+    assert records[2]['authorGivenname2'] is None
+    assert len(records[0]) == len(expected[0])
+    assert 'file_number' in records[0] and 'pdf_folder' not in records[0]
+    # Values repeated on every row of an issue are kept once.
+    assert records[0]['issueTitle'] is records[1]['issueTitle']
+    assert dict(pickle.loads(pickle.dumps(records[1]))) == expected[1]
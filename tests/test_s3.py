@@ -0,0 +1,90 @@
+import io
+import os
+import pytest
+from ojs_s3 import MIN_PART_SIZE, S3UploadStream, iter_lines
+
+MB = 1024 * 1024
+
+
+def chunks(sizes):
+    return [os.urandom(size) for size in sizes]
+
+
+@pytest.mark.parametrize("skip_unchanged", [False, True])
+def test_uneven_writes_upload_every_byte(s3, skip_unchanged):
+    data = chunks([4 * MB, 3 * MB, int(4.9 * MB), 12 * MB, 17])
+    with S3UploadStream(s3, 'bucket', 'conversion1.xml',
+                        part_size=MIN_PART_SIZE,
+                        skip_unchanged=skip_unchanged) as upload:
+        for chunk in data:
+            upload.write(chunk)
+    stored = s3.objects[('bucket', 'conversion1.xml')]
+    assert stored['Body'] == b''.join(data)
+    assert upload.bytes_written == len(stored['Body'])
+    assert upload.uploaded is True
+
+
+def test_changed_object_is_uploaded_again(s3):
+    for data in (chunks([4 * MB, 3 * MB, int(4.9 * MB)]),
+                 chunks([int(4.9 * MB), 4 * MB, 3 * MB])):
+        with S3UploadStream(s3, 'bucket', 'conversion1.xml',
+                            part_size=MIN_PART_SIZE,
+                            skip_unchanged=True) as upload:
+            for chunk in data:
+                upload.write(chunk)
+        assert upload.uploaded is True
+        assert s3.objects[('bucket', 'conversion1.xml')]['Body'] \
+            == b''.join(data)
+
+
+@pytest.mark.parametrize("sizes", [[100], [4 * MB, 3 * MB, int(4.9 * MB)]])
+def test_unchanged_object_is_not_uploaded(s3, sizes):
+    data = chunks(sizes)
+    # Uploaded without skip_unchanged there is no sha256 in the metadata,
+    # the output is compared with the object's ETag.
+    for skip_unchanged in (False, True):
+        with S3UploadStream(s3, 'bucket', 'conversion1.xml',
+                            part_size=MIN_PART_SIZE,
+                            skip_unchanged=skip_unchanged) as upload:
+            for chunk in data:
+                upload.write(chunk)
+    assert upload.uploaded is False
+    assert s3.count('put_object') + s3.count('create_multipart_upload') == 1
+
+
+def test_different_content_type_is_uploaded(s3):
+    for content_encoding in (None, 'gzip'):
+        with S3UploadStream(s3, 'bucket', 'conversion1.xml',
+                            content_encoding=content_encoding,
+                            skip_unchanged=True) as upload:
+            upload.write(b'<issues/>')
+        assert upload.uploaded is True
+    assert s3.objects[('bucket', 'conversion1.xml')]['ContentEncoding'] \
+        == 'gzip'
+
+
+def test_text_is_encoded(s3):
+    with S3UploadStream(s3, 'bucket', 'conversion1.xml') as upload:
+        upload.write('<title>Théâtre</title>')
+    assert s3.objects[('bucket', 'conversion1.xml')]['Body'] \
+        == '<title>Théâtre</title>'.encode('utf-8')
+
+
+def test_failure_aborts_the_upload(s3):
+    with pytest.raises(RuntimeError):
+        with S3UploadStream(s3, 'bucket', 'conversion1.xml',
+                            part_size=MIN_PART_SIZE) as upload:
+            upload.write(os.urandom(6 * MB))
+            raise RuntimeError("rendering failed")
+    assert s3.count('abort_multipart_upload') == 1
+    assert ('bucket', 'conversion1.xml') not in s3.objects
+    assert not s3.uploads
+
+
+def test_iter_lines_across_chunks():
+    text = 'issueTitle,title\r\n"Vol 1","Théâtre\rorgan"\nlast'
+    lines = list(iter_lines(io.BytesIO(('﻿' + text).encode('utf-8')),
+                            chunk_size=3))
+    assert ''.join(lines) == text
+    assert lines[-1] == 'last'
+    assert len(lines) == 3
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import pytest
+from conftest import csv_lines
+from ojs_conversion import convert_files
+from ojs_reader import read_records
+from ojs_service import (ConversionService, DirectoryWatcher, QueueFull,
+                         ServiceServer)
+
+LINES = csv_lines(("a.pdf", ""), ("b.pdf", ""))
+
+
+def contents(directory):
+    return {name: (directory / name).read_bytes()
+            for name in sorted(os.listdir(directory))
+            if name.startswith("conversion") and ".xml" in name}
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # The cover cache is made in the working directory.
+    monkeypatch.chdir(tmp_path)
+    with ConversionService(output_root=str(tmp_path / "out"), jobs=1,
+                           workers=1, max_queued=2,
+                           status_file=str(tmp_path / "status.json")) \
+            as conversion_service:
+        yield conversion_service
+
+
+def test_jobs_convert_like_generate_xml(service, tmp_path):
+    (tmp_path / "atos.csv").write_text("".join(LINES), encoding="utf-8")
+    (tmp_path / "broken.csv").write_text(LINES[0], encoding="utf-8")
+    # Holding the output directory of the first job keeps it and the one
+    # behind it waiting, so a third does not fit in the queue.
+    lock = service._output_lock(str(tmp_path / "out" / "atos"))
+    with lock:
+        first = service.submit(str(tmp_path / "atos.csv"))
+        second = service.submit(str(tmp_path / "broken.csv"))
+        assert (first["status"], second["status"]) == ("queued", "queued")
+        with pytest.raises(QueueFull):
+            service.submit(str(tmp_path / "atos.csv"), name="again")
+    service.join()
+
+    convert_files(read_records(LINES, {
+        'bucket_location': "http://mybucket.s3.amazonaws.com/pdf/"}),
+        output_dir=str(tmp_path / "alone"), warn=lambda _: None)
+    assert contents(tmp_path / "out" / "atos") == contents(tmp_path / "alone")
+    assert [(job["name"], job["status"]) for job in service.list_jobs()] \
+        == [("atos", "converted"), ("broken", "invalid")]
+    assert service.job(first["id"])["latency_seconds"] \
+        >= service.job(first["id"])["queue_seconds"]
+    assert service.job("404") is None
+
+    status = service.status()
+    assert (status["queue_depth"], status["running"]) == (0, 0)
+    assert status["counts"] == {"submitted": 2, "converted": 1, "invalid": 1}
+    assert status["latency_seconds"]["jobs"] == 2
+    with open(tmp_path / "status.json") as status_file:
+        assert json.load(status_file)["counts"] == status["counts"]
+
+
+def test_watched_csvs_are_submitted_once_complete(service, tmp_path):
+    incoming = tmp_path / "incoming"
+    incoming.mkdir()
+    (incoming / "atos.csv").write_text("".join(LINES), encoding="utf-8")
+    watcher = DirectoryWatcher(service, str(incoming))
+    # The first poll only sees the CSV, the second finds it unchanged.
+    assert watcher.poll() == []
+    assert [job["name"] for job in watcher.poll()] == ["atos"]
+    assert watcher.poll() == []
+    service.join()
+    assert sorted(contents(tmp_path / "out" / "atos")) \
+        == ["conversion1.xml", "conversion2.xml"]
+
+
+def request(url, data=None):
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_uploaded_csvs_are_converted(service, tmp_path):
+    server = ServiceServer(("127.0.0.1", 0), service, str(tmp_path / "up"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+        status, job = request(url + "/jobs?name=atos",
+                              "".join(LINES).encode("utf-8"))
+        assert (status, job["name"]) == (202, "atos")
+        assert request(url + "/jobs?name=../x", b"")[0] == 400
+        service.join()
+        status, job = request(url + "/jobs/" + job["id"])
+        assert (status, job["status"], job["issues"]) == (200, "converted", 2)
+        assert request(url + "/jobs/404")[0] == 404
+        assert request(url + "/status")[1]["counts"]["converted"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    # The upload is removed once converted.
+    assert os.listdir(tmp_path / "up") == []
+    assert len(contents(tmp_path / "out" / "atos")) == 2
@@ -0,0 +1,95 @@
+import csv
+import pytest
+from ojs_reader import read_records, read_rows
+from ojs_validation import (ERROR, REQUIRED_COLUMNS, WARNING, ValidationError,
+                            validate, validate_records)
+
+HEADER = ",".join(REQUIRED_COLUMNS)
+
+
+def row(**values):
+    cells = {'uploader': 'admin', 'title': 'An article', 'abstract': '',
+             'issueCover': '', 'issueDatepublished': '1975-10-01',
+             'issueVolume': '17', 'issueNumber': '10', 'issueYear': '1975',
+             'issueTitle': 'Vol 17', 'sectionTitle': 'Articles',
+             'sectionAbbrev': 'ART', 'pages': '1', 'seq': '1',
+             'file1': 'a.pdf'}
+    cells.update(values)
+    return cells
+
+
+def csv_records(*rows, header=HEADER):
+    lines = [header + "\n"]
+    lines += [",".join(cells[name] for name in REQUIRED_COLUMNS) + "\n"
+              for cells in rows]
+    return list(read_records(lines))
+
+
+def problems_of(records):
+    return [(problem.rows, problem.column, problem.severity)
+            for problem in validate_records(records)]
+
+
+def test_valid_rows_have_no_problems():
+    assert problems_of(csv_records(row(), row(seq='2'))) == []
+
+
+@pytest.mark.parametrize('lines', [[], [HEADER + "\n"], ["a,b,c\n"]])
+def test_csv_without_rows_is_an_error(lines):
+    with pytest.raises(ValidationError, match="no rows to convert"):
+        validate(list(read_records(lines)))
+
+
+def test_missing_columns_are_errors():
+    header = HEADER.replace(",seq", "")
+    records = list(read_records([header + "\n", "x" * 3 + "\n"]))
+    assert ((1,), 'seq', ERROR) in problems_of(records)
+
+
+def test_empty_title_and_file_are_warnings():
+    records = csv_records(row(title=''), row(seq='2', file1=''))
+    assert problems_of(records) == [((2,), 'title', WARNING),
+                                    ((3,), 'file1', WARNING)]
+    assert len(validate(records)) == 2
+
+
+def test_empty_section_is_an_error():
+    assert problems_of(csv_records(row(sectionTitle=''))) \
+        == [((2,), 'sectionTitle', ERROR)]
+
+
+def test_title_with_several_abbreviations_is_a_warning():
+    records = csv_records(row(), row(seq='2', sectionAbbrev='ART2'))
+    assert problems_of(records) == [((2, 3), 'sectionAbbrev', WARNING)]
+
+
+def test_abbreviation_with_several_titles_is_an_error():
+    records = csv_records(row(), row(seq='2', sectionTitle='Reviews'))
+    assert problems_of(records) == [((2, 3), 'sectionAbbrev', ERROR)]
+
+
+def test_dates_and_sequences_are_checked():
+    records = csv_records(row(issueDatepublished='10/01/1975'), row())
+    assert ((2,), 'issueDatepublished', ERROR) in problems_of(records)
+    assert ((2, 3), 'seq', ERROR) in problems_of(records)
+
+
+def test_rows_are_read_by_their_own_columns():
+    first = row()
+    second = dict(reversed(list(row(seq='2', file1='').items())))
+    third = row(seq='3')
+    del third['pages']
+    records = list(read_rows([first, second, third]))
+    assert problems_of(records) == [((3,), 'file1', WARNING),
+                                    ((4,), 'pages', ERROR)]
+
+
+def test_short_rows_of_a_dict_reader_are_empty_values():
+    lines = [HEADER + "\n",
+             ",".join(row()[name] for name in REQUIRED_COLUMNS) + "\n",
+             "admin,Short row\n"]
+    records = list(read_rows(csv.DictReader(lines)))
+    found = problems_of(records)
+    assert ((3,), 'issueDatepublished', ERROR) in found
+    assert ((3,), 'issueTitle', WARNING) in found
+    assert not [problem for problem in found if problem[1] == 'seq']
@@ -0,0 +1,74 @@
+import base64
+import io
+import xml.dom.minidom
+from xml.etree import ElementTree
+from conftest import article_cells
+from ojs_builder import (build_article, build_date_published,
+                         build_identification, build_issue_galleys,
+                         build_issue_id, build_sections)
+from ojs_pipeline import publication_status, write_issue
+from ojs_writer import (PKP_NAMESPACE, SCHEMA_LOCATION, XSI_NAMESPACE,
+                        EmbeddedFile, XMLStreamWriter)
+
+ISSUE = {'issueYear': '1975', 'issueVolume': '17', 'issueNumber': '10',
+         'issueDatepublished': '1975-10-01', 'issueTitle': 'Vol 17 "No" 10',
+         'issueCover': ''}
+SECTIONS = {'ART': {'sectionTitle': 'Articles & Reviews',
+                    'sectionAbbrev': 'ART'}}
+
+
+def pretty(root):
+    """
+    The document as the original scripts wrote it, through minidom.
+    """
+    return xml.dom.minidom.parseString(
+        ElementTree.tostring(root)).toprettyxml()
+
+
+def test_issue_document_matches_minidom():
+    articles = [article_cells(),
+                article_cells(file_number='8', seq='4', file1='',
+                              title='<Pipes> & "reeds"',
+                              abstract='First line\r\nsecond line\rthird')]
+    root = ElementTree.Element("issues", {
+        "xmlns": PKP_NAMESPACE, "xmlns:xsi": XSI_NAMESPACE,
+        "xsi:schemaLocation": SCHEMA_LOCATION})
+    issue = ElementTree.SubElement(root, "issue", {
+        "current": "0", "published": str(publication_status(ISSUE))})
+    issue.extend([build_issue_id(1), build_identification(ISSUE),
+                  build_date_published(ISSUE), build_sections(SECTIONS),
+                  build_issue_galleys()])
+    ElementTree.SubElement(issue, "articles").extend(
+        build_article(article) for article in articles)
+
+    output = io.StringIO()
+    writer = XMLStreamWriter(output)
+    writer.start_document()
+    write_issue(writer, 1, ISSUE, SECTIONS, articles)
+    writer.end_document()
+    assert output.getvalue() == pretty(root)
+
+
+def test_mixed_content_matches_minidom():
+    root = ElementTree.fromstring(
+        '<issues a="&amp; &quot;quoted&quot;">lead<b>bold</b>tail'
+        '<empty/><c><d/>after d</c>end</issues>')
+    output = io.StringIO()
+    XMLStreamWriter(output).element(root)
+    assert output.getvalue() == pretty(root).split("\n", 1)[1]
+
+
+
+def test_embedded_file_is_written_as_base64(tmp_path):
+    data = bytes(range(256)) * (EmbeddedFile.CHUNK_SIZE // 128 + 1)
+    path = tmp_path / "article.pdf"
+    path.write_bytes(data)
+    embed = ElementTree.Element("embed", {"encoding": "base64"})
+    embed.text = EmbeddedFile(str(path))
+    output = io.StringIO()
+    XMLStreamWriter(output).element(embed)
+
+    expected = ElementTree.Element("embed", {"encoding": "base64"})
+    expected.text = base64.b64encode(data).decode("ascii")
+    assert output.getvalue() == pretty(expected).split("\n", 1)[1]
+    assert embed.text.encoded_size == len(expected.text)
@@ -0,0 +1,129 @@
+import pytest
+import lambda_function
+import ojs_xsd
+
+pytest.importorskip("lxml")
+
+# Laid out like the PKP schemas: native.xsd includes pkp-native.xsd by its
+# path in an OJS installation, issue and article are not global elements
+# and an issue needs an article.
+NATIVE_XSD = """<schema xmlns="http://www.w3.org/2001/XMLSchema"
+        xmlns:pkp="http://pkp.sfu.ca" targetNamespace="http://pkp.sfu.ca"
+        elementFormDefault="qualified">
+  <include schemaLocation="../../../lib/pkp/plugins/importexport/native/pkp-native.xsd"/>
+  <element name="issues">
+    <complexType><sequence>
+      <element name="issue" maxOccurs="unbounded">
+        <complexType><sequence>
+          <element name="date_published" type="date"/>
+          <element name="articles">
+            <complexType><sequence>
+              <element name="article" maxOccurs="unbounded">
+                <complexType><sequence>
+                  <element name="id" type="pkp:nonEmptyString"/>
+                  <element name="pages" type="int"/>
+                </sequence></complexType>
+              </element>
+            </sequence></complexType>
+          </element>
+        </sequence></complexType>
+      </element>
+    </sequence></complexType>
+  </element>
+</schema>
+"""
+
+PKP_NATIVE_XSD = """<schema xmlns="http://www.w3.org/2001/XMLSchema"
+        targetNamespace="http://pkp.sfu.ca" elementFormDefault="qualified">
+  <simpleType name="nonEmptyString">
+    <restriction base="string"><minLength value="1"/></restriction>
+  </simpleType>
+</schema>
+"""
+
+
+@pytest.fixture
+def schema_file(tmp_path):
+    (tmp_path / "native.xsd").write_text(NATIVE_XSD)
+    (tmp_path / "pkp-native.xsd").write_text(PKP_NATIVE_XSD)
+    return str(tmp_path / "native.xsd")
+
+
+def document(*issues):
+    parts = ['<issues xmlns="http://pkp.sfu.ca">\n']
+    for date, pages in issues:
+        parts.append("<issue>\n<date_published>%s</date_published>\n"
+                     "<articles>\n" % date)
+        for number, page in enumerate(pages, 1):
+            parts.append("<article><id>%d</id><pages>%s</pages></article>\n"
+                         % (number, page))
+        parts.append("</articles>\n</issue>\n")
+    parts.append("</issues>\n")
+    return "".join(parts)
+
+
+def violations(schema_file, text, chunk_size=None):
+    validator = ojs_xsd.StreamValidator("conversion1.xml", schema_file)
+    chunk_size = chunk_size or len(text)
+    for start in range(0, len(text), chunk_size):
+        validator.feed(text[start:start + chunk_size])
+    return [(violation.path, violation.file_number, violation.line)
+            for violation in validator.close()]
+
+
+def test_valid_document_has_no_violations(schema_file):
+    text = document(("1975-10-01", ["1", "2"]), ("1975-11-01", ["3"]))
+    assert violations(schema_file, text) == []
+    assert violations(schema_file, text, chunk_size=7) == []
+
+
+def test_article_violation_is_reported_once_with_its_path(schema_file):
+    text = document(("1975-10-01", ["1"]), ("1975-11-01", ["2", "3", "x"]))
+    assert violations(schema_file, text) == [
+        ("/issues/issue[2]/articles/article[3]/pages", "3", 13)]
+
+
+def test_issue_violation_is_reported_once(schema_file):
+    text = document(("October", ["1", "2", "3"]))
+    assert violations(schema_file, text, chunk_size=16) == [
+        ("/issues/issue[1]/date_published", None, 3)]
+
+
+def test_issue_without_articles_is_reported(schema_file):
+    found = violations(schema_file, document(("1975-10-01", [])))
+    assert [(path, file_number) for path, file_number, _ in found] \
+        == [("/issues/issue[1]/articles", None)]
+
+
+def test_checked_articles_are_dropped(schema_file):
+    validator = ojs_xsd.StreamValidator("conversion1.xml", schema_file)
+    text = document(("1975-10-01", [str(page) for page in range(50)]))
+    validator.feed(text[:text.index("</articles>")])
+    root = next(iter(validator.labels)).getroottree().getroot()
+    assert len(root.findall(".//{http://pkp.sfu.ca}article")) == 1
+    assert validator.close() != []
+
+
+def test_syntax_error_stops_the_check(schema_file):
+    found = violations(schema_file, "<issues xmlns='http://pkp.sfu.ca'><issue>"
+                       "</issues>")
+    assert len(found) == 1
+
+
+def test_missing_schemas_name_their_downloads(monkeypatch):
+    monkeypatch.setitem(ojs_xsd.SCHEMA_SOURCES, "missing.xsd",
+                        "https://schemas.example/missing.xsd")
+    ojs_xsd.load_schema.cache_clear()
+    with pytest.raises(ValueError, match="schemas.example/missing.xsd"):
+        ojs_xsd.load_schema()
+
+
+def test_lambda_without_schemas_returns_400(monkeypatch):
+    monkeypatch.setenv('VALIDATE_XML', '1')
+    monkeypatch.setitem(ojs_xsd.SCHEMA_SOURCES, "missing.xsd",
+                        "https://schemas.example/missing.xsd")
+    ojs_xsd.load_schema.cache_clear()
+    response = lambda_function.lambda_handler(
+        {'Records': [{'s3': {'bucket': {'name': 'bkt'}}}]}, None)
+    assert response['statusCode'] == 400
+    assert "missing.xsd" in response['body']